@@ -0,0 +1,68 @@
+import hmac
+import hashlib
+from fastapi import Header, HTTPException, Depends, Request
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from pydantic import ValidationError
+
+from config import LARAVEL_BEARER_TOKEN, NOTIFY_SECRET, EBOT_API_TOKEN, EBOT_HMAC_SECRET, EBOT_MAX_BODY_SIZE
+from models import EbotEvent
+
+# Security
+security = HTTPBearer()
+
+async def verify_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Проверка Bearer token"""
+    if credentials.credentials != LARAVEL_BEARER_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid authentication token")
+    return credentials.credentials
+
+async def verify_legacy_api_key(x_api_key: str = Header(default=None)):
+    """Проверка X-API-Key для обратной совместимости"""
+    if x_api_key != NOTIFY_SECRET:
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    return x_api_key
+
+async def verify_ebot_event(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    x_signature: str = Header(default=None),
+    x_signature_alg: str = Header(default=None)
+) -> EbotEvent:
+    """
+    Bearer token + HMAC подпись eBot webhook за один проход по телу:
+    тело читается потоком с ограничением EBOT_MAX_BODY_SIZE, подпись считается
+    по мере чтения, затем байты разбираются сразу в модель EbotEvent
+    """
+    if credentials.credentials != EBOT_API_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid authentication token")
+    
+    if not x_signature or not x_signature_alg:
+        raise HTTPException(status_code=401, detail="Missing signature headers")
+    
+    if x_signature_alg != "HMAC-SHA256":
+        raise HTTPException(status_code=401, detail="Unsupported signature algorithm")
+    
+    # Заведомо большое тело отклоняем до чтения
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > EBOT_MAX_BODY_SIZE:
+        raise HTTPException(status_code=413, detail="Request body too large")
+    
+    signer = hmac.new(EBOT_HMAC_SECRET.encode(), digestmod=hashlib.sha256)
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > EBOT_MAX_BODY_SIZE:
+            raise HTTPException(status_code=413, detail="Request body too large")
+        signer.update(chunk)
+        chunks.append(chunk)
+    
+    provided_signature = x_signature.replace("sha256=", "")
+    if not hmac.compare_digest(signer.hexdigest(), provided_signature):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    
+    # Разбор JSON парсером pydantic-core прямо в модель, без промежуточного dict
+    try:
+        return EbotEvent.model_validate_json(b"".join(chunks))
+    except ValidationError:
+        raise HTTPException(status_code=400, detail="Invalid event structure")
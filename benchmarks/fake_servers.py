@@ -0,0 +1,164 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+
+class FakeServer:
+    """
+    Локальный HTTP сервер с управляемой задержкой и ошибками:
+    latency (+ случайная добавка до jitter) секунд на ответ,
+    доля ответов 429 (flood_rate) с retry_after и доля ответов 500 (fail_rate)
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        flood_rate: float = 0.0,
+        retry_after: int = 1,
+        fail_rate: float = 0.0
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.fail_rate = fail_rate
+        self.calls = Counter()
+        self.url = None
+        self._runner = None
+
+    def routes(self, app: web.Application):
+        raise NotImplementedError
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        self.routes(app)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _delay(self):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def _fault(self) -> str:
+        """'flood', 'fail' или '' по заданным долям"""
+        roll = random.random()
+        if roll < self.flood_rate:
+            return "flood"
+        if roll < self.flood_rate + self.fail_rate:
+            return "fail"
+        return ""
+
+
+class FakeTelegram(FakeServer):
+    """
+    Фейковый Bot API: /bot<token>/<method>, ответы в формате Telegram.
+    Ошибки подмешиваются только в методы отправки сообщений, служебные
+    вызовы (getMe, setWebhook, getUpdates) всегда успешны
+    """
+
+    def routes(self, app):
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = await self._params(request)
+        await self._delay()
+
+        fault = self._fault() if self._is_message_method(method) else ""
+        if fault == "flood":
+            self.calls["429"] += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}
+            })
+        if fault == "fail":
+            self.calls["500"] += 1
+            return web.json_response(
+                {"ok": False, "error_code": 500, "description": "Internal Server Error"},
+                status=500
+            )
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    @staticmethod
+    def _is_message_method(method: str) -> bool:
+        return method.lower().startswith(("send", "edit", "copy", "forward")) or method.lower() == "deletemessage"
+
+    @staticmethod
+    async def _params(request):
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post())
+
+    @staticmethod
+    def _result(method: str, params: dict):
+        method = method.lower()
+        if method == "getupdates":
+            return []
+        if method == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method in ("sendmessage", "editmessagetext"):
+            return {
+                "message_id": random.randint(1, 2 ** 31),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+                "text": params.get("text", "")
+            }
+        return True
+
+
+class FakeLaravel(FakeServer):
+    """Фейковый Laravel API: любой путь отвечает {"success": true}"""
+
+    def routes(self, app):
+        app.router.add_route("*", "/{path:.*}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.calls[request.path] += 1
+        await request.read()
+        await self._delay()
+
+        fault = self._fault()
+        if fault == "flood":
+            self.calls["429"] += 1
+            return web.json_response(
+                {"success": False, "message": "Too Many Attempts."},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)}
+            )
+        if fault == "fail":
+            self.calls["500"] += 1
+            return web.json_response({"success": False, "message": "Server Error"}, status=500)
+        return web.json_response({"success": True, "data": {}})
+
+
+if __name__ == "__main__":
+    # Ручной запуск фейков: python benchmarks/fake_servers.py
+    async def serve():
+        telegram = FakeTelegram(latency=0.05)
+        laravel = FakeLaravel(latency=0.02)
+        print(json.dumps({
+            "TELEGRAM_API_SERVER": await telegram.start(port=8081),
+            "API_URL": await laravel.start(port=8082)
+        }))
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
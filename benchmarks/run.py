@@ -0,0 +1,352 @@
+"""
+Нагрузочный прогон main:app против локальных фейков Telegram Bot API и Laravel API
+
+    python benchmarks/run.py --scenario notify --rps 200 --duration 20
+    python benchmarks/run.py --scenario all --save-baseline
+
+Результат пишется в benchmarks/results/<scenario>.json и сравнивается
+с benchmarks/baselines/<scenario>.json (если есть); при регрессии
+сильнее --tolerance код возврата 1
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import aiohttp
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_servers import FakeTelegram, FakeLaravel
+
+ROOT = Path(__file__).resolve().parents[1]
+BASELINES_DIR = Path(__file__).resolve().parent / "baselines"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+SCENARIOS = ("notify", "notify-webhook", "notify-legacy", "telegram-webhook")
+
+# Учётные данные, с которыми запускается бот под нагрузкой
+BOT_TOKEN = "123456:BENCHMARK"
+BEARER_TOKEN = "bench-bearer"
+NOTIFY_SECRET = "bench-legacy"
+HMAC_SECRET = "bench-hmac"
+TELEGRAM_SECRET = "bench-telegram"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def order_data(n: int) -> dict:
+    return {
+        "order_id": f"BENCH-{n}",
+        "vehicle_type": "Экскаватор",
+        "location": "Москва, ул. Тестовая, 1",
+        "date_time": "01.01.2026 10:00",
+        "price": "50 000 ₽"
+    }
+
+
+def build_request(scenario: str, n: int, run_id: str):
+    """(path, body bytes, headers) для n-го запроса сценария"""
+    telegram_id = str(100000 + n % 1000)
+    headers = {"Content-Type": "application/json"}
+
+    if scenario == "notify":
+        body = {"telegram_id": telegram_id, "order_data": order_data(n)}
+        headers["Authorization"] = f"Bearer {BEARER_TOKEN}"
+        path = "/notify"
+    elif scenario == "notify-webhook":
+        body = {
+            "event_data": {"telegram_id": telegram_id, "order_data": order_data(n)},
+            "correlation_id": f"{run_id}-{n}",
+            "idempotency_key": f"{run_id}-{n}"
+        }
+        headers["Authorization"] = f"Bearer {BEARER_TOKEN}"
+        path = "/notify-webhook"
+    elif scenario == "notify-legacy":
+        body = {"telegram_id": telegram_id, "text": f"Заявка #{n}", "url": f"https://example.invalid/{n}"}
+        headers["X-API-Key"] = NOTIFY_SECRET
+        path = "/notify-legacy"
+    elif scenario == "telegram-webhook":
+        user = {"id": int(telegram_id), "is_bot": False, "first_name": "Bench"}
+        body = {
+            "update_id": n + 1,
+            "message": {
+                "message_id": n + 1,
+                "date": int(time.time()),
+                "chat": {"id": int(telegram_id), "type": "private"},
+                "from": user,
+                "text": "/id",
+                "entities": [{"type": "bot_command", "offset": 0, "length": 3}]
+            }
+        }
+        headers["X-Telegram-Bot-Api-Secret-Token"] = TELEGRAM_SECRET
+        path = "/telegram/webhook"
+    else:
+        raise ValueError(f"Неизвестный сценарий: {scenario}")
+
+    raw = json.dumps(body, ensure_ascii=False).encode()
+    if scenario == "notify-webhook":
+        headers["X-Signature"] = "sha256=" + hmac.new(HMAC_SECRET.encode(), raw, hashlib.sha256).hexdigest()
+        headers["X-Signature-Alg"] = "HMAC-SHA256"
+    return path, raw, headers
+
+
+def read_memory(pid: int) -> dict:
+    """RSS и пиковый RSS процесса в МБ (Linux /proc); пусто на других ОС"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return {}
+    return {
+        key: round(int(fields[name].split()[0]) / 1024, 1)
+        for key, name in (("rss_mb", "VmRSS"), ("peak_rss_mb", "VmHWM"))
+        if name in fields
+    }
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class BotProcess:
+    """main:app в отдельном процессе uvicorn с окружением на фейки"""
+
+    def __init__(self, telegram_url: str, laravel_url: str, workdir: str, extra_env: dict = None):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.workdir = workdir
+        self.env = {
+            **os.environ,
+            "PYTHONPATH": str(ROOT),
+            "BOT_TOKEN": BOT_TOKEN,
+            "TELEGRAM_API_SERVER": telegram_url,
+            "API_URL": laravel_url,
+            "LARAVEL_BEARER_TOKEN": BEARER_TOKEN,
+            "NOTIFY_SECRET": NOTIFY_SECRET,
+            "WEBHOOK_SECRET": HMAC_SECRET,
+            "TELEGRAM_WEBHOOK_SECRET": TELEGRAM_SECRET,
+            "TELEGRAM_WEBHOOK_URL": f"{self.url}/telegram/webhook",
+            "LOG_LEVEL": "WARNING",
+            "LOG_FILE": os.path.join(workdir, "bot.log"),
+            **(extra_env or {})
+        }
+        self.process = None
+
+    async def start(self, timeout: float = 30):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--log-level", "warning", "--no-access-log"],
+            cwd=self.workdir,
+            env=self.env
+        )
+        deadline = time.monotonic() + timeout
+        async with aiohttp.ClientSession() as session:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"Бот завершился при запуске, код {self.process.returncode}")
+                try:
+                    async with session.get(f"{self.url}/livez") as response:
+                        if response.status == 200:
+                            return
+                except aiohttp.ClientError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise RuntimeError("Бот не поднялся за отведённое время")
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+async def drive(url: str, scenario: str, rps: float, duration: float, concurrency: int, offset: int) -> dict:
+    """
+    Открытая модель нагрузки: запрос n планируется на момент start + n / rps,
+    задержка считается от запланированного момента (без coordinated omission)
+    """
+    run_id = f"{int(time.time())}-{os.getpid()}"
+    total = int(rps * duration)
+    latencies = []
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        async def one(n: int, scheduled: float):
+            path, body, headers = build_request(scenario, offset + n, run_id)
+            async with semaphore:
+                try:
+                    async with session.post(url + path, data=body, headers=headers) as response:
+                        await response.read()
+                        statuses[str(response.status)] += 1
+                except aiohttp.ClientError as e:
+                    statuses[type(e).__name__] += 1
+            latencies.append(time.monotonic() - scheduled)
+
+        start = time.monotonic()
+        tasks = []
+        for n in range(total):
+            scheduled = start + n / rps
+            delay = scheduled - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(one(n, scheduled)))
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - start
+
+    latencies.sort()
+    ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+    return {
+        "requests": total,
+        "ok": ok,
+        "statuses": dict(statuses),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(ok / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round(latencies[-1] * 1000, 2) if latencies else 0.0
+        }
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Список регрессий относительно базовой линии"""
+    regressions = []
+    base_throughput = baseline["throughput_rps"]
+    if base_throughput and result["throughput_rps"] < base_throughput * (1 - tolerance):
+        regressions.append(f"throughput {result['throughput_rps']} < {base_throughput} rps")
+    for key in ("p50", "p95", "p99"):
+        current, base = result["latency_ms"][key], baseline["latency_ms"][key]
+        if base and current > base * (1 + tolerance):
+            regressions.append(f"{key} {current} > {base} ms")
+    current, base = result.get("memory", {}).get("peak_rss_mb"), baseline.get("memory", {}).get("peak_rss_mb")
+    if current and base and current > base * (1 + tolerance):
+        regressions.append(f"peak_rss {current} > {base} MB")
+    return regressions
+
+
+async def run_scenario(args, scenario: str) -> dict:
+    telegram = FakeTelegram(
+        latency=args.tg_latency,
+        jitter=args.tg_jitter,
+        flood_rate=args.tg_flood_rate,
+        retry_after=args.tg_retry_after,
+        fail_rate=args.tg_fail_rate
+    )
+    laravel = FakeLaravel(
+        latency=args.laravel_latency,
+        jitter=args.laravel_jitter,
+        flood_rate=args.laravel_flood_rate,
+        retry_after=args.laravel_retry_after,
+        fail_rate=args.laravel_fail_rate
+    )
+    extra_env = dict(item.split("=", 1) for item in args.env)
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        bot = BotProcess(await telegram.start(), await laravel.start(), workdir, extra_env)
+        try:
+            await bot.start()
+            if args.warmup:
+                await drive(bot.url, scenario, args.rps, args.warmup, args.concurrency, offset=0)
+            memory_before = read_memory(bot.process.pid)
+            # update_id растут монотонно: замер идёт после прогрева, иначе окно дедупликации их отбросит
+            result = await drive(bot.url, scenario, args.rps, args.duration, args.concurrency, offset=10 ** 6)
+            result["memory"] = {"before": memory_before, **read_memory(bot.process.pid)}
+        finally:
+            bot.stop()
+            await telegram.stop()
+            await laravel.stop()
+
+    result["scenario"] = scenario
+    result["params"] = {
+        key: value for key, value in vars(args).items()
+        if key not in ("scenario", "save_baseline", "tolerance")
+    }
+    result["fake_calls"] = {"telegram": dict(telegram.calls), "laravel": dict(laravel.calls)}
+    result["host"] = {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()}
+    return result
+
+
+async def main_async(args) -> int:
+    scenarios = SCENARIOS if args.scenario == "all" else (args.scenario,)
+    RESULTS_DIR.mkdir(exist_ok=True)
+    failed = False
+
+    for scenario in scenarios:
+        result = await run_scenario(args, scenario)
+        latency = result["latency_ms"]
+        print(
+            f"📊 {scenario}: {result['ok']}/{result['requests']} ok, "
+            f"{result['throughput_rps']} rps, p50={latency['p50']} p95={latency['p95']} "
+            f"p99={latency['p99']} ms, peak RSS={result['memory'].get('peak_rss_mb')} MB, "
+            f"statuses={result['statuses']}"
+        )
+        (RESULTS_DIR / f"{scenario}.json").write_text(json.dumps(result, indent=2, ensure_ascii=False))
+
+        baseline_file = BASELINES_DIR / f"{scenario}.json"
+        if args.save_baseline:
+            BASELINES_DIR.mkdir(exist_ok=True)
+            baseline_file.write_text(json.dumps(result, indent=2, ensure_ascii=False))
+            print(f"💾 Базовая линия сохранена: {baseline_file}")
+        elif baseline_file.exists():
+            baseline = json.loads(baseline_file.read_text())
+            if baseline["params"] != result["params"]:
+                print(f"⚠️ {scenario}: параметры прогона отличаются от базовой линии, сравнение пропущено")
+                continue
+            regressions = compare(result, baseline, args.tolerance)
+            for regression in regressions:
+                print(f"❌ Регрессия {scenario}: {regression}")
+            failed = failed or bool(regressions)
+
+    return 1 if failed else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота против фейков Telegram и Laravel")
+    parser.add_argument("--scenario", choices=SCENARIOS + ("all",), default="all")
+    parser.add_argument("--rps", type=float, default=100, help="Целевая частота запросов")
+    parser.add_argument("--duration", type=float, default=10, help="Длительность прогона, с")
+    parser.add_argument("--warmup", type=float, default=2, help="Прогрев перед замером, с")
+    parser.add_argument("--concurrency", type=int, default=200, help="Максимум запросов в полёте")
+    parser.add_argument("--tg-latency", type=float, default=0.03)
+    parser.add_argument("--tg-jitter", type=float, default=0.02)
+    parser.add_argument("--tg-flood-rate", type=float, default=0.0, help="Доля ответов 429 от Telegram")
+    parser.add_argument("--tg-retry-after", type=int, default=1)
+    parser.add_argument("--tg-fail-rate", type=float, default=0.0, help="Доля ответов 500 от Telegram")
+    parser.add_argument("--laravel-latency", type=float, default=0.02)
+    parser.add_argument("--laravel-jitter", type=float, default=0.01)
+    parser.add_argument("--laravel-flood-rate", type=float, default=0.0)
+    parser.add_argument("--laravel-retry-after", type=int, default=1)
+    parser.add_argument("--laravel-fail-rate", type=float, default=0.0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Дополнительные переменные окружения бота (например SEND_QUEUE_ENABLED=true)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Допустимое ухудшение относительно базовой линии")
+    parser.add_argument("--save-baseline", action="store_true", help="Сохранить результат как базовую линию")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main_async(parse_args())))
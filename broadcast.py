@@ -0,0 +1,192 @@
+import asyncio
+import logging
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup
+
+from circuit_breaker import UpstreamUnavailableError
+from dead_recipients import dead_recipient_reason
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class BroadcastEngine:
+    """
+    Рассылка сообщения всем подписчикам из таблицы users.
+    send_func сам отмечает недоступные чаты (DeadRecipientRegistry.record),
+    рассылка их только подсчитывает.
+    Пользователи читаются порциями по ключу, отправка идёт параллельно
+    под общим лимитером, прогресс сохраняется после каждой порции,
+    поэтому прерванная рассылка продолжается с места остановки.
+    При нескольких воркерах рассылки выполняет только владелец аренды фоновых
+    задач (watch): он раз в poll_interval подхватывает рассылки, созданные
+    другими воркерами, а отмена через таблицу broadcasts видна всем
+    """
+
+    def __init__(
+        self,
+        storage,
+        send_func,
+        limiter: TokenBucket,
+        concurrency: int = 20,
+        chunk_size: int = 500,
+        max_retries: int = 3,
+        poll_interval: float = 5.0
+    ):
+        self.storage = storage
+        self.send_func = send_func
+        self.limiter = limiter
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.poll_interval = poll_interval
+        self._tasks = {}
+        self._watch_task = None
+
+    async def start(self, text: str, reply_markup: InlineKeyboardMarkup = None) -> int:
+        """
+        Создаёт рассылку и возвращает её id. Отправка идёт в фоне: сразу,
+        если этот процесс ведёт рассылки, иначе её подхватит владелец аренды
+        """
+        markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+        broadcast_id = await self.storage.create_broadcast(text, markup)
+        if self._watch_task is not None:
+            self._spawn(await self.storage.get_broadcast(broadcast_id))
+            logger.info(f"📣 Запущена рассылка {broadcast_id}")
+        else:
+            logger.info(f"📣 Создана рассылка {broadcast_id}, её запустит владелец аренды фоновых задач")
+        return broadcast_id
+
+    def watch(self):
+        """Продолжает прерванные рассылки и подхватывает новые (только у владельца аренды)"""
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    async def _watch(self):
+        while True:
+            try:
+                await self.resume()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка проверки рассылок: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def resume(self):
+        """Продолжает рассылки, прерванные остановкой процесса"""
+        for broadcast in await self.storage.get_broadcasts(status="running"):
+            if broadcast["id"] not in self._tasks:
+                logger.info(f"🔄 Продолжаем рассылку {broadcast['id']} с user_id > {broadcast['last_user_id']}")
+                self._spawn(broadcast)
+
+    async def stop(self):
+        """Останавливает рассылки этого процесса; прогресс остаётся в таблице broadcasts"""
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            await asyncio.gather(self._watch_task, return_exceptions=True)
+            self._watch_task = None
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        task = self._tasks.get(broadcast_id)
+        broadcast = await self.storage.get_broadcast(broadcast_id)
+        if broadcast is None or broadcast["status"] != "running":
+            return False
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        # Рассылка другого воркера остановится на следующей контрольной точке
+        return await self.storage.checkpoint_broadcast(broadcast_id, broadcast["last_user_id"], status="cancelled")
+
+    def _spawn(self, broadcast: dict):
+        task = asyncio.create_task(self._run(broadcast))
+        self._tasks[broadcast["id"]] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast["id"], None))
+
+    async def _run(self, broadcast: dict):
+        broadcast_id = broadcast["id"]
+        text = broadcast["text"]
+        reply_markup = (
+            InlineKeyboardMarkup.model_validate_json(broadcast["reply_markup"])
+            if broadcast["reply_markup"] else None
+        )
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send_one(user_id: int):
+            async with semaphore:
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        await self.limiter.acquire()
+                        await self.send_func(user_id, text, reply_markup=reply_markup)
+                        return "sent"
+                    except TelegramRetryAfter as e:
+                        await asyncio.sleep(e.retry_after)
+                    except UpstreamUnavailableError as e:
+                        # Telegram недоступен целиком: это не ошибка получателя
+                        return e
+                    except Exception as e:
+                        reason = dead_recipient_reason(e)
+                        if reason:
+                            return reason
+                        logger.warning(f"Рассылка {broadcast_id}: ошибка отправки {user_id}: {e}")
+                        if attempt < self.max_retries:
+                            await asyncio.sleep(2 ** attempt)
+                return "failed"
+
+        try:
+            async for chunk in self.storage.iter_user_ids(broadcast["last_user_id"], self.chunk_size):
+                results = {}
+                pending = chunk
+                while pending:
+                    outcomes = await asyncio.gather(*(send_one(user_id) for user_id in pending))
+                    results.update(
+                        (user_id, outcome) for user_id, outcome in zip(pending, outcomes)
+                        if not isinstance(outcome, UpstreamUnavailableError)
+                    )
+                    unavailable = [outcome for outcome in outcomes if isinstance(outcome, UpstreamUnavailableError)]
+                    if not unavailable:
+                        break
+                    # Контрольная точка стоит на месте, пока порция не разослана целиком
+                    pending = [user_id for user_id in pending if user_id not in results]
+                    delay = max(1.0, max(e.retry_after for e in unavailable))
+                    logger.warning(
+                        f"⏸ Рассылка {broadcast_id}: Telegram недоступен ({unavailable[0]}), "
+                        f"{len(pending)} получателей порции ждут {delay:.1f}с"
+                    )
+                    await asyncio.sleep(delay)
+                    current = await self.storage.get_broadcast(broadcast_id)
+                    if current is None or current["status"] != "running":
+                        logger.info(f"🛑 Рассылка {broadcast_id} отменена, отправка остановлена")
+                        return
+                outcomes = [results[user_id] for user_id in chunk]
+                # Всё, кроме sent/failed, — причина недоступности чата; в users чат
+                # уже отметил DeadRecipientRegistry внутри send_func
+                removed = len(outcomes) - outcomes.count("sent") - outcomes.count("failed")
+                if removed:
+                    logger.info(f"Рассылка {broadcast_id}: отключено {removed} недоступных пользователей")
+                running = await self.storage.checkpoint_broadcast(
+                    broadcast_id,
+                    chunk[-1],
+                    sent=outcomes.count("sent"),
+                    failed=outcomes.count("failed"),
+                    removed=removed
+                )
+                if not running:
+                    logger.info(f"🛑 Рассылка {broadcast_id} отменена, отправка остановлена")
+                    return
+            final = await self.storage.get_broadcast(broadcast_id)
+            if not await self.storage.checkpoint_broadcast(broadcast_id, final["last_user_id"], status="completed"):
+                logger.info(f"🛑 Рассылка {broadcast_id} отменена, отправка остановлена")
+                return
+            logger.info(
+                f"✅ Рассылка {broadcast_id} завершена: отправлено {final['sent']}, "
+                f"ошибок {final['failed']}, удалено {final['removed']}"
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Рассылка {broadcast_id} прервана: {e}")
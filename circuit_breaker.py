@@ -0,0 +1,315 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+import aiohttp
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+from aiogram.methods import GetUpdates
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Исходы вызова внешнего сервиса
+OK = "ok"
+OVERLOAD = "overload"  # сервис жив, но просит снизить нагрузку (429)
+FAILURE = "failure"    # сетевая ошибка, таймаут или 5xx
+
+# Числовое состояние автомата для метрики
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class UpstreamUnavailableError(Exception):
+    """Вызов отклонён без обращения к сервису; повторить не раньше retry_after секунд"""
+
+    def __init__(self, upstream: str, retry_after: float, message: str):
+        super().__init__(f"{upstream}: {message}")
+        self.upstream = upstream
+        self.retry_after = max(0.0, retry_after)
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(upstream, retry_after, f"автомат разомкнут, повтор через {retry_after:.1f}с")
+
+
+class ConcurrencyLimitError(UpstreamUnavailableError):
+    def __init__(self, upstream: str, limit: int):
+        super().__init__(upstream, 1.0, f"превышен лимит одновременных запросов ({limit})")
+
+
+class CircuitBreaker:
+    """
+    Автомат по скользящему окну вызовов за window секунд. Если в окне не меньше
+    min_calls вызовов и доля ошибок (включая ответы дольше slow_call секунд)
+    достигла failure_rate, автомат размыкается: open_timeout секунд вызовы
+    отклоняются сразу. Затем пропускаются half_open_calls пробных вызовов:
+    успех замыкает автомат, ошибка снова размыкает
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = 0.5,
+        min_calls: int = 20,
+        window: float = 30.0,
+        open_timeout: float = 15.0,
+        slow_call: float = 5.0,
+        half_open_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = max(1, min_calls)
+        self.window = window
+        self.open_timeout = open_timeout
+        self.slow_call = slow_call
+        self.half_open_calls = max(1, half_open_calls)
+        self.clock = clock
+        self.state = CLOSED
+        self.opened_at = None
+        self.opened_count = 0
+        self._calls = deque()
+        self._failures = 0
+        self._probes = 0
+        metrics.CIRCUIT_STATE.labels(name).set(STATE_VALUES[CLOSED])
+
+    def allow(self):
+        """Проверка перед вызовом; при разомкнутом автомате — CircuitOpenError"""
+        if self.state == OPEN:
+            remaining = self.opened_at + self.open_timeout - self.clock()
+            if remaining > 0:
+                self._reject(remaining)
+            self._transition(HALF_OPEN)
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_calls:
+                self._reject(1.0)
+            self._probes += 1
+
+    def record(self, failed: bool, duration: float = 0.0):
+        """Результат вызова, пропущенного allow()"""
+        failed = failed or duration >= self.slow_call
+        if self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+            if failed:
+                self._open()
+            else:
+                self._transition(CLOSED)
+            return
+        if self.state == OPEN:
+            # Поздний ответ на вызов, начатый до размыкания
+            return
+
+        now = self.clock()
+        self._calls.append((now, failed))
+        self._failures += failed
+        while self._calls and now - self._calls[0][0] > self.window:
+            _, old_failed = self._calls.popleft()
+            self._failures -= old_failed
+        if len(self._calls) >= self.min_calls and self._failures / len(self._calls) >= self.failure_rate:
+            self._open()
+
+    def cancel(self):
+        """Вызов, пропущенный allow(), не состоялся: освобождает слот пробы без решения"""
+        if self.state == HALF_OPEN:
+            self._probes = max(0, self._probes - 1)
+
+    def _reject(self, retry_after: float):
+        metrics.CIRCUIT_REJECTED.labels(self.name, "circuit_open").inc()
+        raise CircuitOpenError(self.name, retry_after)
+
+    def _open(self):
+        self.opened_at = self.clock()
+        self.opened_count += 1
+        self._transition(OPEN)
+        logger.warning(f"🔌 {self.name}: автомат разомкнут на {self.open_timeout:.0f}с")
+
+    def _transition(self, state: str):
+        if state == CLOSED and self.state != CLOSED:
+            logger.info(f"✅ {self.name}: автомат замкнут")
+        self.state = state
+        self._probes = 0
+        if state != OPEN:
+            self._calls.clear()
+            self._failures = 0
+        metrics.CIRCUIT_STATE.labels(self.name).set(STATE_VALUES[state])
+
+    def snapshot(self) -> dict:
+        calls = len(self._calls)
+        return {
+            "state": self.state,
+            "calls": calls,
+            "failure_rate": round(self._failures / calls, 3) if calls else 0.0,
+            "opened_count": self.opened_count
+        }
+
+
+class AdaptiveLimiter:
+    """
+    AIMD лимит одновременных запросов: быстрый успешный ответ (не дольше
+    latency_target) увеличивает лимит на 1/limit, то есть примерно на единицу
+    за каждый «круг» запросов; ошибка, 429 или медленный ответ умножают лимит
+    на backoff. Снижение срабатывает не чаще одного раза на поколение запросов:
+    запросы, начатые до предыдущего снижения, лимит больше не трогают.
+    Запрос сверх лимита ждёт освобождения не дольше max_wait секунд
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_limit: int,
+        min_limit: int = 1,
+        initial: Optional[int] = None,
+        latency_target: float = 1.0,
+        backoff: float = 0.5,
+        max_wait: float = 5.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(initial if initial is not None else self.max_limit)
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.clock = clock
+        self.inflight = 0
+        self._waiters = deque()
+        self._decreased_at = float("-inf")
+        self._publish()
+
+    async def acquire(self) -> float:
+        """Занимает слот; возвращает момент начала запроса для release()"""
+        if self.inflight < int(self.limit) and not self._waiters:
+            self.inflight += 1
+            self._publish()
+            return self.clock()
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.max_wait)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже передан, но ожидание отменено: возвращаем его
+                self.inflight -= 1
+                self._wake()
+                self._publish()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.CIRCUIT_REJECTED.labels(self.name, "concurrency").inc()
+                raise ConcurrencyLimitError(self.name, int(self.limit))
+            raise
+        return self.clock()
+
+    def release(self, started: float, outcome: str):
+        self.inflight -= 1
+        duration = self.clock() - started
+        if outcome == OK and duration <= self.latency_target:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        elif started >= self._decreased_at:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            self._decreased_at = self.clock()
+        self._wake()
+        self._publish()
+
+    def _wake(self):
+        # Слот передаётся ожидающему сразу, чтобы новый запрос его не перехватил
+        while self._waiters and self.inflight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.inflight += 1
+
+    def _publish(self):
+        metrics.CONCURRENCY_LIMIT.labels(self.name).set(int(self.limit))
+        metrics.CONCURRENCY_INFLIGHT.labels(self.name).set(self.inflight)
+
+    def snapshot(self) -> dict:
+        return {"limit": int(self.limit), "inflight": self.inflight, "waiting": len(self._waiters)}
+
+
+class GuardedCall:
+    """Исход вызова; клиент выставляет outcome по ответу (например, 5xx)"""
+
+    __slots__ = ("outcome",)
+
+    def __init__(self):
+        self.outcome = None
+
+
+class UpstreamGuard:
+    """
+    Автомат и адаптивный лимит одного внешнего сервиса:
+
+        async with guard.call() as call:
+            response = await ...
+            if response.status >= 500:
+                call.outcome = FAILURE
+
+    Исключение внутри блока классифицирует classify(error) -> OK/OVERLOAD/FAILURE
+    """
+
+    def __init__(self, breaker: CircuitBreaker, limiter: AdaptiveLimiter, classify: Callable[[BaseException], str]):
+        self.name = breaker.name
+        self.breaker = breaker
+        self.limiter = limiter
+        self.classify = classify
+
+    @asynccontextmanager
+    async def call(self):
+        self.breaker.allow()
+        try:
+            started = await self.limiter.acquire()
+        except BaseException:
+            self.breaker.cancel()
+            raise
+        call = GuardedCall()
+        try:
+            yield call
+        except BaseException as e:
+            if call.outcome is None:
+                call.outcome = self.classify(e)
+            raise
+        finally:
+            outcome = call.outcome or OK
+            duration = self.limiter.clock() - started
+            self.limiter.release(started, outcome)
+            self.breaker.record(outcome == FAILURE, duration)
+
+    def snapshot(self) -> dict:
+        return {**self.breaker.snapshot(), **self.limiter.snapshot()}
+
+
+def telegram_outcome(error: BaseException) -> str:
+    """Ошибки Bot API: 429 — перегрузка, сеть и 5xx — сбой, остальное — ответ живого сервиса"""
+    if isinstance(error, TelegramRetryAfter):
+        return OVERLOAD
+    if isinstance(error, (TelegramNetworkError, TelegramServerError, aiohttp.ClientError, asyncio.TimeoutError)):
+        return FAILURE
+    return OK
+
+
+def laravel_outcome(error: BaseException) -> str:
+    if isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError)):
+        return FAILURE
+    return OK
+
+
+class TelegramGuardMiddleware(BaseRequestMiddleware):
+    """Middleware сессии aiogram: все вызовы Bot API, кроме long polling, идут через guard"""
+
+    def __init__(self, guard: UpstreamGuard):
+        self.guard = guard
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+        async with self.guard.call():
+            return await make_request(bot, method)
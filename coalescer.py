@@ -0,0 +1,99 @@
+import asyncio
+import logging
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from circuit_breaker import UpstreamUnavailableError
+from models import OrderData
+from send_queue import PERMANENT_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationCoalescer:
+    """
+    Склейка уведомлений о заказах по получателю: первая заявка открывает окно
+    в window секунд, всё, что пришло за это время, уходит одним сообщением.
+    Окно закрывается раньше, если набралось max_orders заявок.
+    flush(telegram_id, orders) вызывается с заявками в порядке поступления.
+    Эндпоинт к этому моменту уже ответил 202, поэтому неудачная отправка
+    повторяется до max_attempts раз: после retry_after Telegram или автомата,
+    иначе с backoff от retry_delay; ошибки получателя не повторяются
+    """
+
+    def __init__(
+        self,
+        flush,
+        window: float = 5.0,
+        max_orders: int = 10,
+        max_attempts: int = 3,
+        retry_delay: float = 1.0
+    ):
+        self.flush = flush
+        self.window = window
+        self.max_orders = max(1, max_orders)
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self._pending = {}
+        self._timers = {}
+        self._flushing = set()
+
+    def add(self, telegram_id: str, order_data: OrderData) -> int:
+        """Добавляет заявку в окно получателя; возвращает число заявок в окне"""
+        orders = self._pending.setdefault(telegram_id, {})
+        # Повтор того же заказа в окне заменяет прежние данные
+        orders.pop(order_data.order_id, None)
+        orders[order_data.order_id] = order_data
+        count = len(orders)
+
+        if count >= self.max_orders:
+            self._spawn(self._flush(telegram_id))
+        elif telegram_id not in self._timers:
+            self._timers[telegram_id] = self._spawn(self._flush_later(telegram_id))
+        return count
+
+    def pending(self) -> int:
+        return sum(len(orders) for orders in self._pending.values())
+
+    async def stop(self):
+        """Отправляет все открытые окна без ожидания их истечения"""
+        for timer in list(self._timers.values()):
+            timer.cancel()
+        self._timers.clear()
+        for telegram_id in list(self._pending):
+            await self._flush(telegram_id)
+        await asyncio.gather(*self._flushing, return_exceptions=True)
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+        return task
+
+    async def _flush_later(self, telegram_id: str):
+        await asyncio.sleep(self.window)
+        await self._flush(telegram_id)
+
+    async def _flush(self, telegram_id: str):
+        timer = self._timers.pop(telegram_id, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+        orders = self._pending.pop(telegram_id, None)
+        if not orders:
+            return
+        orders = list(orders.values())
+        for attempt in range(self.max_attempts):
+            try:
+                await self.flush(telegram_id, orders)
+                return
+            except (TelegramRetryAfter, UpstreamUnavailableError) as e:
+                error, delay = e, e.retry_after
+            except PERMANENT_ERRORS as e:
+                error = e
+                break
+            except Exception as e:
+                error, delay = e, self.retry_delay * (2 ** attempt)
+            if attempt + 1 < self.max_attempts:
+                logger.warning(f"Повтор сводки пользователю {telegram_id} через {delay:.1f}с: {error}")
+                await asyncio.sleep(delay)
+        logger.error(f"❌ Ошибка отправки сводки пользователю {telegram_id} ({len(orders)} заявок): {error}")
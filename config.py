@@ -1,5 +1,6 @@
 
 import os
+import hashlib
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,6 +9,8 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не найден в .env файле")
+# Адрес Bot API (локальный telegram-bot-api сервер или фейк для нагрузочных тестов)
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER")
 
 # Laravel API
 API_URL = os.getenv("API_URL", "https://app.protonrent.ru/api/v1")
@@ -15,16 +18,147 @@ LARAVEL_BEARER_TOKEN = os.getenv("LARAVEL_BEARER_TOKEN")
 NOTIFY_SECRET = os.getenv("NOTIFY_SECRET")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
 
+# Пул соединений к Laravel API
+LARAVEL_POOL_LIMIT = int(os.getenv("LARAVEL_POOL_LIMIT", 100))
+LARAVEL_POOL_LIMIT_PER_HOST = int(os.getenv("LARAVEL_POOL_LIMIT_PER_HOST", 20))
+LARAVEL_TIMEOUT = float(os.getenv("LARAVEL_TIMEOUT", 10))
+LARAVEL_CONNECT_TIMEOUT = float(os.getenv("LARAVEL_CONNECT_TIMEOUT", 3))
+LARAVEL_RETRIES = int(os.getenv("LARAVEL_RETRIES", 2))
+
 # eBot API (for compatibility with GitLab CI/CD script)
 EBOT_API_TOKEN = os.getenv("EBOT_API_TOKEN") or LARAVEL_BEARER_TOKEN
 EBOT_HMAC_SECRET = os.getenv("EBOT_HMAC_SECRET") or WEBHOOK_SECRET
+# Максимальный размер тела /notify-webhook, байт
+EBOT_MAX_BODY_SIZE = int(os.getenv("EBOT_MAX_BODY_SIZE", 1048576))
 
 # Bot settings
 BOT_HOST = os.getenv("BOT_HOST", "0.0.0.0")
 BOT_PORT = int(os.getenv("BOT_PORT", 8000))
 DEBUG = os.getenv("DEBUG", "false").lower() == "true"
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", 1))
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text | json
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size")  # size | time
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 5))
+LOG_ROTATION_WHEN = os.getenv("LOG_ROTATION_WHEN", "midnight")
+LOG_SAMPLE_RATE = int(os.getenv("LOG_SAMPLE_RATE", 1))  # 1 из N частых сообщений
+LOG_UPDATE_PAYLOADS = os.getenv("LOG_UPDATE_PAYLOADS", "false").lower() == "true"
+
+# Batch notifications
+NOTIFY_BATCH_CONCURRENCY = int(os.getenv("NOTIFY_BATCH_CONCURRENCY", 20))
+NOTIFY_BATCH_MAX_RECIPIENTS = int(os.getenv("NOTIFY_BATCH_MAX_RECIPIENTS", 1000))
+# Сколько /notify/order-update и /notify/order-cancel ждут правок; дальше — 202, правка идёт в фоне
+NOTIFY_EDIT_TIMEOUT = float(os.getenv("NOTIFY_EDIT_TIMEOUT", 10))
+
+# Общее состояние для нескольких процессов/хостов: sqlite:///state.db или redis://host:6379/0
+STATE_BACKEND_URL = os.getenv("STATE_BACKEND_URL", "sqlite:///state.db")
+SHARED_DEDUP = os.getenv("SHARED_DEDUP", "false").lower() == "true"
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", 30))
+# Аренда фоновых задач на users.db (сверка подписчиков, рассылки, диспетчер, отчёты в Laravel)
+JOBS_LEASE_DB = os.getenv("JOBS_LEASE_DB", "jobs_lease.db")
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL", "https://app.protonrent.ru/api/v1/telegram/webhook")
+
+# Telegram webhook: секрет заголовка X-Telegram-Bot-Api-Secret-Token
+# (по умолчанию выводится из BOT_TOKEN, чтобы совпадать на всех репликах)
+TELEGRAM_WEBHOOK_SECRET = (
+    os.getenv("TELEGRAM_WEBHOOK_SECRET")
+    or hashlib.sha256(f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+)
+TELEGRAM_UPDATE_DEDUP_WINDOW = int(os.getenv("TELEGRAM_UPDATE_DEDUP_WINDOW", 65536))
+
+# Telegram webhook: быстрый ответ и обработка обновлений в фоне
+WEBHOOK_ASYNC_PROCESSING = os.getenv("WEBHOOK_ASYNC_PROCESSING", "false").lower() == "true"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 8))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+
+# Кэш готовых сообщений о заказах
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", 1024))
+
+# Send queue (асинхронная отправка через очередь, эндпоинты отвечают 202)
+SEND_QUEUE_ENABLED = os.getenv("SEND_QUEUE_ENABLED", "false").lower() == "true"
+SEND_QUEUE_DB = os.getenv("SEND_QUEUE_DB", "send_queue.db")
+SEND_MAX_ATTEMPTS = int(os.getenv("SEND_MAX_ATTEMPTS", 5))
+SEND_RETRY_BASE_DELAY = float(os.getenv("SEND_RETRY_BASE_DELAY", 1.0))
+SEND_DISPATCHER_CONCURRENCY = int(os.getenv("SEND_DISPATCHER_CONCURRENCY", 30))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", 30))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))
+# Файл общего лимитера Telegram для воркеров одного хоста (при BOT_WORKERS > 1)
+RATE_LIMIT_FILE = os.getenv("RATE_LIMIT_FILE", "telegram_rate.bucket")
+
+# Классы отправки под общим лимитом: веса очереди и максимальное ожидание токена, с (0 — без ограничения)
+PRIORITY_WEIGHT_INTERACTIVE = float(os.getenv("PRIORITY_WEIGHT_INTERACTIVE", 4))
+PRIORITY_WEIGHT_TRANSACTIONAL = float(os.getenv("PRIORITY_WEIGHT_TRANSACTIONAL", 2))
+PRIORITY_WEIGHT_BULK = float(os.getenv("PRIORITY_WEIGHT_BULK", 1))
+PRIORITY_MAX_DELAY_INTERACTIVE = float(os.getenv("PRIORITY_MAX_DELAY_INTERACTIVE", 10))
+PRIORITY_MAX_DELAY_TRANSACTIONAL = float(os.getenv("PRIORITY_MAX_DELAY_TRANSACTIONAL", 60))
+PRIORITY_MAX_DELAY_BULK = float(os.getenv("PRIORITY_MAX_DELAY_BULK", 0))
+PRIORITY_BULK_PREEMPTIBLE = os.getenv("PRIORITY_BULK_PREEMPTIBLE", "true").lower() == "true"
+# Сколько синхронный /notify* ждёт токен, с; дольше — сразу 503 с Retry-After
+NOTIFY_SYNC_MAX_WAIT = float(os.getenv("NOTIFY_SYNC_MAX_WAIT", 2))
+
+# Автоматы и адаптивный (AIMD) лимит одновременных запросов к Telegram и Laravel
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", 0.5))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", 20))
+CIRCUIT_WINDOW = float(os.getenv("CIRCUIT_WINDOW", 30))
+CIRCUIT_OPEN_TIMEOUT = float(os.getenv("CIRCUIT_OPEN_TIMEOUT", 15))
+CIRCUIT_SLOW_CALL = float(os.getenv("CIRCUIT_SLOW_CALL", 5))  # медленный ответ считается ошибкой
+TELEGRAM_CONCURRENCY_MAX = int(os.getenv("TELEGRAM_CONCURRENCY_MAX", 100))
+LARAVEL_CONCURRENCY_MAX = int(os.getenv("LARAVEL_CONCURRENCY_MAX", LARAVEL_POOL_LIMIT_PER_HOST))
+CONCURRENCY_LATENCY_TARGET = float(os.getenv("CONCURRENCY_LATENCY_TARGET", 1.0))
+CONCURRENCY_MAX_WAIT = float(os.getenv("CONCURRENCY_MAX_WAIT", 5))
+
+# Склейка заявок одному получателю в сводку (0 — отправлять сразу)
+NOTIFY_COALESCE_WINDOW = float(os.getenv("NOTIFY_COALESCE_WINDOW", 0))
+NOTIFY_COALESCE_MAX = int(os.getenv("NOTIFY_COALESCE_MAX", 10))
+# Попытки отправить сводку: на момент отправки эндпоинт уже ответил 202
+NOTIFY_COALESCE_ATTEMPTS = int(os.getenv("NOTIFY_COALESCE_ATTEMPTS", 3))
+
+# Кэш результатов регистрации по контакту, с (ошибки не кэшируются)
+REGISTRATION_CACHE_TTL = float(os.getenv("REGISTRATION_CACHE_TTL", 86400))
+REGISTRATION_NEGATIVE_TTL = float(os.getenv("REGISTRATION_NEGATIVE_TTL", 60))  # «номер не найден»
+REGISTRATION_CACHE_SIZE = int(os.getenv("REGISTRATION_CACHE_SIZE", 100000))
+
+# Индекс подписчиков и сверка с Laravel
+SKIP_UNSUBSCRIBED = os.getenv("SKIP_UNSUBSCRIBED", "true").lower() == "true"
+SUBSCRIBER_SYNC_PATH = os.getenv("SUBSCRIBER_SYNC_PATH", "/telegram/subscribers")
+SUBSCRIBER_SYNC_INTERVAL = float(os.getenv("SUBSCRIBER_SYNC_INTERVAL", 300))  # 0 — без сверки
+SUBSCRIBER_SYNC_PAGE_SIZE = int(os.getenv("SUBSCRIBER_SYNC_PAGE_SIZE", 1000))
+# Подхват отписок, записанных другими воркерами, с (0 — только свои записи)
+SUBSCRIBER_REFRESH_INTERVAL = float(os.getenv("SUBSCRIBER_REFRESH_INTERVAL", 2 if BOT_WORKERS > 1 else 0))
+
+# Недоступные чаты: отчёт в Laravel пачками
+DEAD_RECIPIENT_REPORT_PATH = os.getenv("DEAD_RECIPIENT_REPORT_PATH", "/telegram/disable-notifications")
+DEAD_RECIPIENT_BATCH_SIZE = int(os.getenv("DEAD_RECIPIENT_BATCH_SIZE", 100))
+DEAD_RECIPIENT_FLUSH_INTERVAL = float(os.getenv("DEAD_RECIPIENT_FLUSH_INTERVAL", 10))
+
+# Журнал доставки уведомлений о заказах и отчёт о статусах в Laravel (пустой путь — без отчёта)
+DELIVERY_REPORT_PATH = os.getenv("DELIVERY_REPORT_PATH", "/telegram/delivery-status")
+DELIVERY_REPORT_BATCH_SIZE = int(os.getenv("DELIVERY_REPORT_BATCH_SIZE", 500))
+DELIVERY_FLUSH_INTERVAL = float(os.getenv("DELIVERY_FLUSH_INTERVAL", 5))
+DELIVERY_RETENTION = float(os.getenv("DELIVERY_RETENTION", 7 * 86400))
+
+# Broadcast (рассылка всем подписчикам)
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 20))
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", 500))
+# Как часто владелец аренды фоновых задач подхватывает рассылки других воркеров, с
+BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", 5))
+
+# Health checks (фоновое обновление состояния для /livez и /readyz)
+HEALTH_REFRESH_INTERVAL = float(os.getenv("HEALTH_REFRESH_INTERVAL", 15))
+HEALTH_MAX_STALENESS = float(os.getenv("HEALTH_MAX_STALENESS", 60))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", 5))
+
+# /metrics при нескольких воркерах: каждый пишет реестр в каталог, ответ склеивает все (пусто — только свой процесс)
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics" if BOT_WORKERS > 1 else "")
+METRICS_EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", 5))
+
+# Idempotency (дедупликация повторов /notify-webhook)
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", "idempotency.db")
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10000))
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 86400))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", 3600))  # 0 — только при старте
 
 # Validation
 if not NOTIFY_SECRET:
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ответы Laravel, означающие, что пакетный формат не поддерживается
+BATCH_UNSUPPORTED_STATUSES = {400, 404, 405, 422}
+
+
+def dead_recipient_reason(error: Exception) -> Optional[str]:
+    """
+    Причина, по которой чат больше не принимает сообщения:
+    blocked, deactivated, forbidden или chat_not_found; None для прочих ошибок
+    """
+    message = str(error).lower()
+    if isinstance(error, TelegramForbiddenError):
+        if "blocked" in message or "kicked" in message:
+            return "blocked"
+        if "deactivated" in message:
+            return "deactivated"
+        return "forbidden"
+    if isinstance(error, TelegramBadRequest) and "chat not found" in message:
+        return "chat_not_found"
+    return None
+
+
+class DeadRecipientRegistry:
+    """
+    Учёт недоступных чатов (бот заблокирован, аккаунт удалён, чат не найден).
+    Такой чат сразу помечается в users как отписанный с причиной, поэтому
+    следующие уведомления отсекаются без вызова Telegram. В Laravel
+    (/telegram/disable-notifications) отчёт уходит пачками из фоновой задачи;
+    очередь отчёта лежит в SQLite и переживает рестарт. Отчёт отправляет только
+    процесс, для которого is_leader() истинно (владелец аренды фоновых задач)
+    """
+
+    def __init__(
+        self,
+        storage,
+        laravel,
+        report_path: str = "/telegram/disable-notifications",
+        batch_size: int = 100,
+        flush_interval: float = 10.0,
+        is_leader: Optional[Callable[[], bool]] = None
+    ):
+        self.storage = storage
+        self.laravel = laravel
+        self.report_path = report_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.is_leader = is_leader or (lambda: True)
+        self._batch_supported = True
+        self._task = None
+
+    async def record(self, chat_id, error: Exception) -> Optional[str]:
+        """Регистрирует чат, если ошибка отправки означает недоступность; возвращает причину"""
+        reason = dead_recipient_reason(error)
+        if reason is None:
+            return None
+        try:
+            user_id = int(chat_id)
+        except (TypeError, ValueError):
+            return reason
+        try:
+            await self.storage.mark_dead([user_id], reason)
+        except Exception as e:
+            logger.error(f"❌ Не удалось отметить недоступный чат {user_id}: {e}")
+            return reason
+        metrics.DEAD_RECIPIENTS.labels(reason).inc()
+        logger.info(f"🚫 Чат {user_id} недоступен ({reason}), уведомления отключены")
+        return reason
+
+    async def flush(self) -> int:
+        """Отправляет в Laravel накопленные отчёты; возвращает число подтверждённых"""
+        reported = 0
+        while True:
+            rows = await self.storage.get_dead_reports(self.batch_size)
+            if not rows:
+                return reported
+            user_ids = [user_id for user_id, _ in rows]
+            done = await self._report(user_ids)
+            if not done:
+                return reported
+            await self.storage.delete_dead_reports(done)
+            reported += len(done)
+            if len(done) < len(user_ids):
+                return reported
+
+    async def _report(self, user_ids) -> list:
+        if self._batch_supported:
+            response = await self.laravel.post(
+                self.report_path,
+                json={"telegram_ids": [str(user_id) for user_id in user_ids]}
+            )
+            if response.status == 200:
+                return user_ids
+            if response.status not in BATCH_UNSUPPORTED_STATUSES:
+                logger.warning(f"⚠️ Отчёт о недоступных чатах: HTTP {response.status}")
+                return []
+            # Старый Laravel принимает только один telegram_id
+            logger.info("Laravel не принимает пакетный отчёт, переходим на поштучный")
+            self._batch_supported = False
+
+        done = []
+        for user_id in user_ids:
+            response = await self.laravel.post(self.report_path, json={"telegram_id": str(user_id)})
+            if response.status != 200:
+                logger.warning(f"⚠️ Отчёт о недоступном чате {user_id}: HTTP {response.status}")
+                break
+            done.append(user_id)
+        return done
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if not self.is_leader():
+            return
+        # Последняя короткая попытка отчёта; что не ушло, останется в SQLite
+        try:
+            await asyncio.wait_for(self.flush(), timeout=5)
+        except Exception as e:
+            logger.warning(f"⚠️ Отчёт о недоступных чатах не отправлен при остановке: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                if self.is_leader():
+                    await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка отчёта о недоступных чатах: {e}")
+            await asyncio.sleep(self.flush_interval)
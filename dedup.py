@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyCache:
+    """
+    Кэш ответов по idempotency_key: LRU в памяти с TTL
+    и таблица SQLite, чтобы повторы распознавались и после рестарта.
+    Запросы к SQLite выполняются в отдельном потоке, просроченные строки
+    удаляет фоновая задача (start) раз в purge_interval
+    """
+
+    def __init__(
+        self,
+        db_file: str = None,
+        max_size: int = 10000,
+        ttl: float = 86400,
+        backend=None,
+        purge_interval: float = 3600
+    ):
+        self.db_file = db_file
+        self.backend = backend
+        self.max_size = max_size
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self.conn = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="idempotency")
+        self._task = None
+
+    # --- Выполняется в потоке кэша ---
+
+    def _open(self):
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS idempotency (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                status_code INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency (created_at)")
+        self.conn.commit()
+        self._purge()
+
+    def _close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _select(self, key):
+        return self.conn.execute(
+            "SELECT response, status_code, created_at FROM idempotency WHERE key = ?",
+            (key,)
+        ).fetchone()
+
+    def _insert(self, key, response, status_code, created_at):
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO idempotency (key, response, status_code, created_at) VALUES (?, ?, ?, ?)",
+                (key, response, status_code, created_at)
+            )
+
+    def _purge(self):
+        with self.conn:
+            cursor = self.conn.execute(
+                "DELETE FROM idempotency WHERE created_at < ?",
+                (time.time() - self.ttl,)
+            )
+        return cursor.rowcount
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # --- Асинхронный интерфейс ---
+
+    async def open(self):
+        if self.db_file:
+            await self._run(self._open)
+
+    async def close(self):
+        await self.stop()
+        await self._run(self._close)
+
+    async def get(self, key: str) -> Optional[tuple]:
+        """Возвращает (response, status_code) сохранённого ответа или None"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if now - entry[2] < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+            del self._entries[key]
+
+        if self.conn is not None:
+            row = await self._run(self._select, key)
+            if row is not None and now - row[2] < self.ttl:
+                response = json.loads(row[0])
+                self._remember(key, response, row[1], row[2])
+                self.hits += 1
+                return response, row[1]
+
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, response: dict, status_code: int = 200):
+        created_at = time.time()
+        self._remember(key, response, status_code, created_at)
+        if self.conn is not None:
+            await self._run(self._insert, key, json.dumps(response, ensure_ascii=False), status_code, created_at)
+
+    async def lookup(self, key: str) -> Optional[tuple]:
+        """get() с проверкой общего хранилища других реплик (если задано)"""
+        cached = await self.get(key)
+        if cached is not None or self.backend is None:
+            return cached
+        value = await self.backend.get(f"idem:{key}")
+        if value is None:
+            return None
+        entry = json.loads(value)
+        self._remember(key, entry["response"], entry["status_code"], time.time())
+        self.misses -= 1
+        self.hits += 1
+        return entry["response"], entry["status_code"]
+
+    async def store(self, key: str, response: dict, status_code: int = 200):
+        """put() с записью в общее хранилище (если задано)"""
+        await self.put(key, response, status_code)
+        if self.backend is not None:
+            value = json.dumps({"response": response, "status_code": status_code}, ensure_ascii=False)
+            await self.backend.set(f"idem:{key}", value, self.ttl)
+
+    def _remember(self, key: str, response: dict, status_code: int, created_at: float):
+        self._entries[key] = (response, status_code, created_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def purge(self) -> int:
+        """Удаляет просроченные записи из SQLite"""
+        if self.conn is None:
+            return 0
+        return await self._run(self._purge)
+
+    def start(self):
+        """Периодическая очистка просроченных ключей"""
+        if self.conn is not None and self.purge_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._purge_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            try:
+                removed = await self.purge()
+                if removed:
+                    logger.info(f"🧹 Удалено {removed} просроченных ключей идемпотентности")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка очистки ключей идемпотентности: {e}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "size": len(self._entries)
+        }
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DeliveryJournal:
+    """
+    Журнал отправок уведомлений о заказах: строка на каждую попытку
+    (telegram_id, order_id, message_id, статус, задержка, класс ошибки).
+    record() только кладёт строку в буфер; фоновая задача раз в flush_interval
+    пишет буфер в SQLite одной транзакцией и отправляет ещё не переданные
+    строки в Laravel пачками по batch_size. Строки старше retention удаляются.
+    Индекс order_id → (chat_id, message_id) для правки и отзыва пишется сразу
+    при отправке (index_message), чтобы изменение заказа сразу после отправки
+    нашло сообщение.
+    Буфер пишет каждый процесс, а отчёт в Laravel и очистку ведёт только тот,
+    для кого is_leader() истинно (владелец аренды фоновых задач на users.db)
+    """
+
+    def __init__(
+        self,
+        storage,
+        laravel,
+        report_path: Optional[str] = "/telegram/delivery-status",
+        batch_size: int = 500,
+        flush_interval: float = 5.0,
+        retention: float = 7 * 86400,
+        is_leader: Optional[Callable[[], bool]] = None
+    ):
+        self.storage = storage
+        self.laravel = laravel
+        self.report_path = report_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retention = retention
+        self.is_leader = is_leader or (lambda: True)
+        self._buffer = []
+        self._last_status = 200
+        self._task = None
+
+    def record(
+        self,
+        telegram_id,
+        order_id,
+        message_id: Optional[int] = None,
+        status: str = "sent",
+        latency: float = 0.0,
+        error: Optional[str] = None
+    ):
+        """Добавляет попытку отправки в буфер журнала"""
+        self._buffer.append(
+            (str(telegram_id), str(order_id), message_id, status, round(latency, 4), error, time.time())
+        )
+        metrics.DELIVERIES.labels(status).inc()
+
+    async def index_message(self, telegram_id, order_id, message_id: int):
+        """
+        Сразу записывает отправленное сообщение о заказе в индекс для правки и отзыва.
+        Только для сообщений об одном заказе; ошибка записи не отменяет отправку
+        """
+        try:
+            await self.storage.add_order_message(order_id, int(telegram_id), message_id)
+        except (TypeError, ValueError):
+            # chat_id вида @channel в индекс не попадает
+            pass
+        except Exception as e:
+            logger.error(f"❌ Сообщение {message_id} о заказе {order_id} не записано в индекс: {e}")
+
+    async def write(self) -> int:
+        """Переносит буфер в SQLite; возвращает число записанных строк"""
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+        try:
+            await self.storage.add_deliveries(rows)
+        except Exception:
+            # Строки вернутся в буфер и будут записаны следующей попыткой
+            self._buffer[:0] = rows
+            raise
+        return len(rows)
+
+    async def flush(self) -> int:
+        """Пишет буфер и отправляет в Laravel неотправленные статусы; возвращает число подтверждённых"""
+        await self.write()
+        return await self.report()
+
+    async def report(self) -> int:
+        """Отправляет в Laravel неотправленные статусы из SQLite; возвращает число подтверждённых"""
+        if not self.report_path:
+            return 0
+        reported = 0
+        while True:
+            rows = await self.storage.get_unreported_deliveries(self.batch_size)
+            if not rows:
+                return reported
+            response = await self.laravel.post(self.report_path, json={"deliveries": [
+                {
+                    "telegram_id": row["telegram_id"],
+                    "order_id": row["order_id"],
+                    "message_id": row["message_id"],
+                    "status": row["status"],
+                    "latency_ms": round(row["latency"] * 1000),
+                    "error": row["error"],
+                    "sent_at": row["created_at"]
+                }
+                for row in rows
+            ]})
+            if response.status != 200:
+                if response.status != self._last_status:
+                    logger.warning(f"⚠️ Статусы доставки не приняты Laravel: HTTP {response.status}")
+                self._last_status = response.status
+                return reported
+            self._last_status = 200
+            await self.storage.mark_deliveries_reported([row["id"] for row in rows])
+            reported += len(rows)
+            if len(rows) < self.batch_size:
+                return reported
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            await self.write()
+        except Exception as e:
+            logger.error(f"❌ Журнал доставки не записан при остановке ({len(self._buffer)} строк): {e}")
+            return
+        if not self.is_leader():
+            return
+        # Последняя короткая попытка отчёта; что не ушло, останется в SQLite
+        try:
+            await asyncio.wait_for(self.report(), timeout=5)
+        except Exception as e:
+            logger.warning(f"⚠️ Статусы доставки не отправлены при остановке: {e}")
+
+    async def _run(self):
+        last_purge = time.monotonic()
+        while True:
+            try:
+                await self.write()
+                if self.is_leader():
+                    await self.report()
+                    if time.monotonic() - last_purge > 3600:
+                        await self.storage.purge_deliveries(self.retention)
+                        last_purge = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка журнала доставки: {e}")
+            await asyncio.sleep(self.flush_interval)
+
+    def stats(self) -> dict:
+        return {"buffered": len(self._buffer)}
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    """
+    Состояние сервиса для проб: обновляется фоновой задачей,
+    поэтому /livez и /readyz читают только память и не ходят в сеть
+    """
+
+    def __init__(
+        self,
+        get_me: Callable[[], Awaitable],
+        check_laravel: Callable[[], Awaitable[bool]],
+        check_storage: Callable[[], Awaitable],
+        queue_depth: Optional[Callable[[], Awaitable[int]]] = None,
+        interval: float = 15.0,
+        max_staleness: float = 60.0,
+        check_timeout: float = 5.0
+    ):
+        self.get_me = get_me
+        self.check_laravel = check_laravel
+        self.check_storage = check_storage
+        self.queue_depth = queue_depth
+        self.interval = interval
+        self.max_staleness = max_staleness
+        self.check_timeout = check_timeout
+
+        self.bot_info = None
+        self.bot_checked_at = None
+        self.last_send_ok_at = None
+        self.laravel_ok = None
+        self.laravel_checked_at = None
+        self.storage_ok = None
+        self.storage_checked_at = None
+        self.send_queue_depth = None
+        self.refreshed_at = None
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def record_send_ok(self):
+        """Вызывается после успешной отправки в Telegram"""
+        self.last_send_ok_at = time.time()
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval)
+
+    async def refresh(self):
+        await asyncio.gather(self._refresh_bot(), self._refresh_laravel(), self._refresh_storage())
+        if self.queue_depth is not None:
+            try:
+                self.send_queue_depth = await asyncio.wait_for(self.queue_depth(), self.check_timeout)
+                metrics.SEND_QUEUE_DEPTH.set(self.send_queue_depth)
+            except Exception as e:
+                logger.warning(f"Health: не удалось получить глубину очереди: {e}")
+        self.refreshed_at = time.time()
+
+    async def _refresh_bot(self):
+        try:
+            self.bot_info = await asyncio.wait_for(self.get_me(), self.check_timeout)
+            self.bot_checked_at = time.time()
+        except Exception as e:
+            logger.warning(f"Health: Telegram getMe недоступен: {e}")
+
+    async def _refresh_laravel(self):
+        try:
+            self.laravel_ok = await asyncio.wait_for(self.check_laravel(), self.check_timeout)
+        except Exception as e:
+            logger.warning(f"Health: Laravel API недоступен: {e}")
+            self.laravel_ok = False
+        self.laravel_checked_at = time.time()
+
+    async def _refresh_storage(self):
+        try:
+            await asyncio.wait_for(self.check_storage(), self.check_timeout)
+            self.storage_ok = True
+        except Exception as e:
+            logger.error(f"Health: SQLite недоступна для записи: {e}")
+            self.storage_ok = False
+        self.storage_checked_at = time.time()
+
+    def _fresh(self, checked_at: Optional[float], now: float) -> bool:
+        return checked_at is not None and now - checked_at <= self.max_staleness
+
+    def is_alive(self) -> bool:
+        """Процесс жив, пока фоновая задача обновляет состояние"""
+        if self._task is None or self._task.done():
+            return False
+        return self.refreshed_at is None or time.time() - self.refreshed_at <= self.max_staleness + self.interval
+
+    def is_ready(self) -> bool:
+        """Готов принимать трафик: getMe и запись в SQLite свежие и успешные"""
+        now = time.time()
+        return self._fresh(self.bot_checked_at, now) and bool(self.storage_ok) and self._fresh(self.storage_checked_at, now)
+
+    def snapshot(self) -> dict:
+        now = time.time()
+
+        def age(checked_at):
+            return round(now - checked_at, 3) if checked_at is not None else None
+
+        return {
+            "bot_username": self.bot_info.username if self.bot_info else None,
+            "bot_id": self.bot_info.id if self.bot_info else None,
+            "bot_checked_age": age(self.bot_checked_at),
+            "last_send_ok_age": age(self.last_send_ok_at),
+            "laravel_ok": self.laravel_ok,
+            "laravel_checked_age": age(self.laravel_checked_at),
+            "storage_ok": self.storage_ok,
+            "storage_checked_age": age(self.storage_checked_at),
+            "send_queue_depth": self.send_queue_depth,
+            "max_staleness": self.max_staleness
+        }
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import random
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Any, Optional
+
+import aiohttp
+
+import metrics
+from circuit_breaker import FAILURE, OVERLOAD, GuardedCall, UpstreamGuard
+
+logger = logging.getLogger(__name__)
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+@dataclass
+class LaravelResponse:
+    """Ответ Laravel API"""
+    status: int
+    data: Any = None
+
+
+class LaravelClient:
+    """
+    Клиент Laravel API с общим пулом keep-alive соединений.
+    Создаётся один раз на процесс (в lifespan) и закрывается при остановке
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        token: str,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        timeout: float = 10.0,
+        connect_timeout: float = 3.0,
+        retries: int = 2,
+        backoff: float = 0.5,
+        guard: Optional[UpstreamGuard] = None
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.guard = guard
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=60,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                headers={
+                    'Authorization': f'Bearer {self.token}',
+                    'Content-Type': 'application/json',
+                    'Accept': 'application/json'
+                }
+            )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def request(self, method: str, path: str, **kwargs) -> LaravelResponse:
+        """
+        Запрос к Laravel API с повторами при сетевых ошибках и 429/5xx.
+        Задержка между попытками — экспоненциальная с полным jitter.
+        При разомкнутом автомате guard попытка сразу завершается UpstreamUnavailableError
+        """
+        await self.start()
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                async with self._guarded() as call, self._session.request(method, url, **kwargs) as response:
+                    metrics.LARAVEL_LATENCY.labels(path, str(response.status)).observe(time.perf_counter() - started)
+                    if response.status >= 500:
+                        call.outcome = FAILURE
+                    elif response.status == 429:
+                        call.outcome = OVERLOAD
+                    if response.status in RETRY_STATUSES and attempt < self.retries:
+                        logger.warning(f"Laravel API {method} {path}: HTTP {response.status}, повтор")
+                    else:
+                        try:
+                            data = await response.json(content_type=None)
+                        except ValueError:
+                            data = None
+                        return LaravelResponse(status=response.status, data=data)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                metrics.LARAVEL_LATENCY.labels(path, type(e).__name__).observe(time.perf_counter() - started)
+                if attempt >= self.retries:
+                    raise
+                logger.warning(f"Laravel API {method} {path}: {type(e).__name__}: {e}, повтор")
+            attempt += 1
+            await asyncio.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def _guarded(self):
+        if self.guard is None:
+            return nullcontext(GuardedCall())
+        return self.guard.call()
+
+    async def ping(self) -> bool:
+        """Доступность Laravel API: любой ответ без 5xx, без повторов"""
+        await self.start()
+        async with self._guarded() as call, self._session.get(self.base_url) as response:
+            if response.status >= 500:
+                call.outcome = FAILURE
+            return response.status < 500
+
+    async def post(self, path: str, json: Any = None) -> LaravelResponse:
+        return await self.request("POST", path, json=json)
+
+    async def get(self, path: str, params: dict = None) -> LaravelResponse:
+        return await self.request("GET", path, params=params)
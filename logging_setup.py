@@ -0,0 +1,108 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+from datetime import datetime, timezone
+
+# Стандартные атрибуты LogRecord, которые не попадают в extra
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON строка на запись; поля из extra добавляются как есть"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key != "sample":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает только каждую rate-ю запись из помеченных extra={"sample": True}
+    (отдельный счётчик на шаблон сообщения); остальные записи не трогает
+    """
+
+    def __init__(self, rate: int):
+        super().__init__()
+        self.rate = max(1, rate)
+        self._counters = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate == 1 or not getattr(record, "sample", False):
+            return True
+        count = self._counters.get(record.msg, 0)
+        self._counters[record.msg] = count + 1
+        return count % self.rate == 0
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """QueueListener с повторным вызовом stop() без ошибки (atexit + явная остановка)"""
+
+    def stop(self):
+        if self._thread is not None:
+            super().stop()
+
+
+def setup_logging(
+    level: str,
+    log_file: str,
+    fmt: str = "text",
+    rotation: str = "size",
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    when: str = "midnight",
+    sample_rate: int = 1,
+    workers: int = 1
+) -> logging.handlers.QueueListener:
+    """
+    Логи пишутся через QueueHandler: event loop только кладёт запись в очередь,
+    форматирование, ротация и запись на диск идут в потоке QueueListener.
+    При workers > 1 каждый процесс пишет в свой файл (bot.<pid>.log):
+    ротация одного файла несколькими процессами теряет и перемешивает строки
+    """
+    if workers > 1:
+        root_name, ext = os.path.splitext(log_file)
+        log_file = f"{root_name}.{os.getpid()}{ext}"
+    if fmt == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    if rotation == "time":
+        file_handler = logging.handlers.TimedRotatingFileHandler(
+            log_file, when=when, backupCount=backup_count, encoding="utf-8"
+        )
+    else:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, level.upper()))
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+
+    listener = _QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -1,126 +1,243 @@
 import os
 import logging
 import asyncio
-import aiohttp
+import time
 import hmac
-import hashlib
-from fastapi import FastAPI, Header, HTTPException, Depends, Request
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import json
+from fastapi import FastAPI, Header, HTTPException, Depends, Request, Response
+from fastapi.responses import PlainTextResponse, JSONResponse
 from aiogram import Bot, Dispatcher, types
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, BotCommand, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.filters import Command
 from contextlib import asynccontextmanager
-from typing import Union
+from typing import Optional, Union
 
-from models import LaravelNotification, LegacyNotification, TelegramRegistration, ApiResponse, OrderData
+from models import (
+    LaravelNotification, LegacyNotification, TelegramRegistration, ApiResponse, OrderData, BatchNotification, EbotEvent,
+    OrderUpdateNotification, OrderCancelNotification
+)
 from config import *
-from storage import init_db
-
-# Настройка логирования
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
+from storage import user_storage
+from auth import verify_api_key, verify_legacy_api_key, verify_ebot_event
+from send_queue import SendQueue, SendDispatcher
+from dedup import IdempotencyCache
+from laravel_client import LaravelClient
+from rate_limit import TokenBucket, SharedTokenBucket
+from broadcast import BroadcastEngine
+import notify_api
+import metrics
+from health import HealthMonitor
+from message_templates import TemplateRenderer
+from logging_setup import setup_logging
+from update_queue import UpdateQueue
+from update_dedup import UpdateIdWindow
+from shared_state import create_backend, BackendFSMStorage, LeaderLease, SQLiteBackend
+from subscribers import SubscriberIndex
+from dead_recipients import DeadRecipientRegistry, dead_recipient_reason
+from delivery_journal import DeliveryJournal
+from order_messages import OrderMessageEditor
+from coalescer import NotificationCoalescer
+from registration import RegistrationCache
+from phone import looks_like_phone
+from singleflight import SingleFlight
+from pydantic import ValidationError
+from priority import (
+    PriorityScheduler, InteractiveLaneMiddleware, LaneRequestMiddleware, QueueDelayExceeded,
+    INTERACTIVE, TRANSACTIONAL, BULK
+)
+from circuit_breaker import (
+    CircuitBreaker, AdaptiveLimiter, UpstreamGuard, UpstreamUnavailableError,
+    TelegramGuardMiddleware, telegram_outcome, laravel_outcome
+)
+
+# Настройка логирования (запись на диск в отдельном потоке)
+log_listener = setup_logging(
+    LOG_LEVEL,
+    LOG_FILE,
+    fmt=LOG_FORMAT,
+    rotation=LOG_ROTATION,
+    max_bytes=LOG_MAX_BYTES,
+    backup_count=LOG_BACKUP_COUNT,
+    when=LOG_ROTATION_WHEN,
+    sample_rate=LOG_SAMPLE_RATE,
+    workers=BOT_WORKERS
 )
 logger = logging.getLogger(__name__)
 
+def create_guard(name: str, max_concurrency: int, classify) -> UpstreamGuard:
+    """Автомат и адаптивный лимит одновременных запросов к внешнему сервису"""
+    return UpstreamGuard(
+        CircuitBreaker(
+            name,
+            failure_rate=CIRCUIT_FAILURE_RATE,
+            min_calls=CIRCUIT_MIN_CALLS,
+            window=CIRCUIT_WINDOW,
+            open_timeout=CIRCUIT_OPEN_TIMEOUT,
+            slow_call=CIRCUIT_SLOW_CALL
+        ),
+        AdaptiveLimiter(
+            name,
+            max_concurrency,
+            latency_target=CONCURRENCY_LATENCY_TARGET,
+            max_wait=CONCURRENCY_MAX_WAIT
+        ),
+        classify
+    )
+
+# Деградация Telegram или Laravel не должна копить зависшие запросы:
+# при серии ошибок вызовы отклоняются сразу, число одновременных запросов адаптивное
+telegram_guard = create_guard("telegram", TELEGRAM_CONCURRENCY_MAX, telegram_outcome)
+laravel_guard = create_guard("laravel", LARAVEL_CONCURRENCY_MAX, laravel_outcome)
+
 # Инициализация бота
-from aiogram.client.default import DefaultBotProperties
-bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode='HTML'))
-storage = MemoryStorage()
+bot_session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_SERVER)) if TELEGRAM_API_SERVER else None
+bot = Bot(token=BOT_TOKEN, session=bot_session, default=DefaultBotProperties(parse_mode='HTML'))
+
+# Общее состояние реплик: FSM, дедупликация, аренда лидерства
+state_backend = create_backend(STATE_BACKEND_URL)
+storage = BackendFSMStorage(state_backend)
 dp = Dispatcher(storage=storage)
+# Ответы из хендлеров идут под лимитом классом interactive
+dp.update.outer_middleware(InteractiveLaneMiddleware())
 
-# Security
-security = HTTPBearer()
+# Webhook и резервный polling настраивает только владелец аренды
+polling_task = None
 
-async def verify_api_key(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    """Проверка Bearer token"""
-    if credentials.credentials != LARAVEL_BEARER_TOKEN:
-        raise HTTPException(status_code=401, detail="Invalid authentication token")
-    return credentials.credentials
+# Окно последних update_id для отбрасывания повторных доставок
+update_window = UpdateIdWindow(TELEGRAM_UPDATE_DEDUP_WINDOW)
 
-async def verify_legacy_api_key(x_api_key: str = Header(default=None)):
-    """Проверка X-API-Key для обратной совместимости"""
-    if x_api_key != NOTIFY_SECRET:
-        raise HTTPException(status_code=401, detail="Invalid API key")
-    return x_api_key
+# Очередь входящих обновлений (при WEBHOOK_ASYNC_PROCESSING)
+update_queue = UpdateQueue(
+    lambda update: dp.feed_update(bot, update),
+    workers=WEBHOOK_WORKERS,
+    maxsize=WEBHOOK_QUEUE_SIZE
+)
 
-async def verify_webhook_signature(
-    request: Request,
-    x_signature: str = Header(default=None),
-    x_signature_alg: str = Header(default=None)
-):
-    """Проверка HMAC подписи для webhook запросов"""
-    if not x_signature or not x_signature_alg:
-        raise HTTPException(status_code=401, detail="Missing signature headers")
-    
-    if x_signature_alg != "HMAC-SHA256":
-        raise HTTPException(status_code=401, detail="Unsupported signature algorithm")
-    
-    # Получаем тело запроса
-    body = await request.body()
-    
-    # Вычисляем ожидаемую подпись
-    expected_signature = hmac.new(
-        EBOT_HMAC_SECRET.encode(),
-        body,
-        hashlib.sha256
-    ).hexdigest()
-    
-    # Проверяем подпись
-    provided_signature = x_signature.replace("sha256=", "")
-    if not hmac.compare_digest(expected_signature, provided_signature):
-        raise HTTPException(status_code=401, detail="Invalid signature")
-    
-    return True
+# Шаблоны уведомлений о заказах
+renderer = TemplateRenderer(cache_size=TEMPLATE_CACHE_SIZE)
 
-async def verify_ebot_auth(
-    request: Request,
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    x_signature: str = Header(default=None),
-    x_signature_alg: str = Header(default=None)
-):
-    """Комбинированная проверка Bearer token и HMAC подписи для eBot webhook"""
-    # Проверяем Bearer token
-    if credentials.credentials != EBOT_API_TOKEN:
-        raise HTTPException(status_code=401, detail="Invalid authentication token")
-    
-    # Проверяем HMAC подпись
-    await verify_webhook_signature(request, x_signature, x_signature_alg)
-    
-    return credentials.credentials
+# Общий лимит Telegram на исходящие сообщения (очередь и рассылки);
+# при нескольких воркерах лимит делится между процессами через файл
+if BOT_WORKERS > 1:
+    telegram_limiter = SharedTokenBucket(RATE_LIMIT_FILE, TELEGRAM_GLOBAL_RATE)
+else:
+    telegram_limiter = TokenBucket(TELEGRAM_GLOBAL_RATE)
 
-# FastAPI app
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """Управление жизненным циклом приложения"""
-    # Startup
-    logger.info("🚀 Запуск Telegram бота...")
-    logger.info(f"🌐 API URL: {API_URL}")
-    logger.info(f"🔑 Token установлен: {bool(BOT_TOKEN)}")
-    logger.info(f"🔐 Bearer Token: {bool(LARAVEL_BEARER_TOKEN)}")
-    
-    # Инициализируем базу данных
-    init_db()
-    logger.info("✅ База данных инициализирована")
-    
-    # Удаляем webhook если есть (для polling режима)
-    try:
-        logger.info("🔄 Проверка webhook...")
-        webhook_info = await bot.get_webhook_info()
-        if webhook_info.url:
-            logger.info(f"🗑️ Удаляем webhook: {webhook_info.url}")
-            await bot.delete_webhook()
-            logger.info("✅ Webhook удален")
-        else:
-            logger.info("✅ Webhook не установлен")
-    except Exception as e:
-        logger.warning(f"⚠️ Ошибка при работе с webhook: {e}")
+# Классы отправки под общим лимитом: ответы пользователю, уведомления о заказах, рассылки.
+# Рассылка уступает токены, пока ждут более срочные сообщения
+send_scheduler = PriorityScheduler(telegram_limiter)
+send_scheduler.add_lane(INTERACTIVE, PRIORITY_WEIGHT_INTERACTIVE, PRIORITY_MAX_DELAY_INTERACTIVE)
+send_scheduler.add_lane(TRANSACTIONAL, PRIORITY_WEIGHT_TRANSACTIONAL, PRIORITY_MAX_DELAY_TRANSACTIONAL)
+send_scheduler.add_lane(BULK, PRIORITY_WEIGHT_BULK, PRIORITY_MAX_DELAY_BULK, preemptible=PRIORITY_BULK_PREEMPTIBLE)
+
+# Порядок важен: ожидание токена снаружи автомата, чтобы не считаться задержкой Telegram
+bot.session.middleware(LaneRequestMiddleware(send_scheduler))
+bot.session.middleware(TelegramGuardMiddleware(telegram_guard))
+
+# Очередь исходящих сообщений (при SEND_QUEUE_ENABLED)
+send_queue = SendQueue(SEND_QUEUE_DB)
+send_dispatcher = None
+
+# Клиент Laravel API с общим пулом соединений
+laravel = LaravelClient(
+    API_URL,
+    LARAVEL_BEARER_TOKEN,
+    limit=LARAVEL_POOL_LIMIT,
+    limit_per_host=LARAVEL_POOL_LIMIT_PER_HOST,
+    timeout=LARAVEL_TIMEOUT,
+    connect_timeout=LARAVEL_CONNECT_TIMEOUT,
+    retries=LARAVEL_RETRIES,
+    guard=laravel_guard
+)
+
+# Подписчики в памяти: отписавшимся уведомления не отправляются
+subscribers = SubscriberIndex(
+    user_storage,
+    laravel,
+    sync_path=SUBSCRIBER_SYNC_PATH,
+    interval=SUBSCRIBER_SYNC_INTERVAL,
+    page_size=SUBSCRIBER_SYNC_PAGE_SIZE,
+    refresh_interval=SUBSCRIBER_REFRESH_INTERVAL
+)
+
+async def register_in_laravel(telegram_id: str, phone: str) -> int:
+    """Регистрация телефона в Laravel; при успехе пользователь включается локально"""
+    response = await laravel.post("/telegram/register", json={"phone": phone, "telegram_id": telegram_id})
+    if response.status == 200:
+        await user_storage.add_user(int(telegram_id))
+    return response.status
+
+# Журнал отправок уведомлений о заказах, статусы пачками уходят в Laravel
+delivery_journal = DeliveryJournal(
+    user_storage,
+    laravel,
+    report_path=DELIVERY_REPORT_PATH,
+    batch_size=DELIVERY_REPORT_BATCH_SIZE,
+    flush_interval=DELIVERY_FLUSH_INTERVAL,
+    retention=DELIVERY_RETENTION,
+    is_leader=lambda: jobs_lease.is_leader
+)
+
+# Повторная отправка контакта отвечается локально, одновременные дубли — одним запросом
+registration_cache = RegistrationCache(
+    register_in_laravel,
+    ttl=REGISTRATION_CACHE_TTL,
+    negative_ttl=REGISTRATION_NEGATIVE_TTL,
+    max_size=REGISTRATION_CACHE_SIZE,
+    is_active=subscribers.is_subscribed
+)
+
+# Недоступные чаты: отключаются локально и пачками сообщаются в Laravel
+dead_recipients = DeadRecipientRegistry(
+    user_storage,
+    laravel,
+    report_path=DEAD_RECIPIENT_REPORT_PATH,
+    batch_size=DEAD_RECIPIENT_BATCH_SIZE,
+    flush_interval=DEAD_RECIPIENT_FLUSH_INTERVAL,
+    is_leader=lambda: jobs_lease.is_leader
+)
+
+# Правка и отзыв отправленных уведомлений при изменении и отмене заказа
+order_messages = OrderMessageEditor(
+    user_storage,
+    bot,
+    send_scheduler.lane(TRANSACTIONAL),
+    concurrency=NOTIFY_BATCH_CONCURRENCY,
+    record_dead=dead_recipients.record
+)
+
+# Метрики остальных воркеров uvicorn для /metrics
+metrics_exporter = (
+    metrics.MultiprocessExporter(METRICS_DIR, metrics.REGISTRY, interval=METRICS_EXPORT_INTERVAL)
+    if METRICS_DIR else None
+)
+
+# Состояние сервиса для проб, обновляется в фоне
+health_monitor = HealthMonitor(
+    bot.get_me,
+    laravel.ping,
+    user_storage.check_writable,
+    queue_depth=send_queue.depth if SEND_QUEUE_ENABLED else None,
+    interval=HEALTH_REFRESH_INTERVAL,
+    max_staleness=HEALTH_MAX_STALENESS,
+    check_timeout=HEALTH_CHECK_TIMEOUT
+)
+
+# Кэш ответов /notify-webhook по idempotency_key
+idempotency_cache = IdempotencyCache(
+    IDEMPOTENCY_DB,
+    max_size=IDEMPOTENCY_CACHE_SIZE,
+    ttl=IDEMPOTENCY_TTL,
+    backend=state_backend if SHARED_DEDUP else None,
+    purge_interval=IDEMPOTENCY_PURGE_INTERVAL
+)
+
+async def setup_webhook():
+    """Команды бота и webhook; вызывается только у владельца аренды лидерства"""
+    global polling_task
     
     # Устанавливаем команды бота
     commands = [
@@ -130,27 +247,161 @@ async def lifespan(app: FastAPI):
     ]
     await bot.set_my_commands(commands)
     
-    # Настраиваем webhook вместо polling для решения сетевых проблем
-    webhook_url = f"https://app.protonrent.ru/api/v1/telegram/webhook"
+    # setWebhook заменяет текущий webhook без удаления, поэтому Telegram не теряет доставку
     try:
-        logger.info(f"🔄 Настройка webhook: {webhook_url}")
-        await bot.set_webhook(webhook_url)
+        logger.info(f"🔄 Настройка webhook: {TELEGRAM_WEBHOOK_URL}")
+        await bot.set_webhook(TELEGRAM_WEBHOOK_URL, secret_token=TELEGRAM_WEBHOOK_SECRET)
         logger.info("✅ Webhook установлен успешно")
         logger.info("✅ Telegram бот работает в webhook режиме")
     except Exception as e:
         logger.warning(f"⚠️ Не удалось установить webhook: {e}")
         logger.info("🔄 Попытка запуска в polling режиме...")
         try:
-            asyncio.create_task(dp.start_polling(bot))
+            polling_task = asyncio.create_task(dp.start_polling(bot, handle_signals=False))
             logger.info("✅ Telegram бот запущен в polling режиме")
         except Exception as polling_error:
             logger.error(f"❌ Ошибка в polling: {polling_error}")
             logger.error("💥 Telegram бот не может быть запущен")
+
+async def stop_polling():
+    """Останавливает резервный polling (при потере лидерства или остановке)"""
+    global polling_task
+    if polling_task is None:
+        return
+    try:
+        await dp.stop_polling()
+    except RuntimeError:
+        pass
+    polling_task.cancel()
+    await asyncio.gather(polling_task, return_exceptions=True)
+    polling_task = None
+    logger.info("🛑 Polling остановлен")
+
+async def start_background_jobs():
+    """
+    Задачи, которые на одной users.db должен вести один процесс: сверка подписчиков,
+    рассылки (продолжение прерванных и запуск созданных другими воркерами)
+    и диспетчер очереди отправки. Вызывается владельцем аренды jobs_lease
+    """
+    subscribers.start()
+    app.state.broadcast_engine.watch()
+    if send_dispatcher is not None:
+        send_dispatcher.start()
+    logger.info("✅ Фоновые задачи запущены в этом процессе")
+
+async def stop_background_jobs():
+    """Останавливает задачи владельца аренды (при потере аренды или остановке)"""
+    await subscribers.stop()
+    await app.state.broadcast_engine.stop()
+    if send_dispatcher is not None:
+        await send_dispatcher.stop()
+
+# Аренда фоновых задач привязана к файлу users.db, а не к STATE_BACKEND_URL:
+# у реплик на разных хостах свои базы, и у каждой должен быть свой владелец.
+# Отчёты журнала доставки и недоступных чатов проверяют её перед отправкой в Laravel
+jobs_backend = SQLiteBackend(JOBS_LEASE_DB)
+jobs_lease = LeaderLease(
+    jobs_backend,
+    "jobs",
+    ttl=LEADER_LEASE_TTL,
+    on_acquired=start_background_jobs,
+    on_lost=stop_background_jobs
+)
+
+# FastAPI app
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Управление жизненным циклом приложения"""
+    # Startup
+    logger.info("🚀 Запуск Telegram бота...")
+    logger.info(f"🌐 API URL: {API_URL}")
+    logger.info(f"🔑 Token установлен: {bool(BOT_TOKEN)}")
+    logger.info(f"🔐 Bearer Token: {bool(LARAVEL_BEARER_TOKEN)}")
+    
+    # Инициализируем базу данных
+    await user_storage.open()
+    logger.info("✅ База данных инициализирована")
+    await subscribers.load()
+    
+    await idempotency_cache.open()
+    idempotency_cache.start()
+    await laravel.start()
+    subscribers.start_refresh()
+    dead_recipients.start()
+    delivery_journal.start()
+    
+    app.state.broadcast_engine = BroadcastEngine(
+        user_storage,
+        send_telegram_message,
+        send_scheduler.lane(BULK),
+        concurrency=BROADCAST_CONCURRENCY,
+        chunk_size=BROADCAST_CHUNK_SIZE,
+        poll_interval=BROADCAST_POLL_INTERVAL
+    )
+    
+    loop_lag_task = asyncio.create_task(metrics.monitor_event_loop_lag())
+    if metrics_exporter is not None:
+        metrics_exporter.start()
+    health_monitor.start()
+    if WEBHOOK_ASYNC_PROCESSING:
+        update_queue.start()
+        logger.info(f"✅ Фоновая обработка обновлений: {WEBHOOK_WORKERS} воркеров")
+    
+    global send_dispatcher
+    if SEND_QUEUE_ENABLED:
+        await send_queue.open()
+        send_dispatcher = SendDispatcher(
+            send_queue,
+            send_telegram_message,
+            global_rate=TELEGRAM_GLOBAL_RATE,
+            chat_rate=TELEGRAM_CHAT_RATE,
+            max_attempts=SEND_MAX_ATTEMPTS,
+            base_delay=SEND_RETRY_BASE_DELAY,
+            concurrency=SEND_DISPATCHER_CONCURRENCY,
+            global_limiter=send_scheduler.lane(TRANSACTIONAL)
+        )
+        logger.info(f"✅ Очередь отправки открыта, в очереди: {await send_queue.depth()}")
+    
+    # Сверка подписчиков, рассылки, диспетчер очереди и отчёты в Laravel — у одного процесса
+    jobs_lease.start()
+    
+    leader_lease = LeaderLease(
+        state_backend,
+        "webhook",
+        ttl=LEADER_LEASE_TTL,
+        on_acquired=setup_webhook,
+        on_lost=stop_polling
+    )
+    leader_lease.start()
     
     yield
     
     # Shutdown
     logger.info("🛑 Остановка Telegram бота...")
+    await leader_lease.stop()
+    await stop_polling()
+    if WEBHOOK_ASYNC_PROCESSING:
+        await update_queue.stop()
+    await coalescer.stop()
+    # Фоновые правки заказов дописывают индекс order_messages
+    await asyncio.gather(*order_edit_tasks, return_exceptions=True)
+    loop_lag_task.cancel()
+    if metrics_exporter is not None:
+        await metrics_exporter.stop()
+    await health_monitor.stop()
+    await subscribers.stop_refresh()
+    await stop_background_jobs()
+    if send_dispatcher is not None:
+        await send_queue.close()
+    await idempotency_cache.close()
+    # Последние отчёты в Laravel отправляются, пока аренда ещё наша
+    await dead_recipients.stop()
+    await delivery_journal.stop()
+    await jobs_lease.stop()
+    await jobs_backend.close()
+    await laravel.close()
+    await user_storage.close()
+    await storage.close()
     await bot.session.close()
 
 app = FastAPI(
@@ -159,6 +410,8 @@ app = FastAPI(
     version="2.0.0",
     lifespan=lifespan
 )
+app.add_middleware(metrics.MetricsMiddleware)
+app.include_router(notify_api.router)
 
 # --- Telegram обработчики ---
 
@@ -175,7 +428,7 @@ async def handle_start(message: Message):
     welcome_text = (
         "👋 <b>Добро пожаловать в Proton!</b>\n\n"
         "Для получения уведомлений о новых заявках на аренду спецтехники, "
-        "пожалуйста, поделитесь своим номером телефона."
+        "пожалуйста, поделитесь своим номером телефона кнопкой ниже или отправьте его сообщением."
     )
     
     await message.answer(welcome_text, reply_markup=kb, parse_mode="HTML")
@@ -187,27 +440,20 @@ async def handle_stop(message: Message):
     telegram_id = str(message.from_user.id)
     
     try:
-        async with aiohttp.ClientSession() as session:
-            headers = {
-                'Authorization': f'Bearer {LARAVEL_BEARER_TOKEN}',
-                'Content-Type': 'application/json'
-            }
+        response = await laravel.post(
+            "/telegram/disable-notifications",
+            json={"telegram_id": telegram_id}
+        )
+        if response.status == 200:
+            # Удаляем пользователя из локальной БД
+            await user_storage.remove_user(int(telegram_id))
+            registration_cache.invalidate(telegram_id)
             
-            async with session.post(
-                f"{API_URL}/telegram/disable-notifications",
-                json={"telegram_id": telegram_id},
-                headers=headers
-            ) as response:
-                if response.status == 200:
-                    # Удаляем пользователя из локальной БД
-                    from storage import remove_user
-                    remove_user(int(telegram_id))
-                    
-                    await message.answer("🔕 Вы успешно отписались от уведомлений.")
-                    logger.info(f"Пользователь {telegram_id} отписался от уведомлений")
-                else:
-                    logger.warning(f"Ошибка отписки пользователя {telegram_id}: {response.status}")
-                    await message.answer("⚠️ Произошла ошибка при отписке. Попробуйте позже.")
+            await message.answer("🔕 Вы успешно отписались от уведомлений.")
+            logger.info(f"Пользователь {telegram_id} отписался от уведомлений")
+        else:
+            logger.warning(f"Ошибка отписки пользователя {telegram_id}: {response.status}")
+            await message.answer("⚠️ Произошла ошибка при отписке. Попробуйте позже.")
                     
     except Exception as e:
         logger.error(f"Ошибка при отписке пользователя {telegram_id}: {e}")
@@ -222,65 +468,206 @@ async def handle_id(message: Message):
 @dp.message(lambda msg: msg.contact is not None)
 async def handle_contact(message: Message):
     """Обработка контакта пользователя"""
-    contact = message.contact
+    await register_phone(message, message.contact.phone_number)
+
+@dp.message(lambda msg: msg.text is not None and looks_like_phone(msg.text))
+async def handle_phone_text(message: Message):
+    """Номер, набранный вручную вместо кнопки контакта (8…, 00…, без кода страны)"""
+    await register_phone(message, message.text, manual=True)
+
+async def register_phone(message: Message, raw_phone: str, manual: bool = False):
+    """Регистрация по номеру из контакта или из текста сообщения"""
     telegram_id = str(message.from_user.id)
-    phone_number = contact.phone_number
     
-    # Нормализация номера телефона
-    phone_number = phone_number.replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-    if not phone_number.startswith('+'):
-        phone_number = '+' + phone_number
+    try:
+        registration = TelegramRegistration.model_validate(
+            {"phone": raw_phone, "telegram_id": telegram_id}, context={"manual": manual}
+        )
+    except ValidationError:
+        logger.warning(f"Некорректный номер телефона от пользователя {telegram_id}: {raw_phone!r}")
+        await message.answer("❌ Не удалось распознать номер телефона. Отправьте контакт кнопкой ниже.")
+        return
+    phone_number = registration.phone
     
-    logger.info(f"Получен контакт от пользователя {telegram_id}: {phone_number}")
+    logger.info(f"Получен {'номер' if manual else 'контакт'} от пользователя {telegram_id}: {phone_number}")
     
     try:
-        async with aiohttp.ClientSession() as session:
-            headers = {
-                'Authorization': f'Bearer {LARAVEL_BEARER_TOKEN}',
-                'Content-Type': 'application/json'
-            }
+        status, source = await registration_cache.register(telegram_id, phone_number)
+        
+        if status == 200:
+            success_text = (
+                "✅ <b>Регистрация успешна!</b>\n\n"
+                "Теперь вы будете получать уведомления о новых заявках "
+                "на аренду спецтехники, соответствующих вашему оборудованию."
+            )
+            await message.answer(success_text, parse_mode="HTML")
+            logger.info(f"Пользователь {telegram_id} успешно зарегистрирован с номером {phone_number} ({source})")
             
-            registration_data = {
-                "phone": phone_number,
-                "telegram_id": telegram_id
-            }
+        elif status == 404:
+            error_text = (
+                "❌ <b>Пользователь не найден</b>\n\n"
+                "Ваш номер телефона не зарегистрирован в системе Proton. "
+                "Пожалуйста, сначала зарегистрируйтесь в приложении или на сайте."
+            )
+            await message.answer(error_text, parse_mode="HTML")
+            logger.warning(f"Пользователь с номером {phone_number} не найден в системе ({source})")
             
-            async with session.post(
-                f"{API_URL}/telegram/register",
-                json=registration_data,
-                headers=headers
-            ) as response:
-                
-                if response.status == 200:
-                    # Добавляем пользователя в локальную БД для уведомлений
-                    from storage import add_user
-                    add_user(int(telegram_id))
-                    
-                    success_text = (
-                        "✅ <b>Регистрация успешна!</b>\n\n"
-                        "Теперь вы будете получать уведомления о новых заявках "
-                        "на аренду спецтехники, соответствующих вашему оборудованию."
-                    )
-                    await message.answer(success_text, parse_mode="HTML")
-                    logger.info(f"Пользователь {telegram_id} успешно зарегистрирован с номером {phone_number}")
-                    
-                elif response.status == 404:
-                    error_text = (
-                        "❌ <b>Пользователь не найден</b>\n\n"
-                        "Ваш номер телефона не зарегистрирован в системе Proton. "
-                        "Пожалуйста, сначала зарегистрируйтесь в приложении или на сайте."
-                    )
-                    await message.answer(error_text, parse_mode="HTML")
-                    logger.warning(f"Пользователь с номером {phone_number} не найден в системе")
-                    
-                else:
-                    logger.error(f"Ошибка регистрации пользователя {telegram_id}: HTTP {response.status}")
-                    await message.answer("⚠️ Произошла ошибка при регистрации. Попробуйте позже.")
+        else:
+            logger.error(f"Ошибка регистрации пользователя {telegram_id}: HTTP {status}")
+            await message.answer("⚠️ Произошла ошибка при регистрации. Попробуйте позже.")
                     
     except Exception as e:
         logger.error(f"Исключение при регистрации пользователя {telegram_id}: {e}")
         await message.answer("❌ Сервис временно недоступен. Попробуйте позже.")
 
+# --- Уведомления о заказах ---
+
+async def send_telegram_message(chat_id, text: str, reply_markup=None, order_ids=()):
+    """
+    Отправка сообщения в Telegram (общая точка для эндпоинтов и очереди).
+    Для уведомлений о заказах (order_ids) попытка записывается в журнал доставки
+    """
+    started = time.perf_counter()
+    try:
+        message = await bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            reply_markup=reply_markup,
+            parse_mode="HTML"
+        )
+    except Exception as e:
+        latency = time.perf_counter() - started
+        metrics.TELEGRAM_SEND_LATENCY.labels("error").observe(latency)
+        metrics.TELEGRAM_SEND_ERRORS.labels(type(e).__name__).inc()
+        # Заблокировавший бота или удалённый чат больше не получает уведомлений
+        reason = await dead_recipients.record(chat_id, e)
+        for order_id in order_ids:
+            delivery_journal.record(
+                chat_id, order_id, status="unreachable" if reason else "failed",
+                latency=latency, error=type(e).__name__
+            )
+        raise
+    latency = time.perf_counter() - started
+    metrics.TELEGRAM_SEND_LATENCY.labels("ok").observe(latency)
+    health_monitor.record_send_ok()
+    for order_id in order_ids:
+        delivery_journal.record(chat_id, order_id, message_id=message.message_id, latency=latency)
+    if len(order_ids) == 1:
+        # Сообщение об одном заказе можно править и отзывать; сводки — нет
+        await delivery_journal.index_message(chat_id, order_ids[0], message.message_id)
+    return message
+
+async def send_order_message(chat_id, text: str, reply_markup=None, order_ids=(), max_wait: Optional[float] = None):
+    """
+    Уведомление о заказе без очереди: токен общего лимита классом transactional.
+    Синхронные эндпоинты передают max_wait=NOTIFY_SYNC_MAX_WAIT: если токен не достанется
+    за это время, запрос сразу получает QueueDelayExceeded (503 с Retry-After),
+    а не держит вызывающую сторону Laravel до PRIORITY_MAX_DELAY_TRANSACTIONAL
+    """
+    try:
+        await send_scheduler.acquire(TRANSACTIONAL, max_wait=max_wait)
+    except QueueDelayExceeded as e:
+        # До Telegram дело не дошло: отказ в журнал пишем здесь
+        for order_id in order_ids:
+            delivery_journal.record(chat_id, order_id, status="failed", error=type(e).__name__)
+        raise
+    return await send_telegram_message(chat_id, text, reply_markup=reply_markup, order_ids=order_ids)
+
+# Одновременные уведомления об одном заказе одному получателю (старая и новая
+# интеграция шлют в /notify и /notify-webhook параллельно) отправляются один раз
+notify_flight = SingleFlight()
+
+async def send_order_notification(telegram_id: str, order_id, message_text: str, keyboard) -> bool:
+    """
+    Отправка уведомления о заказе с схлопыванием одновременных дублей по (telegram_id, order_id).
+    Возвращает True, если запрос дождался уже идущей отправки, а не отправлял сам
+    """
+    key = (str(telegram_id), str(order_id))
+    shared = notify_flight.in_flight(key)
+    if shared:
+        metrics.NOTIFY_SHARED.inc()
+        logger.info(f"Уведомление о заказе {order_id} пользователю {telegram_id} уже отправляется, ждём его результат")
+    await notify_flight.do(
+        key, lambda: send_order_message(
+            telegram_id, message_text, reply_markup=keyboard, order_ids=[order_id], max_wait=NOTIFY_SYNC_MAX_WAIT
+        )
+    )
+    return shared
+
+async def enqueue_message(chat_ids, text: str, reply_markup=None, order_ids=()) -> list:
+    """Ставит сообщение в очередь отправки и будит диспетчер"""
+    job_ids = await send_queue.enqueue_many(chat_ids, text, reply_markup, order_ids)
+    if send_dispatcher is not None:
+        send_dispatcher.notify()
+    return job_ids
+
+async def send_order_digest(telegram_id: str, orders: list):
+    """Отправка склеенных заявок: одна — обычным шаблоном, несколько — сводкой"""
+    if len(orders) == 1:
+        message_text, keyboard = renderer.render("new_order", orders[0])
+    else:
+        message_text, keyboard = renderer.render_digest(orders)
+        logger.info(f"📦 Сводка из {len(orders)} заявок пользователю {telegram_id}")
+    order_ids = [order.order_id for order in orders]
+    if SEND_QUEUE_ENABLED:
+        await enqueue_message([telegram_id], message_text, keyboard, order_ids)
+    else:
+        await send_order_message(telegram_id, message_text, reply_markup=keyboard, order_ids=order_ids)
+
+# Окно склейки заявок по получателю (при NOTIFY_COALESCE_WINDOW > 0)
+coalescer = NotificationCoalescer(
+    send_order_digest,
+    window=NOTIFY_COALESCE_WINDOW,
+    max_orders=NOTIFY_COALESCE_MAX,
+    max_attempts=NOTIFY_COALESCE_ATTEMPTS,
+    retry_delay=SEND_RETRY_BASE_DELAY
+)
+
+def coalesced_response(telegram_id: str, order_data: OrderData, response: Response, **data) -> ApiResponse:
+    """Заявка добавлена в окно склейки, сообщение уйдёт по его закрытии"""
+    pending = coalescer.add(telegram_id, order_data)
+    response.status_code = 202
+    return ApiResponse(
+        success=True,
+        message="Notification coalesced",
+        data={"telegram_id": telegram_id, "order_id": order_data.order_id, "pending": pending, **data}
+    )
+
+def raise_if_unavailable(error: Exception):
+    """Вызов отклонён автоматом или лимитом — 503 с Retry-After вместо 500"""
+    if isinstance(error, UpstreamUnavailableError):
+        raise HTTPException(
+            status_code=503,
+            detail=f"Upstream unavailable: {error}",
+            headers={"Retry-After": str(max(1, round(error.retry_after)))}
+        )
+
+def circuits_snapshot() -> dict:
+    return {guard.name: guard.snapshot() for guard in (telegram_guard, laravel_guard)}
+
+def skip_reason(telegram_id) -> Optional[str]:
+    """Почему не отправлять: отписка или недоступный чат (по индексу в памяти, без диска)"""
+    if not SKIP_UNSUBSCRIBED:
+        return None
+    return subscribers.inactive_reason(telegram_id)
+
+def skipped_response(telegram_id: str, reason: str, response: Response, **data) -> ApiResponse:
+    """Ответ без отправки: 200 для отписавшихся, 410 для недоступных чатов"""
+    if reason == "unsubscribed":
+        logger.info(f"🔕 Пользователь {telegram_id} отписан, уведомление пропущено")
+        return ApiResponse(
+            success=True,
+            message="Recipient unsubscribed, notification skipped",
+            data={"telegram_id": telegram_id, "skipped": reason, **data}
+        )
+    logger.info(f"🚫 Чат {telegram_id} недоступен ({reason}), уведомление не отправлено")
+    response.status_code = 410
+    return ApiResponse(
+        success=False,
+        message=f"Recipient unreachable: {reason}",
+        data={"telegram_id": telegram_id, "skipped": reason, **data}
+    )
+
 # --- FastAPI эндпоинты ---
 
 @app.get("/", response_model=ApiResponse)
@@ -291,32 +678,67 @@ async def root():
         message="Proton Telegram Bot API v2.0.0",
         data={
             "status": "active",
-            "endpoints": ["/notify", "/notify-legacy", "/notify-webhook", "/health"],
+            "endpoints": ["/notify", "/notify/batch", "/notify/order-update", "/notify/order-cancel", "/notify-legacy", "/notify-webhook", "/broadcast", "/health", "/livez", "/readyz"],
             "telegram_bot": "@proton_rent_bot"
         }
     )
 
 @app.get("/health", response_model=ApiResponse)
 async def health_check():
-    """Проверка здоровья сервиса"""
+    """Проверка здоровья сервиса (getMe берётся из кэша, если он свежий)"""
     try:
-        bot_info = await bot.get_me()
+        bot_info = health_monitor.bot_info
+        if bot_info is None or not health_monitor.is_ready():
+            bot_info = await bot.get_me()
         return ApiResponse(
             success=True,
             message="Service is healthy",
             data={
                 "bot_username": bot_info.username,
                 "bot_id": bot_info.id,
-                "api_url": API_URL
+                "api_url": API_URL,
+                "idempotency": idempotency_cache.stats(),
+                "circuits": circuits_snapshot(),
+                "send_lanes": send_scheduler.stats(),
+                "delivery_journal": delivery_journal.stats()
             }
         )
     except Exception as e:
         logger.error(f"Health check failed: {e}")
         raise HTTPException(status_code=503, detail="Service unhealthy")
 
+@app.get("/livez", response_model=ApiResponse)
+async def liveness(response: Response):
+    """Liveness проба: только состояние в памяти"""
+    if not health_monitor.is_alive():
+        response.status_code = 503
+        return ApiResponse(success=False, message="Health monitor is not running")
+    return ApiResponse(success=True, message="alive")
+
+@app.get("/readyz", response_model=ApiResponse)
+async def readiness(response: Response):
+    """Readiness проба: свежесть кэшированных проверок Telegram и SQLite"""
+    ready = health_monitor.is_ready()
+    if not ready:
+        response.status_code = 503
+    return ApiResponse(
+        success=ready,
+        message="ready" if ready else "not ready",
+        data={**health_monitor.snapshot(), "circuits": circuits_snapshot()}
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus (при METRICS_DIR — всех воркеров)"""
+    return PlainTextResponse(
+        await metrics_exporter.render() if metrics_exporter is not None else metrics.REGISTRY.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
 @app.post("/notify", response_model=ApiResponse)
 async def notify_laravel(
     data: LaravelNotification,
+    response: Response,
     token: str = Depends(verify_api_key)
 ):
     """
@@ -328,54 +750,221 @@ async def notify_laravel(
     
     logger.info(f"Получено уведомление от Laravel для пользователя {telegram_id}, заказ {order_data.order_id}")
     
-    # Формируем красивое сообщение
-    message_text = (
-        "🚛 <b>Новая заявка на аренду спецтехники</b>\n\n"
-        f"📋 <b>Тип техники:</b> {order_data.vehicle_type}\n"
-        f"📍 <b>Локация:</b> {order_data.location}\n"
-        f"📅 <b>Дата и время:</b> {order_data.date_time}\n"
-        f"💰 <b>Стоимость:</b> {order_data.price}\n\n"
-        "Нажмите кнопку ниже для просмотра деталей заявки."
-    )
+    reason = skip_reason(telegram_id)
+    if reason:
+        return skipped_response(telegram_id, reason, response, order_id=order_data.order_id)
     
-    # Создаем inline кнопку
-    # Используем order_url если передан, иначе формируем из order_id
-    order_url = order_data.order_url or f"https://app.protonrent.ru/orders/{order_data.order_id}"
+    if NOTIFY_COALESCE_WINDOW > 0:
+        return coalesced_response(telegram_id, order_data, response)
     
-    keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[[
-            InlineKeyboardButton(
-                text="📋 Перейти к заявке",
-                url=order_url
-            )
-        ]]
-    )
+    message_text, keyboard = renderer.render("new_order", order_data)
     
-    try:
-        await bot.send_message(
-            chat_id=telegram_id,
-            text=message_text,
-            reply_markup=keyboard,
-            parse_mode="HTML"
+    if SEND_QUEUE_ENABLED:
+        job_id = (await enqueue_message([telegram_id], message_text, keyboard, [order_data.order_id]))[0]
+        response.status_code = 202
+        return ApiResponse(
+            success=True,
+            message="Notification queued",
+            data={"telegram_id": telegram_id, "order_id": order_data.order_id, "job_id": job_id}
         )
+    
+    try:
+        shared = await send_order_notification(telegram_id, order_data.order_id, message_text, keyboard)
         
         logger.info(f"Уведомление успешно отправлено пользователю {telegram_id}")
         return ApiResponse(
             success=True,
             message="Notification sent successfully",
-            data={"telegram_id": telegram_id, "order_id": order_data.order_id}
+            data={"telegram_id": telegram_id, "order_id": order_data.order_id, **({"shared": True} if shared else {})}
         )
         
     except Exception as e:
+        reason = dead_recipient_reason(e)
+        if reason:
+            return skipped_response(telegram_id, reason, response, order_id=order_data.order_id)
         logger.error(f"Ошибка отправки уведомления пользователю {telegram_id}: {e}")
+        raise_if_unavailable(e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to send notification: {str(e)}"
         )
 
+@app.post("/notify/batch", response_model=ApiResponse)
+async def notify_batch(
+    data: BatchNotification,
+    response: Response,
+    token: str = Depends(verify_api_key)
+):
+    """
+    Пакетная рассылка уведомлений от Laravel
+    Сообщение для каждого заказа формируется один раз, отправка идёт
+    параллельно с ограничением NOTIFY_BATCH_CONCURRENCY
+    """
+    pairs = data.pairs()
+    if len(pairs) > NOTIFY_BATCH_MAX_RECIPIENTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many recipients: {len(pairs)} > {NOTIFY_BATCH_MAX_RECIPIENTS}"
+        )
+    
+    logger.info(f"Получено пакетное уведомление: {len(pairs)} получателей")
+    
+    # Отписавшимся и недоступным чатам не отправляем: проверка по индексу в памяти
+    skipped = {}
+    deliverable = []
+    for telegram_id, order_data in pairs:
+        reason = skip_reason(telegram_id)
+        if reason:
+            status = "skipped" if reason == "unsubscribed" else "unreachable"
+            skipped.setdefault(telegram_id, {})[order_data.order_id] = {"status": status, "reason": reason}
+        else:
+            deliverable.append((telegram_id, order_data))
+    skipped_count = len(pairs) - len(deliverable)
+    pairs = deliverable
+    if skipped_count:
+        logger.info(f"Пакетное уведомление: пропущено {skipped_count} уведомлений отписавшимся и недоступным")
+    
+    rendered = {}
+    for _, order_data in pairs:
+        if order_data.order_id not in rendered:
+            rendered[order_data.order_id] = renderer.render("new_order", order_data)
+    
+    if SEND_QUEUE_ENABLED:
+        results = dict(skipped)
+        for order_id, (message_text, keyboard) in rendered.items():
+            chat_ids = [telegram_id for telegram_id, order_data in pairs if order_data.order_id == order_id]
+            job_ids = await enqueue_message(chat_ids, message_text, keyboard, [order_id])
+            for telegram_id, job_id in zip(chat_ids, job_ids):
+                results.setdefault(telegram_id, {})[order_id] = {"status": "queued", "job_id": job_id}
+        response.status_code = 202
+        return ApiResponse(
+            success=True,
+            message=f"Batch queued: {len(pairs)} notifications",
+            data={"queued": len(pairs), "skipped": skipped_count, "results": results}
+        )
+    
+    semaphore = asyncio.Semaphore(NOTIFY_BATCH_CONCURRENCY)
+    
+    async def send_one(telegram_id: str, order_id: str):
+        message_text, keyboard = rendered[order_id]
+        async with semaphore:
+            try:
+                await send_order_notification(telegram_id, order_id, message_text, keyboard)
+                return {"status": "sent"}
+            except Exception as e:
+                reason = dead_recipient_reason(e)
+                if reason:
+                    return {"status": "unreachable", "reason": reason}
+                logger.error(f"Ошибка отправки уведомления пользователю {telegram_id}: {e}")
+                if isinstance(e, UpstreamUnavailableError):
+                    return {"status": "failed", "error": str(e), "retry_after": max(1, round(e.retry_after))}
+                return {"status": "failed", "error": str(e)}
+    
+    outcomes = await asyncio.gather(*(
+        send_one(telegram_id, order_data.order_id) for telegram_id, order_data in pairs
+    ))
+    
+    results = dict(skipped)
+    for (telegram_id, order_data), outcome in zip(pairs, outcomes):
+        results.setdefault(telegram_id, {})[order_data.order_id] = outcome
+    sent = sum(1 for outcome in outcomes if outcome["status"] == "sent")
+    failed = sum(1 for outcome in outcomes if outcome["status"] == "failed")
+    skipped_count += len(pairs) - sent - failed
+    
+    logger.info(f"Пакетное уведомление: отправлено {sent} из {len(pairs)}")
+    return ApiResponse(
+        success=failed == 0,
+        message=f"Batch processed: {sent} sent, {failed} failed, {skipped_count} skipped",
+        data={"sent": sent, "failed": failed, "skipped": skipped_count, "results": results}
+    )
+
+# Правки одного заказа одним текстом: повтор запроса Laravel присоединяется к идущей правке
+order_edit_flight = SingleFlight()
+order_edit_tasks = set()
+
+async def run_order_edit(key, edit) -> Optional[dict]:
+    """
+    Правка сообщений о заказе с бюджетом NOTIFY_EDIT_TIMEOUT: итог, если правка
+    уложилась, иначе None — правка продолжается в фоне и доживает до остановки
+    """
+    task = asyncio.ensure_future(order_edit_flight.do(key, edit))
+    order_edit_tasks.add(task)
+    task.add_done_callback(order_edit_tasks.discard)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), NOTIFY_EDIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        return None
+
+def order_edit_accepted(order_id, response: Response) -> ApiResponse:
+    response.status_code = 202
+    return ApiResponse(
+        success=True,
+        message="Order edit accepted, messages are being updated in background",
+        data={"order_id": order_id, "pending": True}
+    )
+
+@app.post("/notify/order-update", response_model=ApiResponse)
+async def notify_order_update(
+    data: OrderUpdateNotification,
+    response: Response,
+    token: str = Depends(verify_api_key)
+):
+    """
+    Изменение заказа: все отправленные о нём уведомления правятся на актуальный
+    текст с параллельностью NOTIFY_BATCH_CONCURRENCY. Если правка не уложилась
+    в NOTIFY_EDIT_TIMEOUT, ответ 202, а правка завершается в фоне
+    """
+    order_data = data.order_data
+    message_text, keyboard = renderer.render("order_updated", order_data)
+
+    async def edit():
+        summary = await order_messages.update(order_data.order_id, message_text, keyboard)
+        logger.info(f"✏️ Заказ {order_data.order_id} изменён: {summary}")
+        return summary
+
+    summary = await run_order_edit(("update", order_data.order_id, message_text), edit)
+    if summary is None:
+        return order_edit_accepted(order_data.order_id, response)
+    failed = summary.get("failed", 0)
+    return ApiResponse(
+        success=failed == 0,
+        message=f"Order update processed: {summary.get('edited', 0)} edited, {failed} failed",
+        data={"order_id": order_data.order_id, **summary}
+    )
+
+@app.post("/notify/order-cancel", response_model=ApiResponse)
+async def notify_order_cancel(
+    data: OrderCancelNotification,
+    response: Response,
+    token: str = Depends(verify_api_key)
+):
+    """
+    Отмена заказа: уведомления о нём удаляются (delete=true) или помечаются
+    отменёнными без кнопки перехода; бюджет ожидания — как у /notify/order-update
+    """
+    order_data = data.order_data
+    message_text, _ = renderer.render("order_cancelled", order_data)
+
+    async def edit():
+        summary = await order_messages.cancel(order_data.order_id, message_text, delete=data.delete)
+        logger.info(f"❌ Заказ {order_data.order_id} отменён: {summary}")
+        return summary
+
+    summary = await run_order_edit(("cancel", order_data.order_id, data.delete), edit)
+    if summary is None:
+        return order_edit_accepted(order_data.order_id, response)
+    failed = summary.get("failed", 0)
+    retracted = summary.get("edited", 0) + summary.get("deleted", 0)
+    return ApiResponse(
+        success=failed == 0,
+        message=f"Order cancel processed: {retracted} retracted, {failed} failed",
+        data={"order_id": order_data.order_id, **summary}
+    )
+
 @app.post("/notify-legacy", response_model=ApiResponse)
 async def notify_legacy(
     data: LegacyNotification,
+    response: Response,
     api_key: str = Depends(verify_legacy_api_key)
 ):
     """
@@ -386,6 +975,10 @@ async def notify_legacy(
     
     logger.info(f"Получено legacy уведомление для пользователя {telegram_id}")
     
+    reason = skip_reason(telegram_id)
+    if reason:
+        return skipped_response(telegram_id, reason, response)
+    
     # Подготавливаем клавиатуру если есть URL
     reply_markup = None
     if data.url:
@@ -395,13 +988,17 @@ async def notify_legacy(
             ]]
         )
     
-    try:
-        await bot.send_message(
-            chat_id=telegram_id,
-            text=data.text,
-            reply_markup=reply_markup,
-            parse_mode="HTML"
+    if SEND_QUEUE_ENABLED:
+        job_id = (await enqueue_message([telegram_id], data.text, reply_markup))[0]
+        response.status_code = 202
+        return ApiResponse(
+            success=True,
+            message="Legacy notification queued",
+            data={"telegram_id": telegram_id, "job_id": job_id}
         )
+    
+    try:
+        await send_order_message(telegram_id, data.text, reply_markup=reply_markup, max_wait=NOTIFY_SYNC_MAX_WAIT)
         
         logger.info(f"Legacy уведомление успешно отправлено пользователю {telegram_id}")
         return ApiResponse(
@@ -411,7 +1008,11 @@ async def notify_legacy(
         )
         
     except Exception as e:
+        reason = dead_recipient_reason(e)
+        if reason:
+            return skipped_response(telegram_id, reason, response)
         logger.error(f"Ошибка отправки legacy уведомления пользователю {telegram_id}: {e}")
+        raise_if_unavailable(e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to send legacy notification: {str(e)}"
@@ -419,101 +1020,183 @@ async def notify_legacy(
 
 @app.post("/notify-webhook", response_model=ApiResponse)
 async def notify_webhook(
-    request: Request,
-    token: str = Depends(verify_ebot_auth)
+    response: Response,
+    event: EbotEvent = Depends(verify_ebot_event)
 ):
     """
     eBot webhook endpoint для Laravel событий с Bearer + HMAC аутентификацией
     Обрабатывает структуру событий от TelegramBotIntegrationService
     """
     try:
-        # Получаем данные события
-        event_data = await request.json()
+        telegram_id = str(event.event_data.telegram_id)
+        order = event.event_data.order_data
+        correlation_id = event.correlation_id
+        idempotency_key = event.idempotency_key
         
-        # Извлекаем информацию о заказе из структуры события
-        telegram_id = event_data.get("event_data", {}).get("telegram_id")
-        order_data = event_data.get("event_data", {}).get("order_data", {})
-        correlation_id = event_data.get("correlation_id")
-        idempotency_key = event_data.get("idempotency_key")
-        
-        if not telegram_id or not order_data:
+        if not telegram_id:
             raise HTTPException(status_code=400, detail="Invalid event structure")
         
-        logger.info(f"Получено webhook событие для пользователя {telegram_id}, заказ {order_data.get('order_id')}, cid={correlation_id}")
+        # Повтор того же события: отдаём сохранённый ответ без отправки в Telegram
+        if idempotency_key:
+            cached = await idempotency_cache.lookup(idempotency_key)
+            if cached is not None:
+                cached_response, status_code = cached
+                logger.info(f"Повтор webhook события idempotency_key={idempotency_key}, cid={correlation_id}")
+                response.status_code = status_code
+                return ApiResponse(**cached_response)
         
-        # Формируем красивое сообщение
-        message_text = (
-            "🚛 <b>Новая заявка на аренду спецтехники</b>\n\n"
-            f"📋 <b>Тип техники:</b> {order_data.get('vehicle_type', 'Не указан')}\n"
-            f"📍 <b>Локация:</b> {order_data.get('location', 'Не указана')}\n"
-            f"📅 <b>Дата и время:</b> {order_data.get('date_time', 'Не указано')}\n"
-            f"💰 <b>Стоимость:</b> {order_data.get('price', 'Не указана')}\n\n"
-            "Нажмите кнопку ниже для просмотра деталей заявки."
-        )
+        logger.info(f"Получено webhook событие для пользователя {telegram_id}, заказ {order.order_id}, cid={correlation_id}")
         
-        # Создаем inline кнопку
-        order_url = order_data.get('order_url') or f"https://app.protonrent.ru/orders/{order_data.get('order_id')}"
+        message_text, keyboard = renderer.render("new_order", order.to_order_data())
+        event_info = {
+            "order_id": order.order_id,
+            "correlation_id": correlation_id,
+            "idempotency_key": idempotency_key
+        }
         
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[[
-                InlineKeyboardButton(
-                    text="📋 Перейти к заявке",
-                    url=order_url
+        reason = skip_reason(telegram_id)
+        if reason:
+            result = skipped_response(telegram_id, reason, response, **event_info)
+        elif NOTIFY_COALESCE_WINDOW > 0:
+            result = coalesced_response(
+                telegram_id,
+                order.to_order_data(),
+                response,
+                correlation_id=correlation_id,
+                idempotency_key=idempotency_key
+            )
+        elif SEND_QUEUE_ENABLED:
+            job_id = (await enqueue_message([telegram_id], message_text, keyboard, [order.order_id]))[0]
+            response.status_code = 202
+            result = ApiResponse(
+                success=True,
+                message="Webhook notification queued",
+                data={"telegram_id": telegram_id, **event_info, "job_id": job_id}
+            )
+        else:
+            try:
+                shared = await send_order_notification(telegram_id, order.order_id, message_text, keyboard)
+            except Exception as e:
+                reason = dead_recipient_reason(e)
+                if not reason:
+                    raise
+                result = skipped_response(telegram_id, reason, response, **event_info)
+            else:
+                logger.info(f"Webhook уведомление успешно отправлено пользователю {telegram_id}, cid={correlation_id}")
+                result = ApiResponse(
+                    success=True,
+                    message="Webhook notification sent successfully",
+                    data={"telegram_id": telegram_id, **event_info, **({"shared": True} if shared else {})}
                 )
-            ]]
-        )
         
-        await bot.send_message(
-            chat_id=telegram_id,
-            text=message_text,
-            reply_markup=keyboard,
-            parse_mode="HTML"
-        )
-        
-        logger.info(f"Webhook уведомление успешно отправлено пользователю {telegram_id}, cid={correlation_id}")
-        return ApiResponse(
-            success=True,
-            message="Webhook notification sent successfully",
-            data={
-                "telegram_id": telegram_id, 
-                "order_id": order_data.get('order_id'),
-                "correlation_id": correlation_id,
-                "idempotency_key": idempotency_key
-            }
-        )
+        if idempotency_key:
+            await idempotency_cache.store(idempotency_key, result.model_dump(), response.status_code or 200)
+        return result
         
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"Ошибка обработки webhook события: {e}")
+        raise_if_unavailable(e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to process webhook event: {str(e)}"
         )
 
+@app.get("/notify/jobs/{job_id}", response_model=ApiResponse)
+async def notify_job_status(
+    job_id: int,
+    token: str = Depends(verify_api_key)
+):
+    """Статус задачи из очереди отправки"""
+    if not SEND_QUEUE_ENABLED:
+        raise HTTPException(status_code=404, detail="Send queue is disabled")
+    job = await send_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ApiResponse(success=True, message=f"Job {job['status']}", data=job)
+
+async def forget_update(update_id: int):
+    """Снимает отметку дедупликации, чтобы повторная доставка была обработана"""
+    update_window.discard(update_id)
+    if SHARED_DEDUP:
+        await state_backend.delete(f"update:{update_id}")
+
 @app.post("/telegram/webhook")
-async def telegram_webhook(update: dict):
+async def telegram_webhook(
+    request: Request,
+    x_telegram_bot_api_secret_token: str = Header(default=None)
+):
     """
     Webhook endpoint для получения обновлений от Telegram
     """
+    # Проверяем секрет до чтения и разбора тела
+    if not x_telegram_bot_api_secret_token or not hmac.compare_digest(
+        x_telegram_bot_api_secret_token, TELEGRAM_WEBHOOK_SECRET
+    ):
+        metrics.TELEGRAM_UPDATES_DROPPED.labels("bad_secret").inc()
+        raise HTTPException(status_code=401, detail="Invalid secret token")
+    
     try:
-        logger.info(f"📨 Получено webhook сообщение: {update}")
+        update = json.loads(await request.body())
+        update_id = update["update_id"]
+    except (ValueError, KeyError, TypeError):
+        metrics.TELEGRAM_UPDATES_DROPPED.labels("malformed").inc()
+        raise HTTPException(status_code=400, detail="Malformed update")
+    
+    # Повторная доставка: подтверждаем без разбора и обработки
+    if not isinstance(update_id, int) or not update_window.add(update_id):
+        metrics.TELEGRAM_UPDATES_DROPPED.labels("duplicate").inc()
+        return {"ok": True}
+    if SHARED_DEDUP and not await state_backend.set_if_absent(f"update:{update_id}", "1", 3600):
+        metrics.TELEGRAM_UPDATES_DROPPED.labels("duplicate").inc()
+        return {"ok": True}
+    
+    try:
+        logger.info("📨 Получено обновление Telegram %s", update_id, extra={"sample": True})
+        if LOG_UPDATE_PAYLOADS and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📨 Тело обновления: {update}")
         
-        # Обрабатываем обновление через диспетчер
         telegram_update = types.Update(**update)
+        
+        if WEBHOOK_ASYNC_PROCESSING:
+            # Отвечаем сразу, обработка идёт в фоне; при переполнении Telegram повторит доставку
+            if not update_queue.submit(telegram_update):
+                await forget_update(update_id)
+                logger.warning(f"⚠️ Очередь обновлений переполнена, update_id={update_id}")
+                return JSONResponse(
+                    status_code=429,
+                    content={"ok": False, "detail": "Update queue is full"},
+                    headers={"Retry-After": "1"}
+                )
+            return {"ok": True}
+        
+        # Обрабатываем обновление через диспетчер
         await dp.feed_update(bot, telegram_update)
         
         return {"ok": True}
     except Exception as e:
+        await forget_update(update_id)
         logger.error(f"❌ Ошибка обработки webhook: {e}")
         raise HTTPException(status_code=500, detail=f"Webhook error: {str(e)}")
 
-if __name__ == "__main__":
+def main():
+    """
+    Точка входа start-bot. При BOT_WORKERS > 1 запускает несколько процессов uvicorn:
+    каждый воркер импортирует приложение заново и строит своё состояние в lifespan
+    (сессия бота, кэши, соединения SQLite), общий лимит Telegram — через RATE_LIMIT_FILE
+    """
     import uvicorn
+    
+    workers = 1 if DEBUG else BOT_WORKERS
     uvicorn.run(
         "main:app",
         host=BOT_HOST,
         port=BOT_PORT,
         reload=DEBUG,
+        workers=workers,
         log_level=LOG_LEVEL.lower()
-    )
\ No newline at end of file
+    )
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,153 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from html import escape
+from typing import Optional
+from urllib.parse import quote
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from models import OrderData
+
+# Лимит Telegram на длину текста сообщения
+MAX_MESSAGE_LENGTH = 4096
+
+ORDER_URL = "https://app.protonrent.ru/orders/{order_id}"
+
+ORDER_FIELDS = ("vehicle_type", "location", "date_time", "price")
+
+
+@dataclass(frozen=True)
+class MessageTemplate:
+    """Шаблон уведомления о заказе"""
+    name: str
+    title: str
+    footer: str
+    button_text: Optional[str] = None
+
+    def compile(self) -> str:
+        """Строка формата с плейсхолдерами полей заказа, собирается один раз"""
+        return (
+            f"{self.title}\n\n"
+            "📋 <b>Тип техники:</b> {vehicle_type}\n"
+            "📍 <b>Локация:</b> {location}\n"
+            "📅 <b>Дата и время:</b> {date_time}\n"
+            "💰 <b>Стоимость:</b> {price}"
+            + (f"\n\n{self.footer}" if self.footer else "")
+        )
+
+
+TEMPLATES = {
+    template.name: template
+    for template in (
+        MessageTemplate(
+            name="new_order",
+            title="🚛 <b>Новая заявка на аренду спецтехники</b>",
+            footer="Нажмите кнопку ниже для просмотра деталей заявки.",
+            button_text="📋 Перейти к заявке"
+        ),
+        MessageTemplate(
+            name="order_updated",
+            title="✏️ <b>Заявка на аренду спецтехники изменена</b>",
+            footer="Нажмите кнопку ниже для просмотра актуальных деталей заявки.",
+            button_text="📋 Перейти к заявке"
+        ),
+        MessageTemplate(
+            name="order_cancelled",
+            title="❌ <b>Заявка на аренду спецтехники отменена</b>",
+            footer="Заявка больше не актуальна."
+        ),
+    )
+}
+
+
+# Сводка нескольких заявок одному получателю
+DIGEST_TITLE = "🚛 <b>Новые заявки на аренду спецтехники: {count}</b>"
+DIGEST_ITEM = "<b>{index}.</b> {vehicle_type}\n📍 {location}\n📅 {date_time} · 💰 {price}"
+DIGEST_FOOTER = "Нажмите кнопку с номером заявки для просмотра деталей."
+DIGEST_BUTTON = "📋 Заявка {index}"
+# Ограничение длины одного поля в сводке, чтобы несколько заявок поместились в сообщение
+DIGEST_FIELD_LENGTH = 150
+
+
+def order_url(order_data: OrderData) -> str:
+    return order_data.order_url or ORDER_URL.format(order_id=quote(str(order_data.order_id), safe=""))
+
+
+class TemplateRenderer:
+    """
+    Рендер уведомлений по именованным шаблонам с HTML экранированием,
+    ограничением длины и LRU кэшем готового текста и клавиатуры
+    """
+
+    def __init__(self, templates: dict = TEMPLATES, cache_size: int = 1024):
+        self.templates = templates
+        self._compiled = {name: template.compile() for name, template in templates.items()}
+        self._render_cached = lru_cache(maxsize=cache_size)(self._render)
+
+    def render(self, template_name: str, order_data: OrderData):
+        """Возвращает (text, reply_markup) для заказа"""
+        if template_name not in self.templates:
+            raise KeyError(f"Unknown message template: {template_name}")
+        return self._render_cached(
+            template_name,
+            order_url(order_data),
+            *(getattr(order_data, field) for field in ORDER_FIELDS)
+        )
+
+    def cache_info(self):
+        return self._render_cached.cache_info()
+
+    def render_digest(self, orders: list):
+        """
+        Одно сообщение о нескольких заявках: нумерованный список и кнопка на каждую.
+        Если список не помещается в лимит Telegram, хвост заменяется счётчиком,
+        кнопки остаются для всех заявок
+        """
+        blocks = []
+        for index, order_data in enumerate(orders, 1):
+            values = {
+                field: escape(self._shorten(getattr(order_data, field)), quote=False)
+                for field in ORDER_FIELDS
+            }
+            blocks.append(DIGEST_ITEM.format(index=index, **values))
+
+        title = DIGEST_TITLE.format(count=len(orders))
+        text = "\n\n".join([title, *blocks, DIGEST_FOOTER])
+        while len(text) > MAX_MESSAGE_LENGTH and len(blocks) > 1:
+            blocks.pop()
+            rest = f"…и ещё {len(orders) - len(blocks)}"
+            text = "\n\n".join([title, *blocks, rest, DIGEST_FOOTER])
+
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=DIGEST_BUTTON.format(index=index), url=order_url(order_data))]
+            for index, order_data in enumerate(orders, 1)
+        ])
+        return text, keyboard
+
+    @staticmethod
+    def _shorten(value: str) -> str:
+        return value if len(value) <= DIGEST_FIELD_LENGTH else value[:DIGEST_FIELD_LENGTH - 1] + "…"
+
+    def _render(self, template_name: str, url: str, *values):
+        template = self.templates[template_name]
+        text = self._format(self._compiled[template_name], dict(zip(ORDER_FIELDS, values)))
+
+        keyboard = None
+        if template.button_text:
+            keyboard = InlineKeyboardMarkup(
+                inline_keyboard=[[InlineKeyboardButton(text=template.button_text, url=url)]]
+            )
+        return text, keyboard
+
+    @staticmethod
+    def _format(compiled: str, values: dict) -> str:
+        text = compiled.format(**{key: escape(value, quote=False) for key, value in values.items()})
+        # Слишком длинный текст: укорачиваем самое длинное поле до исходного значения,
+        # чтобы не разрезать HTML теги и сущности
+        while len(text) > MAX_MESSAGE_LENGTH:
+            key = max(values, key=lambda k: len(values[k]))
+            overflow = len(text) - MAX_MESSAGE_LENGTH
+            values[key] = values[key][:max(0, len(values[key]) - overflow - 1)] + "…"
+            text = compiled.format(**{k: escape(v, quote=False) for k, v in values.items()})
+        return text
+
@@ -0,0 +1,335 @@
+import asyncio
+import os
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+
+# Границы бакетов гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """Значение метрики для одного набора меток"""
+
+    @abstractmethod
+    def _render(self, labels, values, child) -> list:
+        """Строки сэмплов одного набора меток"""
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render(_format_labels(self.labelnames, values), values, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _render(self, labels, values, child):
+        return [f"{self.name}{labels} {child.value}"]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def _render(self, labels, values, child):
+        return [f"{self.name}{labels} {child.value}"]
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render(self, labels, values, child):
+        names = self.labelnames + ("le",)
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(names, values + (le,))} {cumulative}")
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    """Набор метрик процесса в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, worker: str = None) -> str:
+        """Текст для /metrics; с worker к каждому сэмплу добавляется метка worker"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        if worker is not None:
+            lines = [_add_worker_label(line, worker) for line in lines]
+        return "\n".join(lines) + "\n"
+
+
+def _add_worker_label(line: str, worker: str) -> str:
+    if line.startswith("#"):
+        return line
+    name, sep, rest = line.partition("{")
+    label = f'worker="{_escape(worker)}"'
+    if sep:
+        return f"{name}{{{label},{rest}"
+    name, value = line.split(" ", 1)
+    return f"{name}{{{label}}} {value}"
+
+
+class MultiprocessExporter:
+    """
+    Метрики нескольких воркеров uvicorn: каждый процесс раз в interval секунд
+    пишет свой реестр (с меткой worker=<pid>) в файл <directory>/<pid>.prom,
+    а /metrics любого воркера склеивает все файлы. Файлы старше stale_after
+    (воркер упал и перезапущен с другим pid) пропускаются
+    """
+
+    def __init__(self, directory: str, registry: "Registry", interval: float = 5.0, stale_after: float = None):
+        self.directory = directory
+        self.registry = registry
+        self.interval = interval
+        self.stale_after = stale_after or interval * 3
+        self.worker = str(os.getpid())
+        self.path = os.path.join(directory, f"{self.worker}.prom")
+        self._task = None
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    async def _run(self):
+        while True:
+            await asyncio.to_thread(self._write, self.registry.render(self.worker))
+            await asyncio.sleep(self.interval)
+
+    def _write(self, text: str):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+
+    async def render(self) -> str:
+        """Метрики всех живых воркеров: сэмплы одной метрики под общими HELP/TYPE"""
+        # Реестр читается в event loop, файлы — в потоке
+        return await asyncio.to_thread(self._merge, self.registry.render(self.worker))
+
+    def _merge(self, own: str) -> str:
+        self._write(own)
+        families = {}
+        now = time.time()
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".prom"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.stale_after:
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    text = f.read()
+            except FileNotFoundError:
+                continue
+            family = None
+            for line in text.splitlines():
+                if line.startswith("# HELP "):
+                    family = families.setdefault(line.split(" ", 3)[2], {"header": [line], "samples": []})
+                elif line.startswith("# TYPE "):
+                    if len(family["header"]) == 1:
+                        family["header"].append(line)
+                elif line and family is not None:
+                    family["samples"].append(line)
+        lines = []
+        for family in families.values():
+            lines.extend(family["header"])
+            lines.extend(family["samples"])
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "proton_http_requests_total", "HTTP запросы по маршруту и статусу", ("route", "method", "status")
+))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "proton_http_request_duration_seconds", "Время обработки HTTP запроса", ("route",)
+))
+TELEGRAM_SEND_LATENCY = REGISTRY.register(Histogram(
+    "proton_telegram_send_duration_seconds", "Время вызова Telegram sendMessage", ("result",)
+))
+TELEGRAM_SEND_ERRORS = REGISTRY.register(Counter(
+    "proton_telegram_send_errors_total", "Ошибки отправки в Telegram по типу исключения", ("error",)
+))
+LARAVEL_LATENCY = REGISTRY.register(Histogram(
+    "proton_laravel_request_duration_seconds", "Время запроса к Laravel API", ("path", "status")
+))
+TELEGRAM_UPDATES_DROPPED = REGISTRY.register(Counter(
+    "proton_telegram_updates_dropped_total", "Отброшенные входящие обновления Telegram", ("reason",)
+))
+DEAD_RECIPIENTS = REGISTRY.register(Counter(
+    "proton_dead_recipients_total", "Чаты, отключённые из-за ошибок отправки, по причине", ("reason",)
+))
+CIRCUIT_STATE = REGISTRY.register(Gauge(
+    "proton_circuit_state", "Состояние автомата внешнего сервиса: 0 — замкнут, 1 — проба, 2 — разомкнут", ("upstream",)
+))
+CIRCUIT_REJECTED = REGISTRY.register(Counter(
+    "proton_circuit_rejected_total", "Вызовы, отклонённые без обращения к сервису", ("upstream", "reason")
+))
+CONCURRENCY_LIMIT = REGISTRY.register(Gauge(
+    "proton_concurrency_limit", "Текущий адаптивный лимит одновременных запросов", ("upstream",)
+))
+CONCURRENCY_INFLIGHT = REGISTRY.register(Gauge(
+    "proton_concurrency_inflight", "Запросы к сервису в работе", ("upstream",)
+))
+SEND_LANE_WAIT = REGISTRY.register(Histogram(
+    "proton_send_lane_wait_seconds", "Ожидание токена лимита Telegram по классу отправки", ("lane",)
+))
+SEND_LANE_EXPIRED = REGISTRY.register(Counter(
+    "proton_send_lane_expired_total", "Отправки, ждавшие токен дольше допустимого для класса", ("lane",)
+))
+DELIVERIES = REGISTRY.register(Counter(
+    "proton_deliveries_total", "Попытки отправки уведомлений о заказах по статусу журнала", ("status",)
+))
+NOTIFY_SHARED = REGISTRY.register(Counter(
+    "proton_notify_shared_total", "Уведомления, дождавшиеся одновременной отправки того же заказа тому же получателю"
+))
+ORDER_MESSAGE_UPDATES = REGISTRY.register(Counter(
+    "proton_order_message_updates_total", "Правки и удаления отправленных сообщений о заказах", ("action", "status")
+))
+REGISTRATIONS = REGISTRY.register(Counter(
+    "proton_registrations_total", "Регистрации по контакту: источник ответа и статус Laravel", ("source", "status")
+))
+SEND_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "proton_send_queue_depth", "Неотправленные задачи в очереди отправки"
+))
+EVENT_LOOP_LAG = REGISTRY.register(Histogram(
+    "proton_event_loop_lag_seconds", "Задержка event loop относительно расписания",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+))
+
+
+class MetricsMiddleware:
+    """ASGI middleware: счётчики и гистограммы задержки по шаблону маршрута"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Шаблон маршрута вместо пути, чтобы не плодить метки
+            path = route.path if route is not None else "unmatched"
+            HTTP_LATENCY.labels(path).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(path, scope["method"], str(status)).inc()
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Фоновая задача: измеряет, насколько позже запланированного просыпается корутина"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
@@ -1,7 +1,9 @@
-from pydantic import BaseModel, Field
-from typing import Optional, Union
+from pydantic import BaseModel, Field, ValidationInfo, field_validator, model_validator
+from typing import List, Optional, Union
 from datetime import datetime
 
+from phone import normalize_phone
+
 class OrderData(BaseModel):
     """Данные заказа для уведомлений"""
     order_id: str = Field(..., description="ID заказа")
@@ -16,17 +18,104 @@ class LaravelNotification(BaseModel):
     telegram_id: Union[str, int] = Field(..., description="Telegram ID пользователя")
     order_data: OrderData = Field(..., description="Данные заказа")
 
+class BatchNotification(BaseModel):
+    """Пакетное уведомление: один заказ на много получателей или список уведомлений"""
+    order_data: Optional[OrderData] = Field(None, description="Данные заказа (общие для всех получателей)")
+    telegram_ids: Optional[List[Union[str, int]]] = Field(None, description="Список Telegram ID получателей")
+    notifications: Optional[List[LaravelNotification]] = Field(None, description="Список отдельных уведомлений")
+
+    @model_validator(mode="after")
+    def check_payload(self):
+        has_fanout = self.order_data is not None or self.telegram_ids is not None
+        if has_fanout == (self.notifications is not None):
+            raise ValueError("Укажите либо order_data + telegram_ids, либо notifications")
+        if has_fanout and (self.order_data is None or not self.telegram_ids):
+            raise ValueError("Для рассылки заказа нужны order_data и непустой telegram_ids")
+        if self.notifications is not None and not self.notifications:
+            raise ValueError("Список notifications не может быть пустым")
+        return self
+
+    def pairs(self) -> List[tuple]:
+        """Пары (telegram_id, order_data) без повторов получателя"""
+        if self.notifications is not None:
+            items = [(str(n.telegram_id), n.order_data) for n in self.notifications]
+        else:
+            items = [(str(tid), self.order_data) for tid in self.telegram_ids]
+        seen = set()
+        result = []
+        for telegram_id, order_data in items:
+            key = (telegram_id, order_data.order_id)
+            if key not in seen:
+                seen.add(key)
+                result.append((telegram_id, order_data))
+        return result
+
+class EbotOrderData(BaseModel):
+    """Данные заказа из события eBot: кроме order_id поля необязательны"""
+    order_id: Union[str, int] = Field(..., description="ID заказа")
+    vehicle_type: Optional[Union[str, int, float]] = Field(None, description="Тип техники")
+    location: Optional[Union[str, int, float]] = Field(None, description="Локация")
+    date_time: Optional[Union[str, int, float]] = Field(None, description="Дата и время")
+    price: Optional[Union[str, int, float]] = Field(None, description="Стоимость")
+    order_url: Optional[str] = Field(None, description="Полный URL заказа")
+
+    def to_order_data(self) -> OrderData:
+        """OrderData с подстановкой значений по умолчанию"""
+        return OrderData(
+            order_id=str(self.order_id),
+            vehicle_type=str(self.vehicle_type or 'Не указан'),
+            location=str(self.location or 'Не указана'),
+            date_time=str(self.date_time or 'Не указано'),
+            price=str(self.price or 'Не указана'),
+            order_url=self.order_url
+        )
+
+class EbotEventData(BaseModel):
+    """Полезная нагрузка события eBot"""
+    telegram_id: Union[str, int] = Field(..., description="Telegram ID пользователя")
+    order_data: EbotOrderData = Field(..., description="Данные заказа")
+
+class EbotEvent(BaseModel):
+    """Событие eBot от TelegramBotIntegrationService"""
+    event_type: Optional[str] = Field(None, description="Тип события")
+    event_data: EbotEventData = Field(..., description="Данные события")
+    correlation_id: Optional[str] = Field(None, description="ID корреляции для логов")
+    idempotency_key: Optional[str] = Field(None, description="Ключ идемпотентности")
+
 class LegacyNotification(BaseModel):
     """Старая структура для обратной совместимости"""
     telegram_id: Union[str, int] = Field(..., description="Telegram ID пользователя")
     text: str = Field(..., description="Текст сообщения")
     url: Optional[str] = Field(None, description="URL для кнопки")
 
+class BroadcastRequest(BaseModel):
+    """Рассылка сообщения всем подписчикам"""
+    text: str = Field(..., min_length=1, max_length=4096, description="Текст сообщения (HTML)")
+    url: Optional[str] = Field(None, description="URL для кнопки")
+    button_text: str = Field("🔗 Перейти", description="Текст кнопки")
+
+class OrderUpdateNotification(BaseModel):
+    """Изменение заказа: правка всех отправленных о нём сообщений"""
+    order_data: OrderData = Field(..., description="Актуальные данные заказа")
+
+class OrderCancelNotification(BaseModel):
+    """Отмена заказа: отзыв всех отправленных о нём сообщений"""
+    order_data: OrderData = Field(..., description="Данные отменённого заказа")
+    delete: bool = Field(False, description="Удалить сообщения вместо пометки об отмене")
+
 class TelegramRegistration(BaseModel):
-    """Регистрация пользователя в Telegram"""
-    phone: str = Field(..., pattern=r'^\+?\d{10,15}$', description="Номер телефона")
+    """
+    Регистрация пользователя в Telegram. Номер из контакта уже с кодом страны;
+    набранный вручную валидируется с context={"manual": True}
+    """
+    phone: str = Field(..., description="Номер телефона в E.164")
     telegram_id: Union[str, int] = Field(..., description="Telegram ID")
 
+    @field_validator("phone", mode="before")
+    @classmethod
+    def normalize(cls, value, info: ValidationInfo):
+        return normalize_phone(value, manual=bool(info.context and info.context.get("manual")))
+
 class ApiResponse(BaseModel):
     """Стандартный ответ API"""
     success: bool = Field(..., description="Статус операции")
@@ -1,31 +1,66 @@
+from fastapi import APIRouter, Request, HTTPException, Depends
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-from fastapi import APIRouter, Request, Header, HTTPException
-from storage import get_users
-from bot import bot
-import datetime
+from auth import verify_api_key
+from models import ApiResponse, BroadcastRequest
 
-router = APIRouter()
+router = APIRouter(prefix="/broadcast")
 
-AUTH_SECRET = "proton-secret-token"  # секрет должен храниться в env в боевом
 
-@router.post("/notify")
-async def notify(request: Request, authorization: str = Header(None)):
-    if authorization != f"Bearer {AUTH_SECRET}":
-        raise HTTPException(status_code=401, detail="Unauthorized")
+def _engine(request: Request):
+    engine = getattr(request.app.state, "broadcast_engine", None)
+    if engine is None:
+        raise HTTPException(status_code=503, detail="Broadcast engine is not running")
+    return engine
 
-    data = await request.json()
 
-    # логирование
-    with open("log.txt", "a") as log:
-        log.write(f"{datetime.datetime.now().isoformat()} | {data}\n")
+@router.post("", response_model=ApiResponse, status_code=202)
+async def start_broadcast(
+    data: BroadcastRequest,
+    request: Request,
+    token: str = Depends(verify_api_key)
+):
+    """Запуск рассылки всем подписчикам (выполняется в фоне)"""
+    engine = _engine(request)
 
-    message = f"Новая заявка: *{data['type']}* — *{data['location']}* — *{data['date']}*."
-    message += f"\n[Перейти к заявке]({data['url']})"
+    reply_markup = None
+    if data.url:
+        reply_markup = InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text=data.button_text, url=data.url)]]
+        )
 
-    for user_id in get_users():
-        try:
-            await bot.send_message(user_id, message)
-        except Exception:
-            continue
+    broadcast_id = await engine.start(data.text, reply_markup)
+    return ApiResponse(
+        success=True,
+        message="Broadcast started",
+        data={"broadcast_id": broadcast_id}
+    )
 
-    return {"status": "ok"}
+
+@router.get("/{broadcast_id}", response_model=ApiResponse)
+async def broadcast_status(
+    broadcast_id: int,
+    request: Request,
+    token: str = Depends(verify_api_key)
+):
+    """Прогресс рассылки"""
+    engine = _engine(request)
+    broadcast = await engine.storage.get_broadcast(broadcast_id)
+    if broadcast is None:
+        raise HTTPException(status_code=404, detail="Broadcast not found")
+    broadcast.pop("text")
+    broadcast.pop("reply_markup")
+    return ApiResponse(success=True, message=f"Broadcast {broadcast['status']}", data=broadcast)
+
+
+@router.delete("/{broadcast_id}", response_model=ApiResponse)
+async def cancel_broadcast(
+    broadcast_id: int,
+    request: Request,
+    token: str = Depends(verify_api_key)
+):
+    """Отмена рассылки"""
+    engine = _engine(request)
+    if not await engine.cancel(broadcast_id):
+        raise HTTPException(status_code=404, detail="Running broadcast not found")
+    return ApiResponse(success=True, message="Broadcast cancelled", data={"broadcast_id": broadcast_id})
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from typing import Callable, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+import metrics
+from dead_recipients import dead_recipient_reason
+
+logger = logging.getLogger(__name__)
+
+# Тексты ошибок Bot API, после которых править сообщение уже нечего
+MISSING_MESSAGE_ERRORS = ("message to edit not found", "message to delete not found", "message can't be edited")
+
+
+class OrderMessageEditor:
+    """
+    Правка и отзыв отправленных уведомлений о заказе. Сообщения берутся из индекса
+    order_id → (chat_id, message_id), который пишет журнал доставки; вызовы Bot API
+    идут параллельно не более concurrency штук и берут токен общего лимита у limiter.
+    Итог — счётчики по статусам: edited, deleted, unchanged, missing, unreachable, failed
+    """
+
+    def __init__(
+        self,
+        storage,
+        bot,
+        limiter,
+        concurrency: int = 20,
+        record_dead: Optional[Callable] = None
+    ):
+        self.storage = storage
+        self.bot = bot
+        self.limiter = limiter
+        self.concurrency = max(1, concurrency)
+        self.record_dead = record_dead
+
+    async def update(self, order_id, text: str, reply_markup=None) -> dict:
+        """Заменяет текст и клавиатуру во всех сообщениях о заказе"""
+        messages = await self.storage.get_order_messages(order_id)
+        outcomes = await self._run(
+            messages, lambda chat_id, message_id: self._edit(chat_id, message_id, text, reply_markup)
+        )
+        return await self._summary("update", order_id, messages, outcomes)
+
+    async def cancel(self, order_id, text: str, delete: bool = False) -> dict:
+        """
+        Отзывает сообщения о заказе: delete=True удаляет их, иначе текст заменяется
+        на text без кнопки. Бот может удалить только сообщение младше 48 часов,
+        поэтому при неудачном удалении сообщение правится. Из индекса уходят все
+        сообщения, кроме неудавшихся (failed): их можно отозвать повторным вызовом
+        """
+        messages = await self.storage.get_order_messages(order_id)
+
+        async def retract(chat_id, message_id):
+            if delete:
+                status = await self._delete(chat_id, message_id)
+                if status != "failed":
+                    return status
+            return await self._edit(chat_id, message_id, text, None)
+
+        outcomes = await self._run(messages, retract)
+        summary = await self._summary("cancel", order_id, messages, outcomes)
+        done = [chat_id for (chat_id, _), status in zip(messages, outcomes) if status != "failed"]
+        if done:
+            await self.storage.delete_order_messages(order_id, done)
+        return summary
+
+    async def _run(self, messages, action) -> list:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_one(chat_id, message_id):
+            async with semaphore:
+                return await action(chat_id, message_id)
+
+        return await asyncio.gather(*(run_one(chat_id, message_id) for chat_id, message_id in messages))
+
+    async def _summary(self, action: str, order_id, messages, outcomes) -> dict:
+        summary = {"messages": len(messages)}
+        missing = []
+        for (chat_id, _), status in zip(messages, outcomes):
+            summary[status] = summary.get(status, 0) + 1
+            metrics.ORDER_MESSAGE_UPDATES.labels(action, status).inc()
+            if status in ("missing", "unreachable"):
+                missing.append(chat_id)
+        if missing and action == "update":
+            # Удалённые сообщения и недоступные чаты больше не правим
+            await self.storage.delete_order_messages(order_id, missing)
+        return summary
+
+    async def _edit(self, chat_id: int, message_id: int, text: str, reply_markup) -> str:
+        async def edit():
+            await self.bot.edit_message_text(
+                text=text,
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=reply_markup,
+                parse_mode="HTML"
+            )
+            return "edited"
+        return await self._call(chat_id, edit)
+
+    async def _delete(self, chat_id: int, message_id: int) -> str:
+        async def delete():
+            await self.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            return "deleted"
+        return await self._call(chat_id, delete)
+
+    async def _call(self, chat_id: int, request) -> str:
+        for attempt in range(2):
+            try:
+                await self.limiter.acquire()
+                return await request()
+            except TelegramRetryAfter as e:
+                if attempt:
+                    logger.warning(f"⚠️ Сообщение о заказе в чате {chat_id} не изменено: {e}")
+                    return "failed"
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                return await self._error_status(chat_id, e)
+        return "failed"
+
+    async def _error_status(self, chat_id: int, error: Exception) -> str:
+        message = str(error).lower()
+        if isinstance(error, TelegramBadRequest):
+            if "message is not modified" in message:
+                return "unchanged"
+            if any(text in message for text in MISSING_MESSAGE_ERRORS):
+                return "missing"
+        if dead_recipient_reason(error):
+            if self.record_dead is not None:
+                await self.record_dead(chat_id, error)
+            return "unreachable"
+        logger.error(f"❌ Ошибка изменения сообщения о заказе в чате {chat_id}: {error}")
+        return "failed"
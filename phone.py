@@ -0,0 +1,46 @@
+import re
+
+# E.164: «+», код страны без ведущего нуля, всего не больше 15 цифр
+E164_PATTERN = re.compile(r"^\+[1-9]\d{9,14}$")
+_SEPARATORS = re.compile(r"[\s\-().]")
+# Российский мобильный, набранный вручную: 8 9XX XXX-XX-XX или 9XX XXX-XX-XX
+_RU_TRUNK_MOBILE = re.compile(r"^89\d{9}$")
+_RU_LOCAL_MOBILE = re.compile(r"^9\d{9}$")
+# Сообщение, похожее на набранный вручную номер: цифры с «+» и разделителями
+_PHONE_TEXT = re.compile(r"^\+?[\d\s\-().]{10,20}$")
+
+
+def looks_like_phone(text: str) -> bool:
+    """Текст сообщения похож на номер телефона (для регистрации без кнопки контакта)"""
+    return bool(text) and _PHONE_TEXT.match(text.strip()) is not None
+
+
+def normalize_phone(raw: str, manual: bool = False) -> str:
+    """
+    Приводит номер к E.164 (+79161234567): убирает пробелы, дефисы, скобки
+    и точки. Номер из контакта Telegram приходит без «+», но уже с кодом
+    страны, поэтому к нему только добавляется «+» (84912345678 — Вьетнам).
+    Для набранного вручную (manual=True) префикс 00 заменяется на «+»,
+    а российские мобильные 89XXXXXXXXX и 9XXXXXXXXX переписываются на +7.
+    Некорректный номер — ValueError
+    """
+    if raw is None:
+        raise ValueError("Номер телефона не указан")
+    phone = _SEPARATORS.sub("", str(raw))
+    has_plus = phone.startswith("+")
+    digits = phone[1:] if has_plus else phone
+    if not digits.isdigit():
+        raise ValueError(f"Номер телефона содержит недопустимые символы: {raw!r}")
+
+    if manual and not has_plus:
+        if digits.startswith("00"):
+            digits = digits[2:]
+        elif _RU_TRUNK_MOBILE.match(digits):
+            digits = "7" + digits[1:]
+        elif _RU_LOCAL_MOBILE.match(digits):
+            digits = "7" + digits
+
+    phone = "+" + digits
+    if not E164_PATTERN.match(phone):
+        raise ValueError(f"Номер телефона не в формате E.164: {raw!r}")
+    return phone
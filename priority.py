@@ -0,0 +1,227 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import CopyMessage, EditMessageText, ForwardMessage, SendDocument, SendMessage, SendPhoto
+
+import metrics
+from circuit_breaker import UpstreamUnavailableError
+
+logger = logging.getLogger(__name__)
+
+# Классы исходящих сообщений по убыванию срочности
+INTERACTIVE = "interactive"      # ответы пользователю в хендлерах (/start, контакт, /stop)
+TRANSACTIONAL = "transactional"  # уведомления о заказах
+BULK = "bulk"                    # рассылки
+
+# Класс отправок текущей задачи (выставляется для обработки обновлений Telegram)
+current_lane = contextvars.ContextVar("send_lane", default=None)
+
+# Методы Bot API, расходующие общий лимит сообщений
+SEND_METHODS = (SendMessage, EditMessageText, SendPhoto, SendDocument, CopyMessage, ForwardMessage)
+
+
+class QueueDelayExceeded(UpstreamUnavailableError):
+    def __init__(self, lane: str, waited: float, retry_after: float = 1.0, expected: Optional[float] = None):
+        if expected is not None:
+            detail = f"класс {lane} ждал бы токен ~{expected:.1f}с, дольше допустимого"
+        else:
+            detail = f"класс {lane} ждал токен {waited:.1f}с, дольше допустимого"
+        super().__init__("telegram", retry_after, detail)
+        self.lane = lane
+
+
+class _Lane:
+    __slots__ = ("name", "weight", "max_delay", "preemptible", "waiters", "pass_", "granted", "expired")
+
+    def __init__(self, name: str, weight: float, max_delay: float, preemptible: bool):
+        self.name = name
+        self.weight = weight
+        self.max_delay = max_delay
+        self.preemptible = preemptible
+        self.waiters = deque()
+        self.pass_ = 0.0
+        self.granted = 0
+        self.expired = 0
+
+
+class LaneLimiter:
+    """Класс планировщика с интерфейсом TokenBucket.acquire (для BroadcastEngine и SendDispatcher)"""
+
+    def __init__(self, scheduler: "PriorityScheduler", lane: str):
+        self.scheduler = scheduler
+        self.lane = lane
+
+    async def acquire(self, tokens: float = 1.0):
+        await self.scheduler.acquire(self.lane, tokens)
+
+
+class PriorityScheduler:
+    """
+    Раздача токенов общего лимита Telegram между классами отправки.
+    Пока лимита хватает, токен выдаётся сразу; при очереди токены достаются
+    классам по взвешенной справедливой очереди (stride scheduling: класс с
+    весом 4 получает вчетверо больше токенов, чем класс с весом 1).
+    Вытесняемые классы (preemptible, рассылки) не получают токенов, пока ждёт
+    хотя бы один невытесняемый. Запрос, ждавший дольше max_delay своего
+    класса, получает QueueDelayExceeded (0 — ждать без ограничения).
+    max_wait у acquire ограничивает ожидание отдельного вызова (синхронные
+    эндпоинты): если очередь впереди не успеет разойтись за max_wait,
+    отказ приходит сразу, без ожидания
+    """
+
+    def __init__(self, bucket, clock: Callable[[], float] = time.monotonic):
+        self.bucket = bucket
+        self.clock = clock
+        self._lanes = {}
+        self._pass = 0.0
+        self._pump_task = None
+
+    def add_lane(self, name: str, weight: float = 1.0, max_delay: float = 0.0, preemptible: bool = False):
+        self._lanes[name] = _Lane(name, max(weight, 0.001), max_delay, preemptible)
+
+    def lane(self, name: str) -> LaneLimiter:
+        if name not in self._lanes:
+            raise KeyError(f"Неизвестный класс отправки: {name}")
+        return LaneLimiter(self, name)
+
+    async def acquire(self, lane_name: str, tokens: float = 1.0, max_wait: Optional[float] = None):
+        """Ждёт токен для класса lane_name (не дольше max_wait секунд, если задан)"""
+        lane = self._lanes[lane_name]
+        if not self._backlogged() and not self.bucket.try_acquire(tokens):
+            self._grant(lane, 0.0)
+            return
+
+        if max_wait is not None:
+            expected = self._expected_wait(lane, tokens)
+            if expected is not None and expected > max_wait:
+                self._expire(lane)
+                raise QueueDelayExceeded(lane.name, 0.0, retry_after=max(1.0, expected), expected=expected)
+
+        future = asyncio.get_running_loop().create_future()
+        if not lane.waiters:
+            # Простаивавший класс не копит «кредит» за время простоя
+            lane.pass_ = max(lane.pass_, self._pass)
+        enqueued_at = self.clock()
+        lane.waiters.append((enqueued_at, tokens, future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        if max_wait is None:
+            await future
+            return
+        try:
+            # Отменённое ожидание снимается с очереди в _next_lane
+            await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            self._expire(lane)
+            raise QueueDelayExceeded(lane.name, self.clock() - enqueued_at, retry_after=max(1.0, max_wait)) from None
+
+    def _expected_wait(self, lane: _Lane, tokens: float) -> Optional[float]:
+        """
+        Оценка ожидания токена: очередь невытесняемых классов плюс свои токены при
+        скорости бакета. None, если скорость бакета неизвестна
+        """
+        rate = getattr(self.bucket, "rate", None)
+        if not rate:
+            return None
+        queued = sum(
+            waiter[1]
+            for other in self._lanes.values()
+            if not other.preemptible or other is lane
+            for waiter in other.waiters
+            # Отменённые ожидания _next_lane снимает лениво
+            if not waiter[2].done()
+        )
+        return (queued + tokens) / rate
+
+    def _expire(self, lane: _Lane):
+        lane.expired += 1
+        metrics.SEND_LANE_EXPIRED.labels(lane.name).inc()
+
+    def _backlogged(self) -> bool:
+        return any(lane.waiters for lane in self._lanes.values())
+
+    def _grant(self, lane: _Lane, waited: float):
+        lane.granted += 1
+        metrics.SEND_LANE_WAIT.labels(lane.name).observe(waited)
+
+    async def _pump(self):
+        while True:
+            lane = self._next_lane()
+            if lane is None:
+                return
+            enqueued_at, tokens, future = lane.waiters[0]
+            wait = self.bucket.try_acquire(tokens)
+            if wait:
+                # Пока ждём, может прийти запрос более срочного класса
+                await asyncio.sleep(wait)
+                continue
+            lane.waiters.popleft()
+            lane.pass_ += 1 / lane.weight
+            self._pass = lane.pass_
+            self._grant(lane, self.clock() - enqueued_at)
+            future.set_result(None)
+
+    def _next_lane(self) -> Optional[_Lane]:
+        now = self.clock()
+        ready = []
+        for lane in self._lanes.values():
+            while lane.waiters:
+                enqueued_at, _, future = lane.waiters[0]
+                if future.done():
+                    # Ожидание отменено
+                    lane.waiters.popleft()
+                elif lane.max_delay and now - enqueued_at > lane.max_delay:
+                    lane.waiters.popleft()
+                    self._expire(lane)
+                    future.set_exception(QueueDelayExceeded(lane.name, now - enqueued_at))
+                else:
+                    ready.append(lane)
+                    break
+        if not ready:
+            return None
+        urgent = [lane for lane in ready if not lane.preemptible]
+        return min(urgent or ready, key=lambda lane: lane.pass_)
+
+    def stats(self) -> dict:
+        return {
+            lane.name: {
+                "waiting": sum(1 for waiter in lane.waiters if not waiter[2].done()),
+                "granted": lane.granted,
+                "expired": lane.expired
+            }
+            for lane in self._lanes.values()
+        }
+
+
+class InteractiveLaneMiddleware(BaseMiddleware):
+    """Outer middleware обновлений: ответы из хендлеров идут классом interactive"""
+
+    async def __call__(self, handler, event, data):
+        token = current_lane.set(INTERACTIVE)
+        try:
+            return await handler(event, data)
+        finally:
+            current_lane.reset(token)
+
+
+class LaneRequestMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии aiogram: отправки внутри current_lane ждут токен своего класса.
+    Регистрируется раньше TelegramGuardMiddleware, чтобы ожидание токена
+    не считалось задержкой ответа Telegram
+    """
+
+    def __init__(self, scheduler: PriorityScheduler):
+        self.scheduler = scheduler
+
+    async def __call__(self, make_request, bot, method):
+        lane = current_lane.get()
+        if lane is not None and isinstance(method, SEND_METHODS):
+            await self.scheduler.acquire(lane)
+        return await make_request(bot, method)
@@ -0,0 +1,114 @@
+import asyncio
+import mmap
+import os
+import struct
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class TokenBucket:
+    """Токен-бакет: rate токенов в секунду, не больше capacity в запасе"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """Забирает токен; возвращает 0 при успехе или сколько секунд ждать"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    async def acquire(self, tokens: float = 1.0):
+        """Ждёт, пока в бакете появится токен"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Токен-бакет, общий для процессов одного хоста (воркеры uvicorn):
+    состояние лежит в отображённом в память файле, доступ под fcntl.flock
+    """
+
+    _STATE = struct.Struct("dd")
+
+    def __init__(self, path: str, rate: float, capacity: float = None):
+        if fcntl is None:
+            raise RuntimeError("SharedTokenBucket требует fcntl (Linux/macOS)")
+        super().__init__(rate, capacity)
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < self._STATE.size:
+            os.ftruncate(self._fd, self._STATE.size)
+        self._map = mmap.mmap(self._fd, self._STATE.size)
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        # CLOCK_MONOTONIC общий для всех процессов хоста
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            stored, updated_at = self._STATE.unpack_from(self._map)
+            now = time.monotonic()
+            if updated_at <= 0 or updated_at > now:
+                stored = self.capacity
+            else:
+                stored = min(self.capacity, stored + (now - updated_at) * self.rate)
+            wait = 0.0
+            if stored >= tokens:
+                stored -= tokens
+            else:
+                wait = (tokens - stored) / self.rate
+            self._STATE.pack_into(self._map, 0, stored, now)
+            return wait
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class KeyedTokenBucket:
+    """Набор токен-бакетов по ключу (например, по chat_id) с ограничением числа ключей"""
+
+    def __init__(self, rate: float, capacity: float = None, max_keys: int = 100_000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def _bucket(self, key) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(self.rate, self.capacity)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def try_acquire(self, key, tokens: float = 1.0) -> float:
+        return self._bucket(key).try_acquire(tokens)
+
+    async def acquire(self, key, tokens: float = 1.0):
+        await self._bucket(key).acquire(tokens)
@@ -0,0 +1,78 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+
+import metrics
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class RegistrationCache:
+    """
+    Последний результат регистрации по telegram_id: нормализованный телефон,
+    HTTP статус Laravel и время. Повтор с тем же номером в пределах TTL
+    (ttl для 200, negative_ttl для 404) отвечается без запроса в Laravel;
+    одновременные повторы одного пользователя схлопываются в один запрос.
+    Успешная запись действительна, пока is_active(telegram_id) истинно
+    """
+
+    def __init__(
+        self,
+        register_func: Callable[[str, str], Awaitable[int]],
+        ttl: float = 86400,
+        negative_ttl: float = 60,
+        max_size: int = 100000,
+        is_active: Optional[Callable[[str], bool]] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.register_func = register_func
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.is_active = is_active
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._flight = SingleFlight()
+
+    def get(self, telegram_id: str, phone: str) -> Optional[int]:
+        """Статус последней регистрации с этим номером, если он ещё действителен"""
+        entry = self._entries.get(telegram_id)
+        if entry is None:
+            return None
+        cached_phone, status, expires_at = entry
+        if cached_phone != phone or self.clock() >= expires_at:
+            return None
+        if status == 200 and self.is_active is not None and not self.is_active(telegram_id):
+            return None
+        self._entries.move_to_end(telegram_id)
+        return status
+
+    def invalidate(self, telegram_id: str):
+        self._entries.pop(telegram_id, None)
+
+    async def register(self, telegram_id: str, phone: str) -> Tuple[int, str]:
+        """Возвращает (статус, источник): источник — cache, shared или laravel"""
+        status = self.get(telegram_id, phone)
+        if status is not None:
+            source = "cache"
+        else:
+            key = (telegram_id, phone)
+            source = "shared" if self._flight.in_flight(key) else "laravel"
+            status = await self._flight.do(key, lambda: self._register(telegram_id, phone))
+        metrics.REGISTRATIONS.labels(source, str(status)).inc()
+        return status, source
+
+    async def _register(self, telegram_id: str, phone: str) -> int:
+        status = await self.register_func(telegram_id, phone)
+        ttl = self.ttl if status == 200 else self.negative_ttl if status == 404 else 0
+        if ttl > 0:
+            self._entries[telegram_id] = (phone, status, self.clock() + ttl)
+            self._entries.move_to_end(telegram_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return status
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries)}
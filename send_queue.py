@@ -0,0 +1,369 @@
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramUnauthorizedError,
+)
+from aiogram.types import InlineKeyboardMarkup
+
+from circuit_breaker import UpstreamUnavailableError
+from rate_limit import TokenBucket, KeyedTokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, при которых повторная отправка бессмысленна
+PERMANENT_ERRORS = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramUnauthorizedError)
+
+
+@dataclass
+class SendJob:
+    """Задача на отправку сообщения из очереди"""
+    id: int
+    chat_id: str
+    text: str
+    reply_markup: Optional[InlineKeyboardMarkup]
+    attempts: int
+    order_ids: tuple = ()
+
+
+class SendQueue:
+    """
+    Персистентная очередь исходящих сообщений в SQLite.
+    Запросы выполняются в отдельном потоке: ожидание блокировки записи
+    другим воркером (busy_timeout) не останавливает event loop
+    """
+
+    def __init__(self, db_file: str, stale_after: float = 300):
+        self.db_file = db_file
+        # Через сколько секунд задача в статусе 'sending' считается брошенной
+        self.stale_after = stale_after
+        self.conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="send-queue")
+
+    # --- Выполняется в потоке очереди ---
+
+    def _open(self):
+        self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS send_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id TEXT NOT NULL,
+                text TEXT NOT NULL,
+                reply_markup TEXT,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                last_error TEXT,
+                order_ids TEXT
+            )
+        """)
+        # Заказы сообщения (JSON список) для журнала доставки
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(send_queue)")}
+        if "order_ids" not in columns:
+            self.conn.execute("ALTER TABLE send_queue ADD COLUMN order_ids TEXT")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_send_queue_due ON send_queue (status, next_attempt_at)"
+        )
+        # Задачи, прерванные падением процесса, возвращаем в очередь
+        self.conn.execute(
+            "UPDATE send_queue SET status = 'pending' WHERE status = 'sending' AND updated_at <= ?",
+            (time.time() - self.stale_after,)
+        )
+        self.conn.commit()
+
+    def _close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _enqueue_many(self, chat_ids, text, markup, orders):
+        now = time.time()
+        job_ids = []
+        with self.conn:
+            for chat_id in chat_ids:
+                cursor = self.conn.execute(
+                    "INSERT INTO send_queue (chat_id, text, reply_markup, next_attempt_at, created_at, updated_at, order_ids) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (str(chat_id), text, markup, now, now, now, orders)
+                )
+                job_ids.append(cursor.lastrowid)
+        return job_ids
+
+    def _claim(self, limit):
+        now = time.time()
+        # BEGIN IMMEDIATE: несколько процессов не заберут одну и ту же задачу
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self.conn.execute(
+                "SELECT id, chat_id, text, reply_markup, attempts, order_ids FROM send_queue "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+                (now, limit)
+            ).fetchall()
+            self.conn.executemany(
+                "UPDATE send_queue SET status = 'sending', updated_at = ? WHERE id = ?",
+                [(now, row[0]) for row in rows]
+            )
+            self.conn.commit()
+        except BaseException:
+            self.conn.rollback()
+            raise
+        return rows
+
+    def _next_due_at(self):
+        return self.conn.execute(
+            "SELECT MIN(next_attempt_at) FROM send_queue WHERE status = 'pending'"
+        ).fetchone()[0]
+
+    def _mark_sent(self, job_id):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE send_queue SET status = 'sent', attempts = attempts + 1, updated_at = ?, last_error = NULL "
+                "WHERE id = ?",
+                (time.time(), job_id)
+            )
+
+    def _mark_failed(self, job_id, error):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE send_queue SET status = 'failed', attempts = attempts + 1, updated_at = ?, last_error = ? "
+                "WHERE id = ?",
+                (time.time(), error, job_id)
+            )
+
+    def _retry(self, job_id, delay, error, count_attempt):
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "UPDATE send_queue SET status = 'pending', attempts = attempts + ?, next_attempt_at = ?, "
+                "updated_at = ?, last_error = COALESCE(?, last_error) WHERE id = ?",
+                (1 if count_attempt else 0, now + delay, now, error, job_id)
+            )
+
+    def _get(self, job_id):
+        return self.conn.execute(
+            "SELECT id, chat_id, status, attempts, created_at, updated_at, last_error FROM send_queue WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+
+    def _depth(self):
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM send_queue WHERE status IN ('pending', 'sending')"
+        ).fetchone()[0]
+
+    def _purge(self, older_than):
+        with self.conn:
+            cursor = self.conn.execute(
+                "DELETE FROM send_queue WHERE status IN ('sent', 'failed') AND updated_at < ?",
+                (time.time() - older_than,)
+            )
+        return cursor.rowcount
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # --- Асинхронный интерфейс ---
+
+    async def open(self):
+        await self._run(self._open)
+
+    async def close(self):
+        await self._run(self._close)
+
+    async def enqueue(self, chat_id, text: str, reply_markup: InlineKeyboardMarkup = None, order_ids=()) -> int:
+        return (await self.enqueue_many([chat_id], text, reply_markup, order_ids))[0]
+
+    async def enqueue_many(self, chat_ids, text: str, reply_markup: InlineKeyboardMarkup = None, order_ids=()) -> list:
+        """Ставит одно сообщение в очередь для нескольких получателей, возвращает id задач"""
+        markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+        orders = json.dumps([str(order_id) for order_id in order_ids]) if order_ids else None
+        return await self._run(self._enqueue_many, list(chat_ids), text, markup, orders)
+
+    async def claim(self, limit: int) -> list:
+        """Забирает готовые к отправке задачи и помечает их как отправляемые"""
+        rows = await self._run(self._claim, limit)
+        return [
+            SendJob(
+                id=row[0],
+                chat_id=row[1],
+                text=row[2],
+                reply_markup=InlineKeyboardMarkup.model_validate_json(row[3]) if row[3] else None,
+                attempts=row[4],
+                order_ids=tuple(json.loads(row[5])) if row[5] else ()
+            )
+            for row in rows
+        ]
+
+    async def next_due_in(self) -> Optional[float]:
+        """Через сколько секунд станет готова ближайшая задача (None — очередь пуста)"""
+        due_at = await self._run(self._next_due_at)
+        if due_at is None:
+            return None
+        return max(0.0, due_at - time.time())
+
+    async def mark_sent(self, job_id: int):
+        await self._run(self._mark_sent, job_id)
+
+    async def mark_failed(self, job_id: int, error: str):
+        await self._run(self._mark_failed, job_id, error)
+
+    async def retry(self, job_id: int, delay: float, error: str = None, count_attempt: bool = True):
+        """Возвращает задачу в очередь с отложенной попыткой"""
+        await self._run(self._retry, job_id, delay, error, count_attempt)
+
+    async def get(self, job_id: int) -> Optional[dict]:
+        row = await self._run(self._get, job_id)
+        if row is None:
+            return None
+        keys = ("job_id", "chat_id", "status", "attempts", "created_at", "updated_at", "last_error")
+        return dict(zip(keys, row))
+
+    async def depth(self) -> int:
+        """Количество неотправленных задач"""
+        return await self._run(self._depth)
+
+    async def purge(self, older_than: float) -> int:
+        """Удаляет завершённые задачи старше older_than секунд"""
+        return await self._run(self._purge, older_than)
+
+
+class SendDispatcher:
+    """
+    Фоновая отправка сообщений из SendQueue с учётом лимитов Telegram:
+    глобального (≈30 сообщений/с) и на чат (≈1 сообщение/с)
+    """
+
+    def __init__(
+        self,
+        queue: SendQueue,
+        send_func,
+        global_rate: float = 30,
+        chat_rate: float = 1,
+        max_attempts: int = 5,
+        base_delay: float = 1.0,
+        concurrency: int = 30,
+        batch_size: int = 100,
+        idle_interval: float = 1.0,
+        retention: float = 86400,
+        global_limiter: TokenBucket = None
+    ):
+        self.queue = queue
+        self.send_func = send_func
+        self.global_limiter = global_limiter or TokenBucket(global_rate)
+        self.chat_limiter = KeyedTokenBucket(chat_rate)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.batch_size = batch_size
+        self.idle_interval = idle_interval
+        self.retention = retention
+        self._slots = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._inflight = set()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def notify(self):
+        """Будит диспетчер после постановки новых задач"""
+        self._wakeup.set()
+
+    async def _run(self):
+        last_purge = time.monotonic()
+        while True:
+            try:
+                jobs = await self.queue.claim(self.batch_size)
+                if not jobs:
+                    if time.monotonic() - last_purge > 3600:
+                        await self.queue.purge(self.retention)
+                        last_purge = time.monotonic()
+                    await self._idle()
+                    continue
+                for job in jobs:
+                    wait = self.chat_limiter.try_acquire(job.chat_id)
+                    if wait:
+                        # Лимит на чат исчерпан: откладываем задачу, не блокируя остальные
+                        await self.queue.retry(job.id, wait, count_attempt=False)
+                        continue
+                    try:
+                        await self.global_limiter.acquire()
+                    except UpstreamUnavailableError as e:
+                        await self.queue.retry(job.id, e.retry_after, str(e), count_attempt=False)
+                        continue
+                    await self._slots.acquire()
+                    task = asyncio.create_task(self._deliver(job))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка диспетчера очереди отправки: {e}")
+                await asyncio.sleep(self.idle_interval)
+
+    async def _idle(self):
+        delay = await self.queue.next_due_in()
+        timeout = self.idle_interval if delay is None else min(delay, self.idle_interval)
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _backoff(self, attempts: int) -> float:
+        delay = self.base_delay * (2 ** attempts)
+        return delay + random.uniform(0, delay / 2)
+
+    async def _deliver(self, job: SendJob):
+        try:
+            if job.order_ids:
+                await self.send_func(job.chat_id, job.text, reply_markup=job.reply_markup, order_ids=job.order_ids)
+            else:
+                await self.send_func(job.chat_id, job.text, reply_markup=job.reply_markup)
+            await self.queue.mark_sent(job.id)
+        except TelegramRetryAfter as e:
+            logger.warning(f"⏳ Telegram просит подождать {e.retry_after}с, задача {job.id}")
+            await self.queue.retry(job.id, e.retry_after, str(e), count_attempt=False)
+        except UpstreamUnavailableError as e:
+            # Telegram недоступен (автомат разомкнут): попытка не расходуется
+            await self.queue.retry(job.id, e.retry_after, str(e), count_attempt=False)
+        except PERMANENT_ERRORS as e:
+            logger.error(f"Задача {job.id} для {job.chat_id} отклонена Telegram: {e}")
+            await self.queue.mark_failed(job.id, f"{type(e).__name__}: {e}")
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job.attempts + 1 >= self.max_attempts:
+                logger.error(f"Задача {job.id} для {job.chat_id} не отправлена после {job.attempts + 1} попыток: {e}")
+                await self.queue.mark_failed(job.id, error)
+            else:
+                delay = self._backoff(job.attempts)
+                logger.warning(f"Повтор задачи {job.id} через {delay:.1f}с: {e}")
+                await self.queue.retry(job.id, delay, error)
+        finally:
+            self._slots.release()
@@ -0,0 +1,332 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+
+logger = logging.getLogger(__name__)
+
+
+class StateBackend(ABC):
+    """
+    Общее хранилище ключ-значение для нескольких процессов и хостов:
+    FSM состояния, дедупликация, аренда лидерства
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        ...
+
+    @abstractmethod
+    async def set_if_absent(self, key: str, value: str, ttl: Optional[float] = None) -> bool:
+        """Атомарно записывает значение, только если ключа нет (или он истёк)"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+    @abstractmethod
+    async def expire_if_equal(self, key: str, value: str, ttl: float) -> bool:
+        """Продлевает ключ, только если в нём всё ещё value"""
+
+    @abstractmethod
+    async def delete_if_equal(self, key: str, value: str) -> bool:
+        """Удаляет ключ, только если в нём всё ещё value"""
+
+    async def close(self):
+        pass
+
+
+class SQLiteBackend(StateBackend):
+    """
+    Реализация на файле SQLite: общая для процессов одного хоста.
+    Просроченные ключи (update:<id>, idem:<key>) удаляются попутно при записи,
+    не чаще раза в sweep_interval секунд
+    """
+
+    def __init__(self, db_file: str, sweep_interval: float = 60.0):
+        self.db_file = db_file
+        self.sweep_interval = sweep_interval
+        self.conn = None
+        self._swept_at = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA busy_timeout=5000")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS kv (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL
+                )
+            """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_kv_expires ON kv (expires_at) WHERE expires_at IS NOT NULL"
+            )
+        return self.conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _transaction(self, func):
+        # BEGIN IMMEDIATE: проверка и запись атомарны и между процессами
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, time.time())
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    @staticmethod
+    def _current(conn, key, now):
+        row = conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return None
+        return row[0]
+
+    @staticmethod
+    def _expires(ttl, now):
+        return now + ttl if ttl is not None else None
+
+    def _sweep(self, conn, now):
+        if now - self._swept_at < self.sweep_interval:
+            return
+        self._swept_at = now
+        conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+
+    async def get(self, key):
+        return await self._run(lambda: self._current(self._connect(), key, time.time()))
+
+    async def set(self, key, value, ttl=None):
+        def op(conn, now):
+            self._sweep(conn, now)
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, self._expires(ttl, now))
+            )
+        await self._run(self._transaction, op)
+
+    async def set_if_absent(self, key, value, ttl=None):
+        def op(conn, now):
+            self._sweep(conn, now)
+            if self._current(conn, key, now) is not None:
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, self._expires(ttl, now))
+            )
+            return True
+        return await self._run(self._transaction, op)
+
+    async def delete(self, key):
+        await self._run(self._transaction, lambda conn, now: conn.execute("DELETE FROM kv WHERE key = ?", (key,)))
+
+    async def expire_if_equal(self, key, value, ttl):
+        def op(conn, now):
+            if self._current(conn, key, now) != value:
+                return False
+            conn.execute("UPDATE kv SET expires_at = ? WHERE key = ?", (now + ttl, key))
+            return True
+        return await self._run(self._transaction, op)
+
+    async def delete_if_equal(self, key, value):
+        def op(conn, now):
+            if self._current(conn, key, now) != value:
+                return False
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            return True
+        return await self._run(self._transaction, op)
+
+    async def close(self):
+        def op():
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+        await self._run(op)
+
+
+# Lua скрипты для атомарных сравнений в Redis
+EXPIRE_IF_EQUAL = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('pexpire', KEYS[1], ARGV[2]) else return 0 end"
+)
+DELETE_IF_EQUAL = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('del', KEYS[1]) else return 0 end"
+)
+
+
+class RedisBackend(StateBackend):
+    """
+    Реализация поверх Redis-совместимого клиента (redis.asyncio.Redis или его аналог
+    с методами get/set/delete/eval), общая для нескольких хостов
+    """
+
+    def __init__(self, client, prefix: str = "proton:"):
+        self.client = client
+        self.prefix = prefix
+
+    @staticmethod
+    def _decode(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    async def get(self, key):
+        return self._decode(await self.client.get(self.prefix + key))
+
+    async def set(self, key, value, ttl=None):
+        await self.client.set(self.prefix + key, value, px=int(ttl * 1000) if ttl else None)
+
+    async def set_if_absent(self, key, value, ttl=None):
+        return bool(await self.client.set(self.prefix + key, value, nx=True, px=int(ttl * 1000) if ttl else None))
+
+    async def delete(self, key):
+        await self.client.delete(self.prefix + key)
+
+    async def expire_if_equal(self, key, value, ttl):
+        return bool(await self.client.eval(EXPIRE_IF_EQUAL, 1, self.prefix + key, value, int(ttl * 1000)))
+
+    async def delete_if_equal(self, key, value):
+        return bool(await self.client.eval(DELETE_IF_EQUAL, 1, self.prefix + key, value))
+
+    async def close(self):
+        close = getattr(self.client, "aclose", None) or getattr(self.client, "close", None)
+        if close is not None:
+            await close()
+
+
+def create_backend(url: str) -> StateBackend:
+    """sqlite:///path/to/state.db или redis://host:port/db"""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        try:
+            from redis.asyncio import Redis
+        except ImportError:
+            raise RuntimeError("Для STATE_BACKEND_URL=redis://... установите пакет redis>=5")
+        return RedisBackend(Redis.from_url(url))
+    if url.startswith("sqlite:///"):
+        url = url[len("sqlite:///"):]
+    return SQLiteBackend(url)
+
+
+class BackendFSMStorage(BaseStorage):
+    """FSM хранилище aiogram поверх StateBackend"""
+
+    def __init__(self, backend: StateBackend, state_ttl: Optional[float] = None):
+        self.backend = backend
+        self.state_ttl = state_ttl
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        storage_key = self.key_builder.build(key, "state")
+        state = state.state if isinstance(state, State) else state
+        if state is None:
+            await self.backend.delete(storage_key)
+        else:
+            await self.backend.set(storage_key, state, self.state_ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self.backend.get(self.key_builder.build(key, "state"))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self.key_builder.build(key, "data")
+        if not data:
+            await self.backend.delete(storage_key)
+        else:
+            await self.backend.set(storage_key, json.dumps(data, ensure_ascii=False), self.state_ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value = await self.backend.get(self.key_builder.build(key, "data"))
+        return json.loads(value) if value else {}
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+class LeaderLease:
+    """
+    Аренда лидерства с TTL: только владелец аренды управляет webhook
+    и резервным polling. Аренда продлевается в фоне; если продлить не удалось,
+    вызывается on_lost, и другой экземпляр может её забрать
+    """
+
+    def __init__(
+        self,
+        backend: StateBackend,
+        name: str,
+        ttl: float = 30.0,
+        on_acquired=None,
+        on_lost=None
+    ):
+        self.backend = backend
+        self.key = f"lease:{name}"
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.on_acquired = on_acquired
+        self.on_lost = on_lost
+        self.is_leader = False
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.is_leader:
+            self.is_leader = False
+            await self._release()
+
+    async def _release(self):
+        try:
+            await self.backend.delete_if_equal(self.key, self.owner)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось освободить аренду {self.key}: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                if self.is_leader:
+                    if not await self.backend.expire_if_equal(self.key, self.owner, self.ttl):
+                        await self._lose()
+                elif await self.backend.set_if_absent(self.key, self.owner, self.ttl):
+                    self.is_leader = True
+                    logger.info(f"👑 Получена аренда {self.key} ({self.owner})")
+                    if self.on_acquired is not None:
+                        await self.on_acquired()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка аренды {self.key}: {e}")
+                if self.is_leader:
+                    # Ключ освобождаем сразу, иначе до истечения TTL аренду не получит никто
+                    await self._release()
+                    await self._lose()
+            await asyncio.sleep(self.ttl / 3)
+
+    async def _lose(self):
+        self.is_leader = False
+        logger.warning(f"⚠️ Аренда {self.key} потеряна ({self.owner})")
+        if self.on_lost is not None:
+            await self.on_lost()
@@ -0,0 +1,25 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Схлопывание одновременных вызовов с одним ключом: пока первый вызов
+    выполняется, остальные ждут его результат (или исключение), а не
+    повторяют работу. После завершения ключ освобождается
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable]):
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda _: self._calls.pop(key, None))
+        # shield: отмена одного ожидающего не отменяет общий вызов
+        return await asyncio.shield(future)
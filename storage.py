@@ -1,37 +1,428 @@
-
+import asyncio
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 DB_FILE = "users.db"
 
-def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY
+
+class UserStorage:
+    """
+    Хранилище пользователей поверх одного долгоживущего соединения SQLite в WAL режиме.
+    Все операции выполняются в выделенном потоке, поэтому асинхронные методы
+    не блокируют event loop на fsync
+    """
+
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        self.conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+        # Подписчики на изменения: listener(subscribed_ids, unsubscribed_ids)
+        self._listeners = []
+
+    # --- Выполняется в потоке хранилища ---
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA busy_timeout=5000")
+            self.conn.execute("PRAGMA temp_store=MEMORY")
+            self.conn.execute("PRAGMA cache_size=-8000")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    active INTEGER NOT NULL DEFAULT 1,
+                    reason TEXT,
+                    updated_at REAL NOT NULL DEFAULT 0
+                )
+            """)
+            # Отписавшиеся остаются в таблице с active = 0 и причиной
+            # (unsubscribed — /stop или Laravel, blocked/deactivated/chat_not_found — ошибки отправки)
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(users)")}
+            if "active" not in columns:
+                self.conn.execute("ALTER TABLE users ADD COLUMN active INTEGER NOT NULL DEFAULT 1")
+                self.conn.execute("ALTER TABLE users ADD COLUMN updated_at REAL NOT NULL DEFAULT 0")
+            if "reason" not in columns:
+                self.conn.execute("ALTER TABLE users ADD COLUMN reason TEXT")
+            # Изменения других процессов (воркеров) подхватываются по updated_at
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_users_updated ON users (updated_at)")
+            # Недоступные чаты, о которых ещё не сообщили в Laravel
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS dead_reports (
+                    user_id INTEGER PRIMARY KEY,
+                    reason TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            # Журнал отправок уведомлений о заказах; reported_at — когда статус ушёл в Laravel
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS deliveries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    telegram_id TEXT NOT NULL,
+                    order_id TEXT NOT NULL,
+                    message_id INTEGER,
+                    status TEXT NOT NULL,
+                    latency REAL NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    reported_at REAL
+                )
+            """)
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_deliveries_unreported ON deliveries (id) WHERE reported_at IS NULL"
+            )
+            # Последнее сообщение о заказе в каждом чате — для правки и удаления при изменении заказа
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS order_messages (
+                    order_id TEXT NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    sent_at REAL NOT NULL,
+                    PRIMARY KEY (order_id, chat_id)
+                ) WITHOUT ROWID
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    text TEXT NOT NULL,
+                    reply_markup TEXT,
+                    status TEXT NOT NULL DEFAULT 'running',
+                    last_user_id INTEGER NOT NULL DEFAULT 0,
+                    sent INTEGER NOT NULL DEFAULT 0,
+                    failed INTEGER NOT NULL DEFAULT 0,
+                    removed INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            self.conn.commit()
+        return self.conn
+
+    def _close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _set_active(self, subscribed, unsubscribed, reason="unsubscribed", report=False):
+        conn = self._connect()
+        now = time.time()
+        rows = [(uid, 1, None, now) for uid in subscribed] + [(uid, 0, reason, now) for uid in unsubscribed]
+        with conn:
+            conn.executemany(
+                "INSERT INTO users (user_id, active, reason, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET active = excluded.active, reason = excluded.reason, "
+                "updated_at = excluded.updated_at",
+                rows
+            )
+            # Вернувшегося пользователя не отписываем в Laravel
+            conn.executemany("DELETE FROM dead_reports WHERE user_id = ?", [(uid,) for uid in subscribed])
+            if report:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO dead_reports (user_id, reason, created_at) VALUES (?, ?, ?)",
+                    [(uid, reason, now) for uid in unsubscribed]
+                )
+
+    def _get_users(self):
+        conn = self._connect()
+        return [row[0] for row in conn.execute("SELECT user_id FROM users WHERE active = 1")]
+
+    def _get_user_states(self):
+        conn = self._connect()
+        return conn.execute("SELECT user_id, active, reason FROM users").fetchall()
+
+    def _get_user_changes(self, since):
+        conn = self._connect()
+        return conn.execute(
+            "SELECT user_id, active, reason FROM users WHERE updated_at > ? ORDER BY updated_at", (since,)
+        ).fetchall()
+
+    def _get_dead_reports(self, limit):
+        conn = self._connect()
+        return conn.execute(
+            "SELECT user_id, reason FROM dead_reports ORDER BY created_at LIMIT ?", (limit,)
+        ).fetchall()
+
+    def _delete_dead_reports(self, user_ids):
+        conn = self._connect()
+        with conn:
+            conn.executemany("DELETE FROM dead_reports WHERE user_id = ?", [(uid,) for uid in user_ids])
+
+    def _add_deliveries(self, rows, messages):
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "INSERT INTO deliveries (telegram_id, order_id, message_id, status, latency, error, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO order_messages (order_id, chat_id, message_id, sent_at) VALUES (?, ?, ?, ?)",
+                messages
+            )
+
+    def _add_order_message(self, order_id, chat_id, message_id, sent_at):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO order_messages (order_id, chat_id, message_id, sent_at) VALUES (?, ?, ?, ?)",
+                (order_id, chat_id, message_id, sent_at)
+            )
+
+    def _get_order_messages(self, order_id):
+        conn = self._connect()
+        return conn.execute(
+            "SELECT chat_id, message_id FROM order_messages WHERE order_id = ? ORDER BY chat_id", (order_id,)
+        ).fetchall()
+
+    def _delete_order_messages(self, order_id, chat_ids):
+        conn = self._connect()
+        with conn:
+            if chat_ids is None:
+                conn.execute("DELETE FROM order_messages WHERE order_id = ?", (order_id,))
+            else:
+                conn.executemany(
+                    "DELETE FROM order_messages WHERE order_id = ? AND chat_id = ?",
+                    [(order_id, chat_id) for chat_id in chat_ids]
+                )
+
+    def _get_unreported_deliveries(self, limit):
+        conn = self._connect()
+        keys = ("id", "telegram_id", "order_id", "message_id", "status", "latency", "error", "created_at")
+        rows = conn.execute(
+            "SELECT id, telegram_id, order_id, message_id, status, latency, error, created_at "
+            "FROM deliveries WHERE reported_at IS NULL ORDER BY id LIMIT ?",
+            (limit,)
         )
-    """)
-    conn.commit()
-    conn.close()
+        return [dict(zip(keys, row)) for row in rows]
+
+    def _mark_deliveries_reported(self, ids):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.executemany("UPDATE deliveries SET reported_at = ? WHERE id = ?", [(now, i) for i in ids])
+
+    def _purge_deliveries(self, older_than):
+        conn = self._connect()
+        cutoff = time.time() - older_than
+        with conn:
+            cursor = conn.execute("DELETE FROM deliveries WHERE created_at < ?", (cutoff,))
+            conn.execute("DELETE FROM order_messages WHERE sent_at < ?", (cutoff,))
+        return cursor.rowcount
+
+    def _get_meta(self, key):
+        conn = self._connect()
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        conn = self._connect()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _check_writable(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS health (id INTEGER PRIMARY KEY, checked_at REAL NOT NULL)")
+            conn.execute("INSERT OR REPLACE INTO health (id, checked_at) VALUES (1, ?)", (time.time(),))
+
+    def _get_user_ids_after(self, after, limit):
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT user_id FROM users WHERE user_id > ? AND active = 1 ORDER BY user_id LIMIT ?",
+            (after, limit)
+        )
+        return [row[0] for row in rows]
+
+    def _create_broadcast(self, text, reply_markup):
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO broadcasts (text, reply_markup, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (text, reply_markup, now, now)
+            )
+        return cursor.lastrowid
+
+    def _checkpoint_broadcast(self, broadcast_id, last_user_id, sent, failed, removed, status):
+        conn = self._connect()
+        with conn:
+            # Завершённую или отменённую (в том числе другим воркером) рассылку не трогаем
+            cursor = conn.execute(
+                "UPDATE broadcasts SET last_user_id = ?, sent = sent + ?, failed = failed + ?, "
+                "removed = removed + ?, status = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+                (last_user_id, sent, failed, removed, status, time.time(), broadcast_id)
+            )
+        return cursor.rowcount > 0
+
+    def _get_broadcasts(self, status=None, broadcast_id=None):
+        conn = self._connect()
+        query = (
+            "SELECT id, text, reply_markup, status, last_user_id, sent, failed, removed, created_at, updated_at "
+            "FROM broadcasts WHERE (? IS NULL OR status = ?) AND (? IS NULL OR id = ?) ORDER BY id"
+        )
+        keys = ("id", "text", "reply_markup", "status", "last_user_id", "sent", "failed", "removed",
+                "created_at", "updated_at")
+        rows = conn.execute(query, (status, status, broadcast_id, broadcast_id))
+        return [dict(zip(keys, row)) for row in rows]
+
+    # --- Синхронный интерфейс ---
+
+    def run_sync(self, func, *args):
+        """Выполняет операцию в потоке хранилища и ждёт результат"""
+        return self._executor.submit(func, *args).result()
+
+    def set_active_sync(self, subscribed=(), unsubscribed=(), reason="unsubscribed"):
+        """set_active для кода без event loop; слушатели (индекс подписчиков) тоже уведомляются"""
+        subscribed, unsubscribed = list(subscribed), list(unsubscribed)
+        self.run_sync(self._set_active, subscribed, unsubscribed, reason)
+        self._notify(subscribed, unsubscribed, reason)
+
+    # --- Асинхронный интерфейс ---
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def open(self):
+        await self.run(self._connect)
+
+    async def close(self):
+        await self.run(self._close)
+
+    def add_listener(self, listener):
+        """listener(subscribed_ids, unsubscribed_ids, reason) вызывается после каждой записи"""
+        self._listeners.append(listener)
+
+    async def set_active(self, subscribed=(), unsubscribed=(), reason="unsubscribed", report=False):
+        """
+        Подписывает и отписывает пользователей одной транзакцией;
+        report=True ставит отписанных в очередь уведомления Laravel
+        """
+        subscribed, unsubscribed = list(subscribed), list(unsubscribed)
+        await self.run(self._set_active, subscribed, unsubscribed, reason, report)
+        self._notify(subscribed, unsubscribed, reason)
+
+    def _notify(self, subscribed, unsubscribed, reason):
+        for listener in self._listeners:
+            listener(subscribed, unsubscribed, reason)
+
+    async def add_user(self, user_id):
+        await self.set_active(subscribed=[user_id])
+
+    async def add_users(self, user_ids):
+        await self.set_active(subscribed=user_ids)
+
+    async def remove_user(self, user_id):
+        await self.set_active(unsubscribed=[user_id])
+
+    async def remove_users(self, user_ids):
+        await self.set_active(unsubscribed=user_ids)
+
+    async def get_users(self):
+        return await self.run(self._get_users)
+
+    async def get_user_states(self):
+        """(user_id, active, reason) всех известных пользователей"""
+        return await self.run(self._get_user_states)
+
+    async def get_user_changes(self, since):
+        """(user_id, active, reason) пользователей, изменённых после since (time.time())"""
+        return await self.run(self._get_user_changes, since)
+
+    async def mark_dead(self, user_ids, reason):
+        """Отписывает недоступные чаты и ставит их в очередь отчёта для Laravel"""
+        await self.set_active(unsubscribed=user_ids, reason=reason, report=True)
+
+    async def get_dead_reports(self, limit=100):
+        return await self.run(self._get_dead_reports, limit)
+
+    async def delete_dead_reports(self, user_ids):
+        await self.run(self._delete_dead_reports, list(user_ids))
+
+    async def add_deliveries(self, rows, messages=()):
+        """
+        rows: (telegram_id, order_id, message_id, status, latency, error, created_at);
+        messages: (order_id, chat_id, message_id, sent_at) для индекса сообщений заказов
+        """
+        await self.run(self._add_deliveries, list(rows), list(messages))
+
+    async def add_order_message(self, order_id, chat_id, message_id):
+        """Запоминает сообщение о заказе в чате (замещает прежнее)"""
+        await self.run(self._add_order_message, str(order_id), int(chat_id), message_id, time.time())
+
+    async def get_order_messages(self, order_id):
+        """(chat_id, message_id) отправленных сообщений о заказе"""
+        return await self.run(self._get_order_messages, str(order_id))
+
+    async def delete_order_messages(self, order_id, chat_ids=None):
+        """Удаляет заказ из индекса сообщений целиком или для указанных чатов"""
+        await self.run(self._delete_order_messages, str(order_id), None if chat_ids is None else list(chat_ids))
+
+    async def get_unreported_deliveries(self, limit=500):
+        return await self.run(self._get_unreported_deliveries, limit)
+
+    async def mark_deliveries_reported(self, ids):
+        await self.run(self._mark_deliveries_reported, list(ids))
+
+    async def purge_deliveries(self, older_than):
+        """Удаляет записи журнала и индекса сообщений старше older_than секунд, возвращает число записей журнала"""
+        return await self.run(self._purge_deliveries, older_than)
+
+    async def get_meta(self, key):
+        return await self.run(self._get_meta, key)
+
+    async def set_meta(self, key, value):
+        await self.run(self._set_meta, key, value)
+
+    async def check_writable(self):
+        """Пробная запись для проверки готовности"""
+        await self.run(self._check_writable)
+
+    async def iter_user_ids(self, after=0, chunk_size=1000):
+        """Постранично (по ключу) выдаёт user_id по возрастанию, не загружая всю таблицу"""
+        while True:
+            chunk = await self.run(self._get_user_ids_after, after, chunk_size)
+            if not chunk:
+                return
+            yield chunk
+            after = chunk[-1]
+
+    async def create_broadcast(self, text, reply_markup=None):
+        return await self.run(self._create_broadcast, text, reply_markup)
+
+    async def checkpoint_broadcast(self, broadcast_id, last_user_id, sent=0, failed=0, removed=0, status="running"):
+        """Сохраняет прогресс идущей рассылки; False, если она уже не в статусе running"""
+        return await self.run(self._checkpoint_broadcast, broadcast_id, last_user_id, sent, failed, removed, status)
+
+    async def get_broadcast(self, broadcast_id):
+        rows = await self.run(self._get_broadcasts, None, broadcast_id)
+        return rows[0] if rows else None
+
+    async def get_broadcasts(self, status=None):
+        return await self.run(self._get_broadcasts, status, None)
+
+
+user_storage = UserStorage(DB_FILE)
+
+
+# Синхронные функции для обратной совместимости
+
+def init_db():
+    user_storage.run_sync(user_storage._connect)
 
 def add_user(user_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (user_id,))
-    conn.commit()
-    conn.close()
+    user_storage.set_active_sync(subscribed=[user_id])
 
 def remove_user(user_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    user_storage.set_active_sync(unsubscribed=[user_id])
 
 def get_users():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT user_id FROM users")
-    users = [row[0] for row in c.fetchall()]
-    conn.close()
-    return users
+    return user_storage.run_sync(user_storage._get_users)
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Ключ курсора синхронизации в таблице meta
+SYNC_CURSOR_KEY = "subscribers_sync_cursor"
+# Перекрытие окна refresh, с: запись другого процесса могла получить updated_at чуть раньше нашего чтения
+REFRESH_OVERLAP = 1.0
+
+
+class SubscriberIndex:
+    """
+    Индекс подписчиков в памяти: множество активных user_id и словарь
+    отписавшихся {user_id: причина}, загруженные из таблицы users. Изменения пишутся в SQLite и попадают в индекс
+    через слушатель хранилища, поэтому проверка получателя не трогает диск.
+
+    Отправку пропускаем только для известных отписавшихся: таблица users
+    знает не всех подписчиков Laravel (регистрация могла пройти на другой реплике).
+
+    Слушатель видит только записи своего процесса. При нескольких воркерах
+    на одной users.db индекс раз в refresh_interval догружает строки, изменённые
+    другими воркерами (по updated_at); сверку с Laravel (start) запускает
+    только владелец аренды фоновых задач
+    """
+
+    def __init__(
+        self,
+        storage,
+        laravel=None,
+        sync_path: str = "/telegram/subscribers",
+        interval: float = 300.0,
+        page_size: int = 1000,
+        refresh_interval: float = 0.0
+    ):
+        self.storage = storage
+        self.laravel = laravel
+        self.sync_path = sync_path
+        self.interval = interval
+        self.page_size = page_size
+        self.refresh_interval = refresh_interval
+        self.active = set()
+        self.inactive = {}
+        self.last_sync_at = None
+        self._refreshed_at = 0.0
+        self._task = None
+        self._refresh_task = None
+        storage.add_listener(self._apply)
+
+    async def load(self):
+        """Заполняет индекс из таблицы users"""
+        self._refreshed_at = time.time()
+        active, inactive = set(), {}
+        for user_id, is_active, reason in await self.storage.get_user_states():
+            if is_active:
+                active.add(user_id)
+            else:
+                inactive[user_id] = reason or "unsubscribed"
+        self.active, self.inactive = active, inactive
+        logger.info(f"✅ Индекс подписчиков: {len(active)} активных, {len(inactive)} отписавшихся")
+
+    async def refresh(self) -> int:
+        """Применяет изменения таблицы users, сделанные другими процессами; возвращает число строк"""
+        started_at = time.time()
+        rows = await self.storage.get_user_changes(self._refreshed_at - REFRESH_OVERLAP)
+        for user_id, is_active, reason in rows:
+            if is_active:
+                self.active.add(user_id)
+                self.inactive.pop(user_id, None)
+            else:
+                self.inactive[user_id] = reason or "unsubscribed"
+                self.active.discard(user_id)
+        self._refreshed_at = started_at
+        return len(rows)
+
+    def _apply(self, subscribed, unsubscribed, reason):
+        for user_id in subscribed:
+            self.active.add(user_id)
+            self.inactive.pop(user_id, None)
+        for user_id in unsubscribed:
+            self.inactive[user_id] = reason
+            self.active.discard(user_id)
+
+    def is_subscribed(self, user_id) -> bool:
+        return int(user_id) in self.active
+
+    def is_unsubscribed(self, user_id) -> bool:
+        """True, если пользователь известен как отписавшийся"""
+        return self.inactive_reason(user_id) is not None
+
+    def inactive_reason(self, user_id) -> Optional[str]:
+        """Причина отписки (unsubscribed, blocked, ...) или None для активных и неизвестных"""
+        try:
+            return self.inactive.get(int(user_id))
+        except (TypeError, ValueError):
+            return None
+
+    async def sync(self) -> int:
+        """
+        Инкрементальная сверка с Laravel: GET sync_path?since=<cursor>&limit=N
+        отдаёт {"changes": [{"telegram_id": ..., "active": bool}], "next_cursor": ..., "has_more": bool}
+        (допускается обёртка {"success": true, "data": {...}}). Курсор хранится в SQLite
+        """
+        cursor = await self.storage.get_meta(SYNC_CURSOR_KEY)
+        applied = 0
+        while True:
+            params = {"limit": self.page_size}
+            if cursor:
+                params["since"] = cursor
+            response = await self.laravel.get(self.sync_path, params=params)
+            if response.status != 200 or not isinstance(response.data, dict):
+                logger.warning(f"⚠️ Синхронизация подписчиков: HTTP {response.status}")
+                return applied
+            payload = response.data.get("data", response.data)
+
+            subscribed, unsubscribed = [], []
+            for change in payload.get("changes") or []:
+                try:
+                    user_id = int(change["telegram_id"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                (subscribed if change.get("active", True) else unsubscribed).append(user_id)
+            if subscribed or unsubscribed:
+                await self.storage.set_active(subscribed, unsubscribed)
+                applied += len(subscribed) + len(unsubscribed)
+
+            next_cursor = payload.get("next_cursor")
+            if next_cursor is None or str(next_cursor) == cursor:
+                break
+            cursor = str(next_cursor)
+            await self.storage.set_meta(SYNC_CURSOR_KEY, cursor)
+            if not payload.get("has_more"):
+                break
+
+        self.last_sync_at = time.time()
+        if applied:
+            logger.info(f"🔄 Синхронизация подписчиков: применено {applied} изменений")
+        return applied
+
+    def start(self):
+        """Периодическая сверка с Laravel (один процесс на users.db)"""
+        if self.laravel is not None and self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def start_refresh(self):
+        """Подхват изменений других воркеров (в каждом процессе)"""
+        if self.refresh_interval > 0 and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def stop_refresh(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка обновления индекса подписчиков: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка синхронизации подписчиков: {e}")
+            await asyncio.sleep(self.interval)
+
+    def stats(self) -> dict:
+        return {"active": len(self.active), "inactive": len(self.inactive), "last_sync_at": self.last_sync_at}
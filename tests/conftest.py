@@ -0,0 +1,78 @@
+import hashlib
+import hmac
+import importlib
+import os
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+# Безопасные ENV для запуска приложения в тесте (config читается при импорте main):
+# токен валидного формата (НЕ боевой), чтобы aiogram не падал на валидации
+os.environ["BOT_TOKEN"] = "123456:TEST"
+os.environ.setdefault("LARAVEL_API_BASE", "https://example.invalid")
+os.environ.setdefault("LARAVEL_BEARER_TOKEN", "test-token")
+os.environ.setdefault("NOTIFY_SECRET", "test-secret")
+os.environ.setdefault("WEBHOOK_SECRET", "test-hmac-secret")
+
+
+@pytest.fixture
+def main_module(monkeypatch):
+    """Модуль main с заглушенными внешними вызовами; подмены снимаются после теста"""
+    try:
+        import requests
+
+        def _noop_request(self, method, url, *a, **kw):
+            resp = requests.Response()
+            resp.status_code = 200
+            resp._content = b'{}'
+            resp.url = url
+            return resp
+        monkeypatch.setattr(requests.Session, "request", _noop_request)
+    except ImportError:
+        pass
+
+    from aiogram import Bot
+
+    async def _fake_send_message(self, chat_id, text, *a, **kw):
+        return types.SimpleNamespace(message_id=1)
+    monkeypatch.setattr(Bot, "send_message", _fake_send_message)
+
+    notify_api = importlib.import_module("notify_api")
+
+    async def _noop_async(*a, **kw):
+        return {"status": "ok"}
+    for name in ("send_notification", "send_message", "notify", "send_telegram_message"):
+        if callable(getattr(notify_api, name, None)):
+            monkeypatch.setattr(notify_api, name, _noop_async)
+
+    import main
+    return main
+
+
+@pytest.fixture
+def client(main_module):
+    from fastapi.testclient import TestClient
+    return TestClient(main_module.app)
+
+
+@pytest.fixture
+def auth_headers():
+    return {"Authorization": f"Bearer {os.environ['LARAVEL_BEARER_TOKEN']}"}
+
+
+@pytest.fixture
+def signed_headers(auth_headers):
+    """Заголовки /notify-webhook с HMAC подписью тела (или заданной signature)"""
+    def sign(body: bytes, signature: str = None) -> dict:
+        signature = signature or hmac.new(os.environ["WEBHOOK_SECRET"].encode(), body, hashlib.sha256).hexdigest()
+        return {
+            **auth_headers,
+            "X-Signature": f"sha256={signature}",
+            "X-Signature-Alg": "HMAC-SHA256",
+            "Content-Type": "application/json"
+        }
+    return sign
@@ -0,0 +1,122 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+from broadcast import BroadcastEngine
+from circuit_breaker import CircuitOpenError
+from dead_recipients import DeadRecipientRegistry
+from rate_limit import TokenBucket
+from storage import UserStorage
+
+
+def test_broadcast_resumes_from_checkpoint_and_prunes_blocked(tmp_path):
+    storage = UserStorage(str(tmp_path / "users.db"))
+    registry = DeadRecipientRegistry(storage, laravel=None)
+    sent = []
+
+    async def send(chat_id, text, reply_markup=None):
+        # Как send_telegram_message: недоступный чат отмечает реестр, ошибка пробрасывается
+        if chat_id == 4:
+            error = TelegramForbiddenError(method=SendMessage(chat_id=chat_id, text=text), message="bot was blocked by the user")
+            await registry.record(chat_id, error)
+            raise error
+        sent.append(chat_id)
+
+    async def scenario():
+        await storage.open()
+        await storage.add_users(range(1, 8))
+        engine = BroadcastEngine(storage, send, TokenBucket(1000), chunk_size=3)
+
+        # Рассылка прервалась после первой порции (user_id 1..3)
+        broadcast_id = await storage.create_broadcast("hello")
+        await storage.checkpoint_broadcast(broadcast_id, 3, sent=3)
+
+        await engine.resume()
+        await asyncio.gather(*engine._tasks.values())
+        result = await storage.get_broadcast(broadcast_id)
+        users = await storage.get_users()
+        reports = await storage.get_dead_reports()
+        await storage.close()
+        return result, users, reports
+
+    result, users, reports = asyncio.run(scenario())
+    assert sent == [5, 6, 7]
+    assert result["status"] == "completed"
+    assert result["sent"] == 6
+    assert result["removed"] == 1
+    assert 4 not in users
+    assert reports == [(4, "blocked")]
+
+
+def test_broadcast_cancelled_by_another_worker_stops_at_checkpoint(tmp_path):
+    db = str(tmp_path / "users.db")
+    leader_storage, other_storage = UserStorage(db), UserStorage(db)
+    sent = []
+
+    async def scenario():
+        await leader_storage.open()
+        await other_storage.open()
+        await leader_storage.add_users(range(1, 10))
+        leader = BroadcastEngine(leader_storage, None, TokenBucket(1000), chunk_size=3, poll_interval=0.01)
+        other = BroadcastEngine(other_storage, None, TokenBucket(1000), chunk_size=3)
+
+        async def send(chat_id, text, reply_markup=None):
+            sent.append(chat_id)
+            if chat_id == 2:
+                # Отмена пришла в воркер, который рассылку не ведёт
+                assert await other.cancel(broadcast_id)
+
+        leader.send_func = send
+        # Рассылку создаёт не владелец аренды, запускает владелец
+        broadcast_id = await other.start("hello")
+        assert not other._tasks
+        leader.watch()
+        while not sent:
+            await asyncio.sleep(0.01)
+        await asyncio.gather(*leader._tasks.values())
+        await leader.stop()
+        result = await leader_storage.get_broadcast(broadcast_id)
+        await leader_storage.close()
+        await other_storage.close()
+        return result
+
+    result = asyncio.run(scenario())
+    assert sent == [1, 2, 3]
+    assert result["status"] == "cancelled"
+
+
+def test_broadcast_waits_out_telegram_outage_without_skipping_users(tmp_path):
+    storage = UserStorage(str(tmp_path / "users.db"))
+    sent = []
+    outages = {"left": 2}
+
+    async def send(chat_id, text, reply_markup=None):
+        if chat_id in (2, 3) and outages["left"]:
+            outages["left"] -= 1
+            raise CircuitOpenError("telegram", 0.1)
+        sent.append(chat_id)
+
+    async def scenario():
+        await storage.open()
+        await storage.add_users(range(1, 6))
+        # Повторы на ошибку получателя отключены: отказ автомата их не расходует
+        engine = BroadcastEngine(storage, send, TokenBucket(1000), chunk_size=3, max_retries=0)
+        broadcast_id = await storage.create_broadcast("hello")
+        await engine.resume()
+        await asyncio.gather(*engine._tasks.values())
+        result = await storage.get_broadcast(broadcast_id)
+        await storage.close()
+        return result
+
+    result = asyncio.run(scenario())
+    # Автомат разомкнут: получатели порции дождались и получили сообщение ровно один раз
+    assert sorted(sent) == [1, 2, 3, 4, 5]
+    assert len(sent) == 5
+    assert result["status"] == "completed"
+    assert result["sent"] == 5
+    assert result["failed"] == 0
@@ -0,0 +1,95 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from circuit_breaker import (
+    CircuitBreaker, AdaptiveLimiter, UpstreamGuard, CircuitOpenError, ConcurrencyLimitError,
+    FAILURE, OK, telegram_outcome
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_rejects_and_recovers_after_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker("test", failure_rate=0.5, min_calls=4, window=10, open_timeout=5, clock=clock)
+    for failed in (False, True, False, True):
+        breaker.allow()
+        breaker.record(failed)
+    assert breaker.state == "open"
+
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.allow()
+    assert error.value.retry_after == 5
+
+    clock.now = 6
+    breaker.allow()
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()  # одна проба за раз
+    breaker.record(False)
+    assert breaker.state == "closed"
+    assert breaker.snapshot()["opened_count"] == 1
+
+
+def test_limiter_aimd_and_wait_timeout():
+    async def scenario():
+        limiter = AdaptiveLimiter("test", max_limit=4, latency_target=1.0, max_wait=0.01)
+        first = await limiter.acquire()
+        second = await limiter.acquire()
+        limiter.release(first, FAILURE)
+        assert limiter.limit == 2
+        # Запрос, начатый до снижения, не снижает лимит повторно
+        limiter.release(second, FAILURE)
+        assert limiter.limit == 2
+
+        started = await limiter.acquire()
+        limiter.release(started, OK)
+        assert limiter.limit == 2.5
+
+        held = [await limiter.acquire(), await limiter.acquire()]
+        with pytest.raises(ConcurrencyLimitError):
+            await limiter.acquire()
+        assert limiter.snapshot() == {"limit": 2, "inflight": 2, "waiting": 0}
+
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release(held[0], OK)
+        await waiter
+        assert limiter.inflight == 2
+
+    asyncio.run(scenario())
+
+
+def test_guard_classifies_exceptions():
+    async def scenario():
+        guard = UpstreamGuard(
+            CircuitBreaker("test", min_calls=2, failure_rate=0.5),
+            AdaptiveLimiter("test", max_limit=10),
+            telegram_outcome
+        )
+        with pytest.raises(ValueError):
+            async with guard.call():
+                raise ValueError("bad request")
+        assert guard.breaker.state == "closed"
+
+        with pytest.raises(asyncio.TimeoutError):
+            async with guard.call():
+                raise asyncio.TimeoutError()
+        assert guard.breaker.state == "open"
+        assert guard.limiter.inflight == 0
+        with pytest.raises(CircuitOpenError):
+            async with guard.call():
+                pass
+
+    asyncio.run(scenario())
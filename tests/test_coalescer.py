@@ -0,0 +1,61 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from circuit_breaker import CircuitOpenError
+from coalescer import NotificationCoalescer
+from models import OrderData
+
+
+def _order(order_id, price="1 000 ₽"):
+    return OrderData(
+        order_id=order_id, vehicle_type="Кран", location="Тверь", date_time="01.01.2024", price=price
+    )
+
+
+def test_coalescer_merges_window_and_flushes_on_max():
+    sent = []
+
+    async def flush(telegram_id, orders):
+        sent.append((telegram_id, [(order.order_id, order.price) for order in orders]))
+
+    async def scenario():
+        coalescer = NotificationCoalescer(flush, window=0.05, max_orders=3)
+        assert coalescer.add("1", _order("a")) == 1
+        assert coalescer.add("1", _order("a", price="2 000 ₽")) == 1
+        coalescer.add("1", _order("b"))
+        coalescer.add("2", _order("c"))
+        coalescer.add("2", _order("d"))
+        coalescer.add("2", _order("e"))
+        await asyncio.sleep(0)
+        assert sent == [("2", [("c", "1 000 ₽"), ("d", "1 000 ₽"), ("e", "1 000 ₽")])]
+
+        await asyncio.sleep(0.1)
+        assert sent[1] == ("1", [("a", "2 000 ₽"), ("b", "1 000 ₽")])
+
+        coalescer.add("3", _order("f"))
+        await coalescer.stop()
+        assert sent[2] == ("3", [("f", "1 000 ₽")])
+        assert coalescer.pending() == 0
+
+    asyncio.run(scenario())
+
+
+def test_coalescer_retries_failed_digest():
+    attempts = []
+
+    async def flush(telegram_id, orders):
+        attempts.append(telegram_id)
+        if len(attempts) < 3:
+            # Эндпоинт уже ответил 202: отказ автомата не должен терять сводку
+            raise CircuitOpenError("telegram", 0.01)
+
+    async def scenario():
+        coalescer = NotificationCoalescer(flush, window=0, max_orders=1, max_attempts=3)
+        coalescer.add("1", _order("a"))
+        await coalescer.stop()
+
+    asyncio.run(scenario())
+    assert attempts == ["1", "1", "1"]
@@ -0,0 +1,51 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramServerError
+from aiogram.methods import SendMessage
+
+from dead_recipients import DeadRecipientRegistry
+from laravel_client import LaravelResponse
+from storage import UserStorage
+
+
+class FakeLaravel:
+    """Не принимает пакетный формат, поштучные отчёты подтверждает"""
+
+    def __init__(self):
+        self.posts = []
+
+    async def post(self, path, json=None):
+        self.posts.append(json)
+        return LaravelResponse(status=422 if "telegram_ids" in json else 200)
+
+
+def test_dead_chats_are_disabled_and_reported(tmp_path):
+    storage = UserStorage(str(tmp_path / "users.db"))
+    laravel = FakeLaravel()
+    method = SendMessage(chat_id=1, text="x")
+
+    async def scenario():
+        await storage.open()
+        await storage.add_users([1, 2, 3])
+        registry = DeadRecipientRegistry(storage, laravel, batch_size=10)
+        reasons = [
+            await registry.record(1, TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")),
+            await registry.record(2, TelegramBadRequest(method=method, message="Bad Request: chat not found")),
+            await registry.record(3, TelegramServerError(method=method, message="Internal Server Error")),
+        ]
+        reported = await registry.flush()
+        states = sorted(await storage.get_user_states())
+        pending = await storage.get_dead_reports()
+        await storage.close()
+        return reasons, reported, states, pending
+
+    reasons, reported, states, pending = asyncio.run(scenario())
+    assert reasons == ["blocked", "chat_not_found", None]
+    assert reported == 2
+    assert states == [(1, 0, "blocked"), (2, 0, "chat_not_found"), (3, 1, None)]
+    assert pending == []
+    assert laravel.posts == [{"telegram_ids": ["1", "2"]}, {"telegram_id": "1"}, {"telegram_id": "2"}]
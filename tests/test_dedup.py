@@ -0,0 +1,35 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from dedup import IdempotencyCache
+
+
+def test_cache_survives_restart_and_purges_expired_keys(tmp_path):
+    db = str(tmp_path / "idempotency.db")
+
+    async def scenario():
+        cache = IdempotencyCache(db, ttl=60)
+        await cache.open()
+        await cache.store("k1", {"success": True}, 202)
+        await cache.close()
+
+        # После рестарта ответ берётся из SQLite
+        restarted = IdempotencyCache(db, ttl=60)
+        await restarted.open()
+        cached = await restarted.lookup("k1")
+
+        # Просроченная строка удаляется фоновой очисткой, а не только при старте
+        restarted.ttl = 0
+        restarted.purge_interval = 0.01
+        restarted.start()
+        await asyncio.sleep(0.05)
+        remaining = await restarted._run(lambda: restarted.conn.execute("SELECT COUNT(*) FROM idempotency").fetchone()[0])
+        await restarted.close()
+        return cached, remaining
+
+    cached, remaining = asyncio.run(scenario())
+    assert cached == ({"success": True}, 202)
+    assert remaining == 0
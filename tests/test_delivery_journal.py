@@ -0,0 +1,75 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from delivery_journal import DeliveryJournal
+from laravel_client import LaravelResponse
+from storage import UserStorage
+
+
+class FakeLaravel:
+    def __init__(self, status=200):
+        self.status = status
+        self.posts = []
+
+    async def post(self, path, json=None):
+        self.posts.append((path, json))
+        return LaravelResponse(status=self.status)
+
+
+def test_journal_writes_rows_and_reports_in_batches(tmp_path):
+    storage = UserStorage(str(tmp_path / "users.db"))
+    laravel = FakeLaravel(status=503)
+    journal = DeliveryJournal(storage, laravel, batch_size=2)
+
+    async def scenario():
+        await storage.open()
+        journal.record(1, "A-1", message_id=10, latency=0.12)
+        journal.record(2, "A-1", status="unreachable", latency=0.05, error="TelegramForbiddenError")
+        journal.record(3, "A-2", message_id=11, latency=0.2)
+
+        # Laravel недоступен: строки остаются неотправленными
+        assert await journal.flush() == 0
+        assert len(await storage.get_unreported_deliveries()) == 3
+
+        laravel.status = 200
+        assert await journal.flush() == 3
+        assert await storage.get_unreported_deliveries() == []
+        await storage.close()
+
+    asyncio.run(scenario())
+    batches = [payload["deliveries"] for _, payload in laravel.posts[1:]]
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert batches[0][0] == {
+        "telegram_id": "1", "order_id": "A-1", "message_id": 10, "status": "sent",
+        "latency_ms": 120, "error": None, "sent_at": batches[0][0]["sent_at"]
+    }
+    assert batches[0][1]["error"] == "TelegramForbiddenError"
+
+
+def test_follower_writes_journal_but_leaves_reporting_to_leader(tmp_path):
+    storage = UserStorage(str(tmp_path / "users.db"))
+    laravel = FakeLaravel()
+    leader = {"value": False}
+    journal = DeliveryJournal(storage, laravel, flush_interval=0.01, is_leader=lambda: leader["value"])
+
+    async def scenario():
+        await storage.open()
+        journal.start()
+        journal.record(1, "A-1", message_id=10)
+        await asyncio.sleep(0.05)
+        await journal.stop()
+        unreported = await storage.get_unreported_deliveries()
+
+        # Аренда перешла к этому процессу: отчёт уходит
+        leader["value"] = True
+        reported = await journal.flush()
+        await storage.close()
+        return unreported, reported
+
+    unreported, reported = asyncio.run(scenario())
+    assert len(unreported) == 1
+    assert reported == 1
+    assert len(laravel.posts) == 1
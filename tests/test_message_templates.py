@@ -0,0 +1,48 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from message_templates import TemplateRenderer, MAX_MESSAGE_LENGTH
+from models import OrderData
+
+
+def _order(**overrides):
+    fields = {
+        "order_id": "A/1",
+        "vehicle_type": "Экскаватор <JCB>",
+        "location": "Москва & область",
+        "date_time": "01.01.2024 10:00",
+        "price": "50 000 ₽",
+    }
+    fields.update(overrides)
+    return OrderData(**fields)
+
+
+def test_render_escapes_html_and_caches():
+    renderer = TemplateRenderer()
+    text, keyboard = renderer.render("new_order", _order())
+    assert "Экскаватор &lt;JCB&gt;" in text
+    assert "Москва &amp; область" in text
+    assert keyboard.inline_keyboard[0][0].url == "https://app.protonrent.ru/orders/A%2F1"
+
+    again = renderer.render("new_order", _order())
+    assert again[0] is text and again[1] is keyboard
+    assert renderer.cache_info().hits == 1
+
+
+def test_render_enforces_telegram_length_limit():
+    renderer = TemplateRenderer()
+    text, _ = renderer.render("order_cancelled", _order(location="&" * 5000))
+    assert len(text) <= MAX_MESSAGE_LENGTH
+    assert text.endswith("Заявка больше не актуальна.")
+
+
+def test_render_digest_lists_orders_and_fits_limit():
+    renderer = TemplateRenderer()
+    orders = [_order(order_id=str(i), location="Тверь " * 60) for i in range(1, 31)]
+    text, keyboard = renderer.render_digest(orders)
+    assert len(text) <= MAX_MESSAGE_LENGTH
+    assert "…и ещё" in text
+    assert len(keyboard.inline_keyboard) == 30
+    assert keyboard.inline_keyboard[0][0].url == "https://app.protonrent.ru/orders/1"
@@ -0,0 +1,35 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from metrics import Counter, Gauge, MultiprocessExporter, Registry
+
+
+def _registry(requests, depth):
+    registry = Registry()
+    registry.register(Counter("proton_requests_total", "Запросы", ("route",))).labels("/").inc(requests)
+    registry.register(Gauge("proton_depth", "Глубина")).set(depth)
+    return registry
+
+
+def test_exporter_merges_workers_under_one_header(tmp_path):
+    first = MultiprocessExporter(str(tmp_path), _registry(2, 5.0))
+    second = MultiprocessExporter(str(tmp_path), _registry(3, 5.0))
+    first.worker, second.worker = "1", "2"
+    first.path, second.path = str(tmp_path / "1.prom"), str(tmp_path / "2.prom")
+
+    async def scenario():
+        await second.render()
+        text = await first.render()
+        await second.stop()
+        return text, await first.render()
+
+    text, alone = asyncio.run(scenario())
+    assert text.count("# TYPE proton_requests_total counter") == 1
+    assert 'proton_requests_total{worker="1",route="/"} 2.0' in text
+    assert 'proton_requests_total{worker="2",route="/"} 3.0' in text
+    assert 'proton_depth{worker="2"} 5.0' in text
+    # Остановленный воркер больше не попадает в ответ
+    assert 'worker="2"' not in alone
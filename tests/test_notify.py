@@ -1,67 +1,17 @@
-import os
-import sys
-from pathlib import Path
+import asyncio
+import json
 import types
-import importlib
 
-# Добавляем корень репозитория в PYTHONPATH
-sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import httpx
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
 
-# Безопасные ENV для запуска приложения в тесте:
-# токен валидного формата (НЕ боевой), чтобы aiogram не падал на валидации
-os.environ["BOT_TOKEN"] = "123456:TEST"
-os.environ.setdefault("LARAVEL_API_BASE", "https://example.invalid")
-os.environ.setdefault("LARAVEL_BEARER_TOKEN", "test-token")
-os.environ.setdefault("NOTIFY_SECRET", "test-secret")
-
-def _safe_monkeypatch():
-    """Глушим внешние вызовы, чтобы тест не ходил в сеть/Telegram."""
-    # 1) requests
-    try:
-        import requests  # type: ignore
-        def _noop(self, method, url, *a, **kw):  # pragma: no cover
-            resp = requests.Response()
-            resp.status_code = 200
-            resp._content = b'{}'
-            resp.url = url
-            return resp
-        requests.Session.request = _noop  # type: ignore
-    except Exception:
-        pass
-
-    # 2) aiogram Bot.send_message
-    try:
-        from aiogram import Bot  # type: ignore
-        async def _fake_send_message(self, chat_id, text, *a, **kw):  # pragma: no cover
-            return types.SimpleNamespace(message_id=1)
-        Bot.send_message = _fake_send_message  # type: ignore
-    except Exception:
-        pass
-
-    # 3) функции в notify_api (если есть)
-    try:
-        notify_api = importlib.import_module("notify_api")
-        for name in ("send_notification", "send_message", "notify", "send_telegram_message"):
-            if hasattr(notify_api, name) and callable(getattr(notify_api, name)):
-                async def _noop_async(*a, **kw):  # pragma: no cover
-                    return {"status": "ok"}
-                setattr(notify_api, name, _noop_async)
-    except Exception:
-        pass
-
-
-def test_notify_ok():
-    _safe_monkeypatch()
-
-    import main  # в main должен быть app = FastAPI(...)
-    from fastapi.testclient import TestClient
-
-    assert hasattr(main, "app"), "В main.py должен быть объект app (FastAPI)"
-    client = TestClient(main.app)
 
+def test_notify_ok(client, auth_headers):
     # Новый формат данных для Laravel API
     payload = {
-        "telegram_id": 123456789, 
+        "telegram_id": 123456789,
         "order_data": {
             "order_id": "TEST-123",
             "vehicle_type": "Экскаватор",
@@ -70,9 +20,208 @@ def test_notify_ok():
             "price": "50 000 ₽"
         }
     }
-    
-    # Используем Bearer token из config
-    headers = {"Authorization": f"Bearer {os.getenv('LARAVEL_BEARER_TOKEN', 'test-token')}"}
-    r = client.post("/notify", json=payload, headers=headers)
+
+    r = client.post("/notify", json=payload, headers=auth_headers)
     assert r.status_code // 100 == 2, r.text
     assert r.headers.get("content-type", "").startswith("application/json")
+
+
+def test_notify_skips_unsubscribed_recipient(main_module, client, auth_headers, monkeypatch):
+    sent = []
+
+    async def _counting_send_message(self, chat_id, text, *a, **kw):
+        sent.append(chat_id)
+        return types.SimpleNamespace(message_id=len(sent))
+    monkeypatch.setattr(Bot, "send_message", _counting_send_message)
+    monkeypatch.setitem(main_module.subscribers.inactive, 424242, "unsubscribed")
+
+    r = client.post("/notify", json={
+        "telegram_id": "424242",
+        "order_data": {
+            "order_id": "TEST-SKIP", "vehicle_type": "Кран", "location": "Москва",
+            "date_time": "01.01.2026", "price": "1 ₽"
+        }
+    }, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    assert r.json()["data"]["skipped"] == "unsubscribed"
+    assert sent == []
+
+
+def test_notify_marks_blocked_chat_and_short_circuits(main_module, client, auth_headers, monkeypatch, tmp_path):
+    calls = []
+
+    async def _blocked_send_message(self, chat_id, text, *a, **kw):
+        calls.append(chat_id)
+        raise TelegramForbiddenError(method=SendMessage(chat_id=chat_id, text=text), message="Forbidden: bot was blocked by the user")
+    monkeypatch.setattr(Bot, "send_message", _blocked_send_message)
+
+    storage = main_module.user_storage
+    asyncio.run(storage.close())
+    monkeypatch.setattr(storage, "db_file", str(tmp_path / "users.db"))
+    payload = {
+        "telegram_id": "515151",
+        "order_data": {
+            "order_id": "TEST-DEAD", "vehicle_type": "Кран", "location": "Москва",
+            "date_time": "01.01.2026", "price": "1 ₽"
+        }
+    }
+    try:
+        first = client.post("/notify", json=payload, headers=auth_headers)
+        second = client.post("/notify", json=payload, headers=auth_headers)
+        reports = asyncio.run(storage.get_dead_reports())
+    finally:
+        main_module.subscribers.inactive.pop(515151, None)
+        # Соединение с временной базой закрываем до того, как monkeypatch вернёт db_file
+        asyncio.run(storage.close())
+    assert first.status_code == 410, first.text
+    assert second.status_code == 410
+    assert second.json()["data"]["skipped"] == "blocked"
+    assert len(calls) == 1
+    assert reports == [(515151, "blocked")]
+
+
+def test_notify_batch_fanout(client, auth_headers):
+    payload = {
+        "order_data": {
+            "order_id": "TEST-BATCH",
+            "vehicle_type": "Кран",
+            "location": "Казань",
+            "date_time": "01.01.2024 10:00",
+            "price": "80 000 ₽"
+        },
+        "telegram_ids": [111, "222", 111]
+    }
+
+    r = client.post("/notify/batch", json=payload, headers=auth_headers)
+    assert r.status_code == 200, r.text
+    data = r.json()["data"]
+    assert data["sent"] == 2
+    assert data["results"]["111"]["TEST-BATCH"]["status"] == "sent"
+    assert data["results"]["222"]["TEST-BATCH"]["status"] == "sent"
+
+
+def test_notify_webhook_replay_is_deduplicated(main_module, client, signed_headers, monkeypatch):
+    sent = []
+
+    async def _counting_send_message(self, chat_id, text, *a, **kw):
+        sent.append(chat_id)
+        return types.SimpleNamespace(message_id=len(sent))
+    monkeypatch.setattr(Bot, "send_message", _counting_send_message)
+
+    body = json.dumps({
+        "event_data": {
+            "telegram_id": "123456789",
+            "order_data": {"order_id": "TEST-IDEMP", "vehicle_type": "Кран"}
+        },
+        "correlation_id": "cid-1",
+        "idempotency_key": "idem-TEST-IDEMP"
+    }).encode()
+    headers = signed_headers(body)
+
+    first = client.post("/notify-webhook", content=body, headers=headers)
+    second = client.post("/notify-webhook", content=body, headers=headers)
+    assert first.status_code == 200, first.text
+    assert second.json() == first.json()
+    assert len(sent) == 1
+    assert main_module.idempotency_cache.stats()["hits"] >= 1
+
+
+def test_concurrent_notify_and_webhook_share_one_send(main_module, auth_headers, signed_headers, monkeypatch):
+    sent = []
+
+    async def _slow_send_message(self, chat_id, text, *a, **kw):
+        sent.append(chat_id)
+        await asyncio.sleep(0.05)
+        return types.SimpleNamespace(message_id=len(sent))
+    monkeypatch.setattr(Bot, "send_message", _slow_send_message)
+
+    body = json.dumps({
+        "event_data": {"telegram_id": "777001", "order_data": {"order_id": "TEST-FLIGHT", "vehicle_type": "Кран"}}
+    }).encode()
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=main_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(
+                client.post("/notify", json={
+                    "telegram_id": "777001",
+                    "order_data": {
+                        "order_id": "TEST-FLIGHT", "vehicle_type": "Кран", "location": "Москва",
+                        "date_time": "01.01.2026", "price": "1 ₽"
+                    }
+                }, headers=auth_headers),
+                client.post("/notify-webhook", content=body, headers=signed_headers(body))
+            )
+
+    notify, webhook = asyncio.run(scenario())
+    assert notify.status_code == 200, notify.text
+    assert webhook.status_code == 200, webhook.text
+    assert sent == ["777001"]
+    assert [r.json()["data"].get("shared") for r in (notify, webhook)].count(True) == 1
+
+
+def test_notify_webhook_rejects_bad_signature_structure_and_size(main_module, client, signed_headers):
+    def post(body: bytes, signature: str = None):
+        return client.post("/notify-webhook", content=body, headers=signed_headers(body, signature))
+
+    valid = json.dumps({"event_data": {"telegram_id": "1", "order_data": {"order_id": "X"}}}).encode()
+    assert post(valid, signature="0" * 64).status_code == 401
+    assert post(json.dumps({"event_data": {"telegram_id": "1"}}).encode()).status_code == 400
+    assert post(b"{" + b" " * main_module.EBOT_MAX_BODY_SIZE + b"}").status_code == 413
+
+
+def test_metrics_exposes_route_latency(client):
+    client.get("/")
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert "# TYPE proton_http_requests_total counter" in r.text
+    assert 'proton_http_requests_total{route="/",method="GET",status="200"}' in r.text
+    assert 'proton_http_request_duration_seconds_bucket{route="/",le="+Inf"}' in r.text
+
+
+def test_telegram_webhook_checks_secret_and_drops_redeliveries(main_module, client, monkeypatch):
+    fed = []
+
+    async def _fake_feed_update(bot, update, **kw):
+        fed.append(update.update_id)
+    monkeypatch.setattr(main_module.dp, "feed_update", _fake_feed_update)
+
+    update = {
+        "update_id": 900001,
+        "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "hi"}
+    }
+
+    r = client.post("/telegram/webhook", json=update, headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+    assert r.status_code == 401
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": main_module.TELEGRAM_WEBHOOK_SECRET}
+    assert client.post("/telegram/webhook", json=update, headers=headers).json() == {"ok": True}
+    assert client.post("/telegram/webhook", json=update, headers=headers).json() == {"ok": True}
+    assert fed == [900001]
+
+
+def test_order_edit_answers_within_budget_and_finishes_in_background(main_module, monkeypatch):
+    calls = []
+
+    async def slow_edit():
+        calls.append("slow")
+        await asyncio.sleep(0.1)
+        return {"messages": 300, "edited": 300}
+
+    async def quick_edit():
+        return {"messages": 1, "edited": 1}
+
+    async def scenario():
+        first = await main_module.run_order_edit(("update", "BIG", "text"), slow_edit)
+        # Повтор Laravel после таймаута присоединяется к идущей правке
+        retry = await main_module.run_order_edit(("update", "BIG", "text"), slow_edit)
+        background = await asyncio.gather(*main_module.order_edit_tasks)
+        quick = await main_module.run_order_edit(("update", "SMALL", "text"), quick_edit)
+        return first, retry, background, quick
+
+    monkeypatch.setattr(main_module, "NOTIFY_EDIT_TIMEOUT", 0.01)
+    first, retry, background, quick = asyncio.run(scenario())
+    assert first is None and retry is None
+    assert calls == ["slow"]
+    assert background == [{"messages": 300, "edited": 300}] * 2
+    assert quick == {"messages": 1, "edited": 1}
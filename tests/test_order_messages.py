@@ -0,0 +1,122 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import DeleteMessage, EditMessageText
+
+from delivery_journal import DeliveryJournal
+from order_messages import OrderMessageEditor
+from storage import UserStorage
+
+
+class FakeLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    async def acquire(self, tokens: float = 1.0):
+        self.acquired += 1
+
+
+class FakeBot:
+    """
+    Чат 2 удалил сообщение, чат 3 заблокировал бота, в чате 4 текст уже актуален,
+    в чате 6 Telegram не отвечает
+    """
+
+    def __init__(self):
+        self.edits = []
+        self.deleted = []
+
+    async def edit_message_text(self, text, chat_id, message_id, reply_markup=None, parse_mode=None):
+        method = EditMessageText(text=text, chat_id=chat_id, message_id=message_id)
+        if chat_id == 2:
+            raise TelegramBadRequest(method, "Bad Request: message to edit not found")
+        if chat_id == 3:
+            raise TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+        if chat_id == 4:
+            raise TelegramBadRequest(method, "Bad Request: message is not modified")
+        if chat_id == 6:
+            raise TimeoutError("request timed out")
+        self.edits.append((chat_id, message_id, text, reply_markup))
+
+    async def delete_message(self, chat_id, message_id):
+        if chat_id == 5:
+            raise TelegramBadRequest(
+                DeleteMessage(chat_id=chat_id, message_id=message_id), "Bad Request: message can't be deleted"
+            )
+        if chat_id == 6:
+            raise TimeoutError("request timed out")
+        self.deleted.append((chat_id, message_id))
+
+
+def test_journal_indexes_messages_without_waiting_for_flush(tmp_path):
+    storage = UserStorage(str(tmp_path / "users.db"))
+    journal = DeliveryJournal(storage, None, report_path=None)
+
+    async def scenario():
+        await storage.open()
+        await journal.index_message(1, "A-1", 10)
+        await journal.index_message(1, "A-1", 12)
+        await journal.index_message("@channel", "A-1", 20)
+        journal.record(1, "A-1", message_id=12)
+        # Индекс виден до сброса буфера журнала
+        messages = await storage.get_order_messages("A-1")
+        await storage.close()
+        return messages
+
+    # Повторная отправка в тот же чат заменяет message_id
+    assert asyncio.run(scenario()) == [(1, 12)]
+
+
+def test_update_edits_messages_and_drops_missing(tmp_path):
+    storage = UserStorage(str(tmp_path / "users.db"))
+    bot = FakeBot()
+    limiter = FakeLimiter()
+    dead = []
+
+    async def record_dead(chat_id, error):
+        dead.append(chat_id)
+
+    editor = OrderMessageEditor(storage, bot, limiter, concurrency=2, record_dead=record_dead)
+
+    async def scenario():
+        await storage.open()
+        await storage.add_deliveries([], [("A-1", chat_id, chat_id * 10, 0.0) for chat_id in (1, 2, 3, 4)])
+        summary = await editor.update("A-1", "new text", None)
+        messages = await storage.get_order_messages("A-1")
+        await storage.close()
+        return summary, messages
+
+    summary, messages = asyncio.run(scenario())
+    assert summary == {"messages": 4, "edited": 1, "missing": 1, "unreachable": 1, "unchanged": 1}
+    assert bot.edits == [(1, 10, "new text", None)]
+    assert dead == [3]
+    assert limiter.acquired == 4
+    assert messages == [(1, 10), (4, 40)]
+
+
+def test_cancel_deletes_with_edit_fallback_and_keeps_failed_in_index(tmp_path):
+    storage = UserStorage(str(tmp_path / "users.db"))
+    bot = FakeBot()
+    editor = OrderMessageEditor(storage, bot, FakeLimiter())
+
+    async def scenario():
+        await storage.open()
+        await storage.add_deliveries([], [("A-1", 1, 10, 0.0), ("A-1", 5, 50, 0.0), ("A-1", 6, 60, 0.0)])
+        summary = await editor.cancel("A-1", "cancelled", delete=True)
+        messages = await storage.get_order_messages("A-1")
+        retry = await editor.cancel("A-1", "cancelled")
+        await storage.close()
+        return summary, messages, retry
+
+    summary, messages, retry = asyncio.run(scenario())
+    assert summary == {"messages": 3, "deleted": 1, "edited": 1, "failed": 1}
+    assert bot.deleted == [(1, 10)]
+    # Старое сообщение не удалить: помечается отменённым без кнопки
+    assert bot.edits == [(5, 50, "cancelled", None)]
+    # Неудавшийся отзыв остаётся в индексе для повтора
+    assert messages == [(6, 60)]
+    assert retry == {"messages": 1, "failed": 1}
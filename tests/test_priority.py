@@ -0,0 +1,122 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from priority import PriorityScheduler, QueueDelayExceeded, INTERACTIVE, TRANSACTIONAL, BULK
+
+
+class ManualBucket:
+    """Бакет, в который токены кладёт тест"""
+
+    def __init__(self):
+        self.tokens = 0
+
+    def try_acquire(self, tokens=1.0):
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return 0.001
+
+
+def _scheduler(bucket, preemptible=True, max_delay=0.0):
+    scheduler = PriorityScheduler(bucket)
+    scheduler.add_lane(INTERACTIVE, 4)
+    scheduler.add_lane(TRANSACTIONAL, 2, max_delay=max_delay)
+    scheduler.add_lane(BULK, 1, preemptible=preemptible)
+    return scheduler
+
+
+async def _drain(bucket, order, count):
+    for _ in range(count):
+        bucket.tokens += 1
+        before = len(order)
+        while len(order) == before:
+            await asyncio.sleep(0.001)
+
+
+def test_bulk_is_preempted_and_lanes_share_by_weight():
+    async def scenario():
+        bucket = ManualBucket()
+        scheduler = _scheduler(bucket)
+        order = []
+
+        async def send(lane):
+            await scheduler.acquire(lane)
+            order.append(lane)
+
+        tasks = [asyncio.create_task(send(BULK)) for _ in range(3)]
+        tasks += [asyncio.create_task(send(TRANSACTIONAL)) for _ in range(3)]
+        tasks += [asyncio.create_task(send(INTERACTIVE)) for _ in range(6)]
+        await asyncio.sleep(0.01)
+        await _drain(bucket, order, 12)
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(scenario())
+    # Пока ждут срочные классы, рассылка не получает токенов
+    assert order[-3:] == [BULK] * 3
+    # interactive (вес 4) и transactional (вес 2) делят токены 2:1
+    assert order[:6].count(INTERACTIVE) == 4
+    assert order[:6].count(TRANSACTIONAL) == 2
+
+
+def test_wfq_without_preemption_and_max_delay():
+    async def scenario():
+        bucket = ManualBucket()
+        scheduler = _scheduler(bucket, preemptible=False, max_delay=0.01)
+        order = []
+
+        async def send(lane):
+            await scheduler.acquire(lane)
+            order.append(lane)
+
+        bulk = [asyncio.create_task(send(BULK)) for _ in range(2)]
+        stale = asyncio.create_task(send(TRANSACTIONAL))
+        await asyncio.sleep(0.03)
+        with pytest.raises(QueueDelayExceeded):
+            await stale
+        interactive = [asyncio.create_task(send(INTERACTIVE)) for _ in range(2)]
+        await asyncio.sleep(0.005)
+        await _drain(bucket, order, 4)
+        await asyncio.gather(*bulk, *interactive)
+        return order, scheduler.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert sorted(order) == sorted([BULK, BULK, INTERACTIVE, INTERACTIVE])
+    # Без вытеснения рассылка получает свою долю, а не ждёт конца срочных
+    assert BULK in order[:2]
+    assert stats[TRANSACTIONAL]["expired"] == 1
+
+
+def test_max_wait_caps_synchronous_callers():
+    async def scenario():
+        bucket = ManualBucket()
+        bucket.rate = 10
+        scheduler = _scheduler(bucket)
+
+        # Впереди 30 токенов при 10/с: ждать ~3 с, отказ без ожидания
+        queued = [asyncio.create_task(scheduler.acquire(TRANSACTIONAL)) for _ in range(30)]
+        await asyncio.sleep(0.005)
+        started = asyncio.get_running_loop().time()
+        with pytest.raises(QueueDelayExceeded) as shed:
+            await scheduler.acquire(TRANSACTIONAL, max_wait=2)
+        shed_after = asyncio.get_running_loop().time() - started
+        for task in queued:
+            task.cancel()
+        await asyncio.gather(*queued, return_exceptions=True)
+
+        # Оценка укладывается в max_wait, но токен так и не пришёл
+        with pytest.raises(QueueDelayExceeded) as timed_out:
+            await scheduler.acquire(TRANSACTIONAL, max_wait=0.02)
+        return shed.value, shed_after, timed_out.value, scheduler.stats()
+
+    shed, shed_after, timed_out, stats = asyncio.run(scenario())
+    assert shed_after < 0.01
+    assert shed.retry_after >= 3
+    assert timed_out.retry_after == 1
+    assert stats[TRANSACTIONAL]["expired"] == 2
+    assert stats[TRANSACTIONAL]["waiting"] == 0
@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from rate_limit import SharedTokenBucket
+
+
+def test_shared_bucket_is_common_for_instances(tmp_path):
+    path = str(tmp_path / "rate.bucket")
+    first = SharedTokenBucket(path, rate=1, capacity=2)
+    second = SharedTokenBucket(path, rate=1, capacity=2)
+
+    assert first.try_acquire() == 0
+    assert second.try_acquire() == 0
+    # Запас израсходован обоими экземплярами вместе
+    assert first.try_acquire() > 0
+    assert second.try_acquire() > 0
+
+    first.close()
+    second.close()
@@ -0,0 +1,98 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from pydantic import ValidationError
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from models import TelegramRegistration
+from phone import looks_like_phone, normalize_phone
+from registration import RegistrationCache
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("79161234567", "+79161234567"),
+    ("+7 916 123 45 67", "+79161234567"),
+    ("+375291234567", "+375291234567"),
+    # Контакт Telegram: код страны уже есть, 8… и 9… — не российские номера
+    ("84912345678", "+84912345678"),
+    ("85291234567", "+85291234567"),
+    ("9715012345678", "+9715012345678"),
+    ("919876543210", "+919876543210"),
+])
+def test_normalize_contact_phone(raw, expected):
+    assert normalize_phone(raw) == expected
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("8 (916) 123-45-67", "+79161234567"),
+    ("9161234567", "+79161234567"),
+    ("79161234567", "+79161234567"),
+    ("00 44 20 7946 0958", "+442079460958"),
+    # Не российский мобильный: 8 не считается префиксом выхода на межгород
+    ("84912345678", "+84912345678"),
+    ("85291234567", "+85291234567"),
+])
+def test_normalize_manual_phone(raw, expected):
+    assert normalize_phone(raw, manual=True) == expected
+
+
+@pytest.mark.parametrize("raw", ["", "12345", "+0123456789", "8916abc4567", "+1234567890123456"])
+def test_normalize_phone_rejects_invalid(raw):
+    with pytest.raises(ValueError):
+        normalize_phone(raw)
+
+
+def test_registration_model_normalizes_phone():
+    assert TelegramRegistration(phone="7-916-123-45-67", telegram_id=1).phone == "+79161234567"
+    assert TelegramRegistration(phone="84912345678", telegram_id=1).phone == "+84912345678"
+    with pytest.raises(ValidationError):
+        TelegramRegistration(phone="not a phone", telegram_id=1)
+
+
+def test_registration_model_rewrites_typed_phone():
+    typed = TelegramRegistration.model_validate(
+        {"phone": "8 (916) 123-45-67", "telegram_id": 1}, context={"manual": True}
+    )
+    assert typed.phone == "+79161234567"
+    # Тот же текст из контакта — уже с кодом страны (Вьетнам)
+    assert TelegramRegistration(phone="84912345678", telegram_id=1).phone == "+84912345678"
+    assert looks_like_phone("8 (916) 123-45-67")
+    assert looks_like_phone("+44 20 7946 0958")
+    assert not looks_like_phone("Привет")
+    assert not looks_like_phone("12345")
+
+
+def test_registration_cache_single_flight_and_ttl():
+    calls = []
+    now = [0.0]
+    active = set()
+
+    async def register(telegram_id, phone):
+        calls.append((telegram_id, phone))
+        await asyncio.sleep(0.01)
+        if phone.endswith("0"):
+            return 404
+        active.add(telegram_id)
+        return 200
+
+    cache = RegistrationCache(register, ttl=100, negative_ttl=10, is_active=active.__contains__, clock=lambda: now[0])
+
+    async def scenario():
+        first = await asyncio.gather(*(cache.register("1", "+79161234567") for _ in range(3)))
+        assert first == [(200, "laravel"), (200, "shared"), (200, "shared")]
+        assert await cache.register("1", "+79161234567") == (200, "cache")
+
+        # Отписка делает успешную запись недействительной
+        active.discard("1")
+        assert (await cache.register("1", "+79161234567"))[1] == "laravel"
+
+        assert await cache.register("2", "+79161234560") == (404, "laravel")
+        assert await cache.register("2", "+79161234560") == (404, "cache")
+        now[0] = 11
+        assert await cache.register("2", "+79161234560") == (404, "laravel")
+
+    asyncio.run(scenario())
+    assert len(calls) == 4
@@ -0,0 +1,67 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+from aiogram.methods import SendMessage
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from send_queue import SendQueue, SendDispatcher
+
+
+def test_queue_roundtrip_and_recovery(tmp_path):
+    queue = SendQueue(str(tmp_path / "queue.db"), stale_after=0)
+    keyboard = InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text="📋 Перейти к заявке", url="https://example.invalid/1")]]
+    )
+
+    async def scenario():
+        await queue.open()
+        job_ids = await queue.enqueue_many(["1", "2"], "hello", keyboard)
+        assert await queue.depth() == 2
+
+        jobs = await queue.claim(10)
+        assert [job.id for job in jobs] == job_ids
+        assert jobs[0].reply_markup.inline_keyboard[0][0].url == "https://example.invalid/1"
+        assert await queue.claim(10) == []
+
+        # После рестарта незавершённые задачи возвращаются в очередь
+        await queue.close()
+        await queue.open()
+        assert len(await queue.claim(10)) == 2
+        await queue.close()
+
+    asyncio.run(scenario())
+
+
+def test_dispatcher_honors_retry_after_and_permanent_errors(tmp_path):
+    queue = SendQueue(str(tmp_path / "queue.db"), stale_after=0)
+    calls = []
+    method = SendMessage(chat_id=1, text="x")
+
+    async def send(chat_id, text, reply_markup=None):
+        calls.append(chat_id)
+        if chat_id == "1" and calls.count("1") == 1:
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+        if chat_id == "2":
+            raise TelegramForbiddenError(method=method, message="bot was blocked by the user")
+
+    async def scenario():
+        await queue.open()
+        dispatcher = SendDispatcher(queue, send, global_rate=1000, chat_rate=1000, idle_interval=0.01)
+        ok_id = await queue.enqueue("1", "hello")
+        blocked_id = await queue.enqueue("2", "hello")
+        dispatcher.start()
+        for _ in range(200):
+            if await queue.depth() == 0:
+                break
+            await asyncio.sleep(0.01)
+        await dispatcher.stop()
+        statuses = (await queue.get(ok_id))["status"], (await queue.get(blocked_id))["status"]
+        await queue.close()
+        return statuses
+
+    assert asyncio.run(scenario()) == ("sent", "failed")
+    assert calls.count("1") == 2
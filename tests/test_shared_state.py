@@ -0,0 +1,140 @@
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from aiogram.fsm.storage.base import StorageKey
+
+from shared_state import (
+    StateBackend, SQLiteBackend, RedisBackend, BackendFSMStorage, LeaderLease, EXPIRE_IF_EQUAL, DELETE_IF_EQUAL
+)
+
+
+class FakeRedis:
+    """Локальная замена Redis с подмножеством команд, которое использует RedisBackend"""
+
+    def __init__(self):
+        self.data = {}
+
+    def _alive(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            entry = None
+        return entry
+
+    async def get(self, key):
+        entry = self._alive(key)
+        return entry[0].encode() if entry else None
+
+    async def set(self, key, value, nx=False, px=None):
+        if nx and self._alive(key):
+            return None
+        self.data[key] = (str(value), time.monotonic() + px / 1000 if px else None)
+        return True
+
+    async def delete(self, key):
+        return 1 if self.data.pop(key, None) else 0
+
+    async def eval(self, script, numkeys, key, value, *args):
+        entry = self._alive(key)
+        if entry is None or entry[0] != value:
+            return 0
+        if script == EXPIRE_IF_EQUAL:
+            self.data[key] = (entry[0], time.monotonic() + args[0] / 1000)
+            return 1
+        if script == DELETE_IF_EQUAL:
+            return await self.delete(key)
+        raise NotImplementedError(script)
+
+
+def _check_lease(backend):
+    async def scenario():
+        first = LeaderLease(backend, "webhook", ttl=0.3)
+        second = LeaderLease(backend, "webhook", ttl=0.3)
+        first.start()
+        await asyncio.sleep(0.05)
+        second.start()
+        await asyncio.sleep(0.2)
+        leaders = (first.is_leader, second.is_leader)
+        # Лидер останавливается и освобождает аренду, второй экземпляр её забирает
+        await first.stop()
+        await asyncio.sleep(0.25)
+        takeover = second.is_leader
+        await second.stop()
+        await backend.close()
+        return leaders, takeover
+
+    return asyncio.run(scenario())
+
+
+def test_leader_lease_sqlite(tmp_path):
+    leaders, takeover = _check_lease(SQLiteBackend(str(tmp_path / "state.db")))
+    assert leaders == (True, False)
+    assert takeover
+
+
+def test_leader_lease_redis_standin():
+    leaders, takeover = _check_lease(RedisBackend(FakeRedis()))
+    assert leaders == (True, False)
+    assert takeover
+
+
+def test_leader_lease_released_when_on_acquired_fails():
+    backend = RedisBackend(FakeRedis())
+
+    async def fail():
+        raise RuntimeError("webhook setup failed")
+
+    async def scenario():
+        lease = LeaderLease(backend, "jobs", ttl=30, on_acquired=fail)
+        lease.start()
+        await asyncio.sleep(0.05)
+        # Ключ свободен сразу, а не через TTL
+        owner = await backend.get(lease.key)
+        await lease.stop()
+        return lease.is_leader, owner
+
+    assert asyncio.run(scenario()) == (False, None)
+
+
+def test_fsm_storage_roundtrip():
+    storage = BackendFSMStorage(RedisBackend(FakeRedis()))
+    key = StorageKey(bot_id=1, chat_id=2, user_id=3)
+
+    async def scenario():
+        await storage.set_state(key, "Registration:phone")
+        await storage.update_data(key, {"phone": "+79990000000"})
+        return await storage.get_state(key), await storage.get_data(key)
+
+    assert asyncio.run(scenario()) == ("Registration:phone", {"phone": "+79990000000"})
+
+
+def test_sqlite_backend_sweeps_expired_keys(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "state.db"), sweep_interval=0)
+
+    async def scenario():
+        await backend.set_if_absent("update:1", "1", 0.01)
+        await backend.set("idem:a", "{}", 0.01)
+        await backend.set("lease:webhook", "owner")
+        await asyncio.sleep(0.02)
+        assert await backend.set_if_absent("update:2", "1", 60)
+        keys = await backend._run(lambda: [row[0] for row in backend.conn.execute("SELECT key FROM kv ORDER BY key")])
+        await backend.close()
+        return keys
+
+    # Просроченные строки удалены из файла, а не только скрыты при чтении
+    assert asyncio.run(scenario()) == ["lease:webhook", "update:2"]
+
+
+def test_incomplete_backend_fails_on_creation():
+    class GetOnlyBackend(StateBackend):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnlyBackend()
@@ -0,0 +1,42 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from storage import UserStorage
+
+
+def test_user_storage_bulk_and_wal(tmp_path):
+    storage = UserStorage(str(tmp_path / "users.db"))
+
+    async def scenario():
+        await storage.open()
+        await storage.add_users([3, 1, 2, 2])
+        await storage.remove_user(2)
+        users = await storage.get_users()
+        await storage.remove_users([1, 3])
+        rest = await storage.get_users()
+        mode = await storage.run(lambda: storage.conn.execute("PRAGMA journal_mode").fetchone()[0])
+        await storage.close()
+        return users, rest, mode
+
+    users, rest, mode = asyncio.run(scenario())
+    assert sorted(users) == [1, 3]
+    assert rest == []
+    assert mode == "wal"
+
+
+def test_sync_writes_notify_listeners(tmp_path):
+    storage = UserStorage(str(tmp_path / "users.db"))
+    events = []
+    storage.add_listener(lambda subscribed, unsubscribed, reason: events.append((subscribed, unsubscribed)))
+
+    # Путь старого bot.py: синхронная запись без event loop
+    storage.set_active_sync(subscribed=[1])
+    storage.set_active_sync(unsubscribed=[1])
+    users = storage.run_sync(storage._get_users)
+    storage.run_sync(storage._close)
+
+    assert events == [([1], []), ([], [1])]
+    assert users == []
@@ -0,0 +1,87 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from laravel_client import LaravelResponse
+from storage import UserStorage
+from subscribers import SubscriberIndex, SYNC_CURSOR_KEY
+
+
+class FakeLaravel:
+    """Отдаёт заранее заготовленные страницы изменений и запоминает курсоры"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.cursors = []
+
+    async def get(self, path, params=None):
+        self.cursors.append(params.get("since"))
+        return LaravelResponse(status=200, data={"success": True, "data": self.pages.pop(0)})
+
+
+def test_index_write_through_and_incremental_sync(tmp_path):
+    storage = UserStorage(str(tmp_path / "users.db"))
+    laravel = FakeLaravel([
+        {"changes": [{"telegram_id": 5, "active": True}, {"telegram_id": 2, "active": False}],
+         "next_cursor": "c1", "has_more": True},
+        {"changes": [{"telegram_id": "7", "active": False}], "next_cursor": "c2", "has_more": False},
+    ])
+
+    async def scenario():
+        await storage.open()
+        await storage.add_users([1, 2])
+        index = SubscriberIndex(storage, laravel)
+        await index.load()
+        assert index.is_subscribed(2)
+
+        await storage.remove_user(1)
+        assert index.is_unsubscribed(1) and not index.is_subscribed(1)
+        assert not index.is_unsubscribed(999)
+
+        assert await index.sync() == 3
+        cursor = await storage.get_meta(SYNC_CURSOR_KEY)
+
+        # После рестарта индекс восстанавливается из SQLite
+        restored = SubscriberIndex(storage)
+        await restored.load()
+        users = await storage.get_users()
+        await storage.close()
+        return index, restored, cursor, users
+
+    index, restored, cursor, users = asyncio.run(scenario())
+    assert laravel.cursors == [None, "c1"]
+    assert cursor == "c2"
+    assert index.is_subscribed(5) and index.is_unsubscribed(2) and index.is_unsubscribed(7)
+    assert restored.active == {5} and set(restored.inactive) == {1, 2, 7}
+    assert users == [5]
+
+
+def test_refresh_picks_up_changes_from_other_workers(tmp_path):
+    db = str(tmp_path / "users.db")
+    storage, other_worker = UserStorage(db), UserStorage(db)
+
+    async def scenario():
+        await storage.open()
+        await other_worker.open()
+        await storage.add_users([1, 2])
+        index = SubscriberIndex(storage)
+        await index.load()
+
+        # /stop и недоступный чат обработаны другим воркером: слушатель их не видит
+        await other_worker.remove_user(1)
+        await other_worker.mark_dead([2], "blocked")
+        await other_worker.add_user(3)
+        assert index.is_subscribed(1)
+
+        changed = await index.refresh()
+        await storage.close()
+        await other_worker.close()
+        return index, changed
+
+    index, changed = asyncio.run(scenario())
+    assert changed >= 3
+    assert index.inactive_reason(1) == "unsubscribed"
+    assert index.inactive_reason(2) == "blocked"
+    assert index.is_subscribed(3)
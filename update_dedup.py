@@ -0,0 +1,45 @@
+class UpdateIdWindow:
+    """
+    Скользящее окно последних update_id на битовом кольце фиксированного размера.
+    update_id от Telegram монотонно растут, поэтому всё, что старше окна,
+    считается уже обработанным
+    """
+
+    def __init__(self, size: int = 65536):
+        self.size = size
+        self._bits = bytearray((size + 7) // 8)
+        self.high = None
+
+    def _index(self, update_id: int):
+        position = update_id % self.size
+        return position >> 3, 1 << (position & 7)
+
+    def add(self, update_id: int) -> bool:
+        """Отмечает update_id; False, если он уже встречался (или старше окна)"""
+        if self.high is None:
+            self.high = update_id
+        elif update_id > self.high:
+            self._clear_range(self.high + 1, update_id)
+            self.high = update_id
+        elif update_id <= self.high - self.size:
+            return False
+
+        byte, mask = self._index(update_id)
+        if self._bits[byte] & mask:
+            return False
+        self._bits[byte] |= mask
+        return True
+
+    def discard(self, update_id: int):
+        """Снимает отметку, чтобы повторная доставка после ошибки была обработана"""
+        if self.high is not None and self.high - self.size < update_id <= self.high:
+            byte, mask = self._index(update_id)
+            self._bits[byte] &= ~mask & 0xFF
+
+    def _clear_range(self, start: int, end: int):
+        if end - start + 1 >= self.size:
+            self._bits = bytearray(len(self._bits))
+            return
+        for update_id in range(start, end + 1):
+            byte, mask = self._index(update_id)
+            self._bits[byte] &= ~mask & 0xFF
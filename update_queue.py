@@ -0,0 +1,71 @@
+import asyncio
+import itertools
+import logging
+
+from aiogram import types
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update: types.Update):
+    """Ключ упорядочивания: чат обновления, либо отправитель, если чата нет"""
+    event = update.event
+    chat = getattr(event, "chat", None)
+    if chat is None:
+        message = getattr(event, "message", None)
+        chat = getattr(message, "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user is not None else None
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь входящих обновлений Telegram с пулом воркеров.
+    Обновления одного чата всегда попадают к одному воркеру и обрабатываются по порядку
+    """
+
+    def __init__(self, process, workers: int = 8, maxsize: int = 1000):
+        self.process = process
+        self.workers = max(1, workers)
+        self._queues = [asyncio.Queue(max(1, maxsize // self.workers)) for _ in range(self.workers)]
+        self._round_robin = itertools.cycle(range(self.workers))
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+
+    async def stop(self, timeout: float = 10.0):
+        """Дожидается обработки принятых обновлений, затем останавливает воркеры"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Не обработано обновлений при остановке: {self.depth()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, update: types.Update) -> bool:
+        """Кладёт обновление в очередь без ожидания; False, если очередь переполнена"""
+        key = chat_key(update)
+        index = hash(key) % self.workers if key is not None else next(self._round_robin)
+        try:
+            self._queues[index].put_nowait(update)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.process(update)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки обновления {update.update_id}: {e}")
+            finally:
+                queue.task_done()